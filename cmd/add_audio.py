@@ -1,31 +1,44 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import os, sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
+import uploader
+import waiter
 
 ##########################################################################
 # Add an archive of audio files (wav files)
 # You can add multiple audio sources to an acousic model
+# The script waits until the service has processed the audio, since no other
+# audio can be added meanwhile (use --no-wait to return right away)
+# The audio is not sent again if it was already uploaded and has not changed
+# since (use --force to upload it anyway)
 ##########################################################################
 
 audio_filename = env.get_arg("audio filename")
 print("\nAdding audio source ...")
 
-headers = {'Content-Type' : "application/zip"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations/"+env.get_acoustic_id()+"/audio/"+audio_filename
-
-with open(audio_filename, 'rb') as f:
-   r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers, data=f)
-
-print("Adding audio source returns: ", r.status_code)
-if r.status_code != 201:
+audio_name = os.path.basename(audio_filename)
+client = stt_client.get_client()
+try:
+   result = uploader.upload_audio(client, env.get_acoustic_id(), audio_filename,
+                                  name=audio_name, force=env.has_option('--force'))
+except Exception as e:
    print("Failed to add audio source")
-   print(r.text)
+   print(e)
    sys.exit(-1)
-else:
+print("Adding audio source: ", result)
+
+if env.has_option('--no-wait'):
    sys.exit(0)
+
+print("Checking status of audio processing...")
+try:
+   waiter.wait_for_audio(client, env.get_acoustic_id(), audio_name,
+                         timeout=env.get_wait_timeout(),
+                         on_status=waiter.print_status)
+except waiter.WaitError as e:
+   print("Audio processing failed: ", e)
+   sys.exit(-1)
+
+print("Audio processing done!")
+sys.exit(0)
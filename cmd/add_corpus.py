@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
 import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import os, sys
 import env
+import stt_client
+import uploader
+import waiter
+import word_cache
 
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+client = stt_client.get_client()
 
 ##########################################################################
 # Step 1: Add a corpus file (plain text file)
+# The corpus is not sent again if it was already uploaded and has not changed
+# since (use --force to upload it anyway)
 ##########################################################################
 # 'dictation_fixed.txt' is name of local file containing the corpus to be uploaded
 # 'dictation-1' is the name of the new corpus
@@ -17,39 +20,33 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 #corpus_file = "dictation_fixed.txt"
 #corpus_name = "dictation-1"
 corpus_file = env.get_arg("corpus filename")
+corpus_name = os.path.basename(corpus_file)
 print("\nAdding corpus file: ", corpus_file)
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/corpora/"+corpus_file
-with open(corpus_file, 'rb') as f:
-   r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers, data=f)
-
-print("Adding corpus file returns: ", r.status_code)
-if r.status_code != 201:
+try:
+   result = uploader.upload_corpus(client, env.get_language_id(), corpus_file,
+                                   name=corpus_name, force=env.has_option('--force'))
+except Exception as e:
    print("Failed to add corpus file")
-   print(r.text)
+   print(e)
    sys.exit(-1)
+print("Adding corpus file: ", result)
 
 ##########################################################################
 # Step 2: Get status of corpus file just added.
 # After corpus is uploaded, there is some analysis done to extract OOVs.
 # You cannot upload a new corpus or words while this analysis is on-going so
-# we need to loop until the status becomes 'analyzed' for this corpus.
+# we need to wait until the status becomes 'analyzed' for this corpus.
 ##########################################################################
 print("Checking status of corpus analysis...")
 
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/corpora/"+corpus_file
-r = requests.get(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
-respJson = r.json()
-status = respJson['status']
-time_to_run = 10
-while (status != 'analyzed'):
-    time.sleep(10)
-    r = requests.get(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
-    respJson = r.json()
-    status = respJson['status']
-    print("status: ", status, "(", time_to_run, ")")
-    time_to_run += 10
+try:
+    waiter.wait_for_corpus(client, env.get_language_id(), corpus_name,
+                           timeout=env.get_wait_timeout(),
+                           on_status=waiter.print_status)
+except waiter.WaitError as e:
+    print("Corpus analysis failed: ", e)
+    sys.exit(-1)
 
 print("Corpus analysis done!")
 
@@ -60,12 +57,21 @@ print("Corpus analysis done!")
 ##########################################################################
 print("\nListing words...")
 
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/words?sort=count"
-r = requests.get(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+r = client.list_words(env.get_language_id(), sort="count")
 
 print("Listing words returns: ", r.status_code)
 file=codecs.open(env.get_language_id()+".OOVs.corpus", 'wb', 'utf-8')
 file.write(r.text)
 print("Words list from added corpus saved in file: ", env.get_language_id(), ".OOVs.corpus")
 
+##########################################################################
+# Step 4: update the local word cache used by predict_oovs.py: the words
+# of the corpus that are not in the list are known by the base model.
+##########################################################################
+if r.status_code == 200:
+    cache = word_cache.WordCache(env.get_language_id())
+    cache.set_words(r.json()['words'])
+    cache.learn_corpus(word_cache.count_words(corpus_file))
+    cache.save()
+
 sys.exit(0)
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import os, sys, time
+import wave
+from collections import namedtuple
+from multiprocessing import Pool
+import numpy as np
+import stt_client
+
+##########################################################################
+# Prepare audio before sending it to the service:
+# - decode the WAV file and mix it down to mono
+# - resample it to the rate of the model (8kHz for the narrowband models,
+#   16kHz for the broadband ones)
+# - find the speech with an energy based voice activity detector, trim the
+#   silence at both ends and shorten the long pauses
+# - encode it as WAV, or as FLAC or Ogg/Opus when the soundfile package is
+#   installed
+#
+# A file without any speech is rejected with NoSpeechError rather than
+# sent empty.  The parts of the file that are kept are returned with the
+# prepared audio, and restore_times converts the times of a recognition
+# result back to times in the original file.
+#
+# Less audio means fewer bytes on the wire and fewer billed minutes.  Run
+# this script on a set of files to see what would be saved:
+#
+#   python audio_prep.py ../data/Audio --encoding flac
+##########################################################################
+
+ENCODINGS = {
+    'wav': ('WAV', 'PCM_16', 'audio/wav'),
+    'flac': ('FLAC', 'PCM_16', 'audio/flac'),
+    'ogg': ('OGG', 'OPUS', 'audio/ogg;codecs=opus'),
+}
+EXTENSIONS = {'wav': '.wav', 'flac': '.flac', 'ogg': '.ogg'}
+
+FRAME_MS = 20
+# Frames this much louder than the noise floor are speech
+THRESHOLD_DB = 12.0
+# Frames quieter than this are never speech
+MIN_SPEECH_DB = -55.0
+# Silence kept around speech, and longest pause kept within it
+PADDING_MS = 200
+MAX_PAUSE_MS = 600
+
+# segments are the (start, end) times in seconds of the parts of the
+# original audio kept, or None without trimming
+Prepared = namedtuple('Prepared', 'data content_type rate duration_in duration_out '
+                                  'bytes_in bytes_out elapsed segments')
+
+
+class NoSpeechError(ValueError):
+    pass
+
+
+def model_rate(model):
+    return 8000 if 'Narrowband' in model else 16000
+
+
+##########################################################################
+# Decoding and resampling
+##########################################################################
+
+def read_wav(path):
+    # Returns the samples as float32 in [-1, 1], mixed down to mono, and
+    # the sample rate
+    with wave.open(path, 'rb') as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        data = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        samples = values.astype(np.float32) / (1 << 23)
+    else:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / (1 << 31)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _lowpass(samples, cutoff, taps=101):
+    # Windowed sinc filter, cutoff as a fraction of the sample rate
+    n = np.arange(taps) - (taps - 1) / 2.0
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode='same')
+
+
+def resample(samples, rate, target):
+    if rate == target or not len(samples):
+        return samples
+    try:
+        from math import gcd
+        from scipy.signal import resample_poly
+        common = gcd(rate, target)
+        return resample_poly(samples, target // common, rate // common).astype(np.float32)
+    except ImportError:
+        pass
+    # Without scipy: filter out what the target rate cannot represent, then
+    # interpolate linearly
+    if target < rate:
+        samples = _lowpass(samples, 0.45 * target / rate)
+    count = int(round(len(samples) * target / float(rate)))
+    positions = np.arange(count) * (rate / float(target))
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+##########################################################################
+# Voice activity detection
+##########################################################################
+
+def frame_energies(samples, rate, frame_ms=FRAME_MS):
+    # Energy in dB of every frame
+    size = max(1, rate * frame_ms // 1000)
+    count = len(samples) // size
+    frames = samples[:count * size].reshape(count, size)
+    power = np.mean(frames.astype(np.float64) ** 2, axis=1)
+    return 10 * np.log10(power + 1e-12), size
+
+
+def speech_segments(samples, rate, threshold_db=THRESHOLD_DB, padding_ms=PADDING_MS,
+                    max_pause_ms=MAX_PAUSE_MS):
+    # Returns the (start, end) sample offsets of the speech regions.  Frames
+    # above the noise floor (the 10th percentile of the frame energies) by
+    # threshold_db are speech; regions are padded, and regions separated
+    # by pauses shorter than max_pause_ms are merged.
+    energies, size = frame_energies(samples, rate)
+    if not len(energies):
+        return []
+    floor = np.percentile(energies, 10)
+    speech = energies > max(floor + threshold_db, MIN_SPEECH_DB)
+    padding = int(padding_ms / FRAME_MS)
+    if padding:
+        speech = np.convolve(speech, np.ones(2 * padding + 1), mode='same') > 0
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    segments = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        start, end = start * size, min(end * size, len(samples))
+        if segments and start - segments[-1][1] < rate * max_pause_ms // 1000:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    return segments
+
+
+def remove_silence(samples, rate, max_pause_ms=MAX_PAUSE_MS):
+    # Keep only the speech, with pauses of at most max_pause_ms between
+    # the regions.  Returns the samples kept and their (start, end) sample
+    # offsets.
+    segments = speech_segments(samples, rate, max_pause_ms=max_pause_ms)
+    if not segments:
+        return samples[:0], segments
+    return np.concatenate([samples[start:end] for start, end in segments]), segments
+
+
+def restore_times(result, segments):
+    # Returns the recognition result of trimmed audio with its times
+    # converted to times in the original audio: a time falls in the
+    # segment kept that contains it, and is shifted by the silence removed
+    # before the segment.  A word ending where a segment ends stays in it.
+    starts = np.array([start for start, _ in segments])
+    lengths = np.array([end - start for start, end in segments])
+    ends = np.cumsum(lengths)
+
+    def restore(time, side='right'):
+        i = min(int(np.searchsorted(ends, time, side)), len(ends) - 1)
+        return round(float(starts[i] + time - (ends[i] - lengths[i])), 2)
+
+    result = dict(result)
+    results = []
+    for r in result.get('results', []):
+        r = dict(r)
+        alternatives = []
+        for alternative in r.get('alternatives', []):
+            if 'timestamps' in alternative:
+                alternative = dict(alternative, timestamps=[
+                    [word, restore(start), restore(end, 'left')]
+                    for word, start, end in alternative['timestamps']])
+            alternatives.append(alternative)
+        r['alternatives'] = alternatives
+        if 'word_alternatives' in r:
+            r['word_alternatives'] = [
+                dict(w, start_time=restore(w['start_time']),
+                     end_time=restore(w['end_time'], 'left'))
+                for w in r['word_alternatives']]
+        results.append(r)
+    result['results'] = results
+    if 'speaker_labels' in result:
+        labels = []
+        for label in result['speaker_labels']:
+            label = dict(label)
+            label['from'], label['to'] = restore(label['from']), restore(label['to'], 'left')
+            labels.append(label)
+        result['speaker_labels'] = labels
+    return result
+
+
+##########################################################################
+# Encoding
+##########################################################################
+
+def check_encoding(encoding):
+    if encoding != 'wav':
+        try:
+            import soundfile
+        except ImportError:
+            raise RuntimeError("encoding as %s needs the soundfile package" % encoding)
+
+
+def encode(samples, rate, encoding='wav'):
+    # Returns the encoded bytes and their content type
+    check_encoding(encoding)
+    if encoding == 'wav':
+        pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(pcm.tobytes())
+        return buffer.getvalue(), ENCODINGS['wav'][2]
+    import soundfile
+    container, subtype, content_type = ENCODINGS[encoding]
+    buffer = io.BytesIO()
+    soundfile.write(buffer, samples, rate, format=container, subtype=subtype)
+    return buffer.getvalue(), content_type
+
+
+def prepare(path, model=stt_client.BASE_MODEL, encoding='wav', trim=True,
+            max_pause_ms=MAX_PAUSE_MS):
+    start = time.time()
+    samples, rate = read_wav(path)
+    duration_in = len(samples) / float(rate)
+    target = model_rate(model)
+    samples = resample(samples, rate, target)
+    segments = None
+    if trim:
+        samples, segments = remove_silence(samples, target, max_pause_ms)
+        if not segments:
+            raise NoSpeechError("no speech found")
+        segments = [(float(start) / target, float(end) / target) for start, end in segments]
+    data, content_type = encode(samples, target, encoding)
+    return Prepared(data, content_type, target, duration_in, len(samples) / float(target),
+                    os.path.getsize(path), len(data), time.time() - start, segments)
+
+
+def _prepare_file(job):
+    path, output, options = job
+    try:
+        prepared = prepare(path, **options)
+    except Exception as e:
+        return path, None, e
+    if output:
+        with open(output + '.tmp', 'wb') as f:
+            f.write(prepared.data)
+        os.replace(output + '.tmp', output)
+    return path, prepared._replace(data=None), None
+
+
+def prepare_files(paths, output_dir=None, workers=None, **options):
+    # Prepares the files on all CPU cores, yielding (path, Prepared without
+    # the data, exception) in the order of the paths.  With output_dir, the
+    # prepared audio is written there under the same base name.
+    extension = EXTENSIONS[options.get('encoding', 'wav')]
+    jobs = []
+    for path in paths:
+        output = None
+        if output_dir:
+            output = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + extension)
+        jobs.append((path, output, options))
+    with Pool(workers) as pool:
+        for result in pool.imap(_prepare_file, jobs):
+            yield result
+
+
+def _saved(before, after):
+    return 100.0 * (before - after) / before if before else 0.0
+
+
+def main(argv=None):
+    import transcribe
+    parser = argparse.ArgumentParser(description="Prepare audio files for the service")
+    parser.add_argument('audio', help="audio file, directory, glob pattern or manifest")
+    parser.add_argument('--encoding', choices=sorted(ENCODINGS), default='wav')
+    parser.add_argument('--model', default=stt_client.BASE_MODEL,
+                        help="model whose sample rate to use")
+    parser.add_argument('--no-trim', action='store_true', help="keep the silences")
+    parser.add_argument('--max-pause', type=int, default=MAX_PAUSE_MS,
+                        help="longest pause kept within speech, in ms")
+    parser.add_argument('--output-dir', help="write the prepared files to this directory")
+    parser.add_argument('--workers', type=int, help="number of processes")
+    args = parser.parse_args(argv)
+    try:
+        check_encoding(args.encoding)
+    except RuntimeError as e:
+        print(e)
+        return -1
+
+    if os.path.isfile(args.audio) and args.audio.lower().endswith('.wav'):
+        paths = [args.audio]
+    else:
+        paths = transcribe.collect_audio_files(args.audio)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    totals = np.zeros(5)
+    failed = 0
+    start = time.time()
+    for path, prepared, error in prepare_files(paths, args.output_dir, args.workers,
+                                               model=args.model, encoding=args.encoding,
+                                               trim=not args.no_trim, max_pause_ms=args.max_pause):
+        if error:
+            failed += 1
+            print("FAILED  %s: %s" % (path, error))
+            continue
+        print("%s: %.1fs -> %.1fs of audio, %d -> %d bytes (%.0f%%)"
+              % (path, prepared.duration_in, prepared.duration_out, prepared.bytes_in,
+                 prepared.bytes_out, 100.0 * prepared.bytes_out / max(prepared.bytes_in, 1)))
+        totals += (prepared.duration_in, prepared.duration_out, prepared.bytes_in,
+                   prepared.bytes_out, prepared.elapsed)
+    elapsed = time.time() - start
+    print("\n%d files prepared, %d failed in %.1fs (%.1fs of processing)"
+          % (len(paths) - failed, failed, elapsed, totals[4]))
+    print("Audio:  %.1f -> %.1f minutes (%.0f%% saved)"
+          % (totals[0] / 60, totals[1] / 60, _saved(totals[0], totals[1])))
+    print("Bytes:  %.1f -> %.1f MB (%.0f%% saved)"
+          % (totals[2] / 1e6, totals[3] / 1e6, _saved(totals[2], totals[3])))
+    return -1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+import argparse
+import contextlib
+import json
+import os, sys, time
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import audio_prep
+import env
+import mock_server
+import stt_client
+import uploader
+import waiter
+
+##########################################################################
+# Throughput and latency of the operations of the scripts, at several
+# levels of concurrency.
+#
+# By default the operations run against a mock service started in this
+# process (see mock_server.py), whose latency, processing times and
+# throttling are set with the same options as mock_server.py.  With
+# --endpoint, they run against another server, with the credentials of
+# USERNAME and PASSWORD; the operations that create resources delete
+# them when they are done.
+#
+#   python benchmark.py --latency 0.05 --concurrency 1,8,32
+#   python benchmark.py --operations recognize,stream --requests 500
+#
+# With --startup, the commands of stt.py are timed instead, each run
+# --repeat times in a new interpreter and --repeat times within one
+# 'stt.py batch' process, to measure what starting the interpreter,
+# importing the modules and connecting cost per command.
+##########################################################################
+
+CORPUS_TEXT = ("the patient was given metoprolol and lisinopril for hypertension "
+               "and atorvastatin for hyperlipidemia\n") * 200
+
+
+def _check(r, expected=200):
+    if r.status_code != expected:
+        raise RuntimeError("%s %s returns %d: %s" % (r.request.method, r.request.path_url,
+                                                     r.status_code, r.text))
+    return r
+
+
+def make_fixtures(directory, audio_seconds):
+    # A corpus and a WAV file of audio_seconds of tones and pauses
+    corpus = os.path.join(directory, 'corpus.txt')
+    with open(corpus, 'w') as f:
+        f.write(CORPUS_TEXT)
+    rate = 8000
+    t = np.arange(int(audio_seconds * rate)) / float(rate)
+    samples = 0.3 * np.sin(2 * np.pi * 440 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+    audio = os.path.join(directory, 'audio.wav')
+    with open(audio, 'wb') as f:
+        f.write(audio_prep.encode(samples.astype(np.float32), rate)[0])
+    return corpus, audio
+
+
+##########################################################################
+# Operations
+#
+# Each one is a function of (client, fixtures) doing what a script does,
+# and raising an exception when it fails.
+##########################################################################
+
+def _language_model(client):
+    r = _check(client.create_language_model('benchmark'), 201)
+    return r.json()['customization_id']
+
+
+def op_list_models(client, fixtures):
+    _check(client.list_models())
+
+
+def op_get_language_model(client, fixtures):
+    _check(client.get_language_model(fixtures['language_id']))
+
+
+def op_list_words(client, fixtures):
+    _check(client.list_words(fixtures['language_id'], sort='count'))
+
+
+def op_recognize(client, fixtures):
+    with open(fixtures['audio'], 'rb') as f:
+        _check(client.recognize(f, timestamps=True, word_confidence=True))
+
+
+def op_stream(client, fixtures):
+    import streaming
+    ws = streaming.connect()
+    try:
+        streaming.recognize_stream(ws, fixtures['audio'])
+    finally:
+        ws.close()
+
+
+def op_add_corpus(client, fixtures):
+    # add_corpus.py: upload the corpus and wait for its analysis
+    language_id = _language_model(client)
+    try:
+        uploader.upload_corpus(client, language_id, fixtures['corpus'])
+        waiter.wait_for_corpus(client, language_id, 'corpus.txt',
+                               initial_delay=fixtures['poll'])
+    finally:
+        client.delete_language_model(language_id)
+
+
+def op_train_language_model(client, fixtures):
+    # add_corpus.py then train_language_model.py on a new model
+    language_id = _language_model(client)
+    try:
+        uploader.upload_corpus(client, language_id, fixtures['corpus'])
+        waiter.wait_for_corpus(client, language_id, 'corpus.txt',
+                               initial_delay=fixtures['poll'])
+        _check(client.train_language_model(language_id))
+        waiter.wait_for_language_model(client, language_id, initial_delay=fixtures['poll'])
+    finally:
+        client.delete_language_model(language_id)
+
+
+def op_add_audio(client, fixtures):
+    # add_audio.py: upload the audio and wait until it is processed
+    r = _check(client.create_acoustic_model('benchmark'), 201)
+    acoustic_id = r.json()['customization_id']
+    try:
+        uploader.upload_audio(client, acoustic_id, fixtures['audio'])
+        waiter.wait_for_audio(client, acoustic_id, 'audio.wav', initial_delay=fixtures['poll'])
+    finally:
+        client.delete_acoustic_model(acoustic_id)
+
+
+OPERATIONS = [
+    ('list_models', op_list_models),
+    ('get_language_model', op_get_language_model),
+    ('list_words', op_list_words),
+    ('recognize', op_recognize),
+    ('stream', op_stream),
+    ('add_corpus', op_add_corpus),
+    ('add_audio', op_add_audio),
+    ('train_language_model', op_train_language_model),
+]
+
+
+# Commands of stt.py timed by --startup; 'help' only starts stt.py.  The
+# benchmark models are not trained, so the audio is transcribed with the
+# base models.
+STARTUP_COMMANDS = ['--help', 'list-models', 'list-lm', 'list-corpus', 'list-am',
+                    'list-audio', 'LANGUAGE_ID= ACOUSTIC_ID= transcribe --no-cache {audio}']
+
+
+##########################################################################
+# Measures
+##########################################################################
+
+def run_operation(operation, client, fixtures, requests, concurrency):
+    # Returns the latencies of the successful calls, the number of failed
+    # calls and the wall time
+    def call(_):
+        start = time.time()
+        try:
+            operation(client, fixtures)
+        except Exception as e:
+            return None, str(e)
+        return time.time() - start, None
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests)))
+    elapsed = time.time() - start
+    latencies = [latency for latency, _ in results if latency is not None]
+    errors = [error for _, error in results if error is not None]
+    return latencies, errors, elapsed
+
+
+def summarize(name, concurrency, latencies, errors, elapsed):
+    row = {'operation': name, 'concurrency': concurrency,
+           'calls': len(latencies) + len(errors), 'errors': len(errors),
+           'throughput': len(latencies) / elapsed if elapsed else 0.0}
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        row.update(p50_ms=p50, p95_ms=p95, p99_ms=p99, max_ms=max(latencies) * 1000)
+    if errors:
+        row['first_error'] = errors[0]
+    return row
+
+
+def startup_benchmark(client, fixtures, repeat):
+    import stt
+    acoustic = _check(client.create_acoustic_model('benchmark'), 201).json()
+    environ = dict(os.environ, LANGUAGE_ID=fixtures['language_id'],
+                   ACOUSTIC_ID=acoustic['customization_id'])
+
+    def timed(argv, script=None):
+        # Leading NAME=value arguments are set in the environment, as in
+        # a batch script
+        variables = dict(environ)
+        while argv and stt._assignment(argv[0]):
+            name, value = argv.pop(0).split('=', 1)
+            variables[name] = value
+        start = time.time()
+        p = subprocess.run([sys.executable, stt.__file__] + argv, input=script, env=variables,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           universal_newlines=True)
+        return time.time() - start, p.returncode
+
+    rows = []
+    print("%-36s %12s %12s" % ('command', 'process ms', 'batch ms'))
+    try:
+        for command in STARTUP_COMMANDS:
+            line = command.format(**fixtures)
+            runs = [timed(line.split()) for _ in range(repeat)]
+            errors = sum(1 for _, code in runs if code)
+            process = sum(elapsed for elapsed, _ in runs) / repeat
+            if command == '--help':
+                batch = None
+            else:
+                elapsed, code = timed(['batch', '-'], (line + '\n') * repeat)
+                batch = elapsed / repeat
+                errors += bool(code)
+            rows.append({'command': line, 'process_ms': process * 1000,
+                         'batch_ms': batch * 1000 if batch is not None else None,
+                         'errors': errors})
+            label = ' '.join(t for t in line.split() if not stt._assignment(t))
+            print("%-36s %12.1f %12s" % (label[:36], process * 1000,
+                                         '%.1f' % (batch * 1000) if batch is not None else '-'))
+    finally:
+        client.delete_acoustic_model(acoustic['customization_id'])
+    return rows
+
+
+def print_row(row):
+    if 'p50_ms' in row:
+        print("%-22s %5d %6d %6d %9.1f %9.1f %9.1f %9.1f %9.1f"
+              % (row['operation'], row['concurrency'], row['calls'], row['errors'],
+                 row['throughput'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['max_ms']))
+    else:
+        print("%-22s %5d %6d %6d       all calls failed"
+              % (row['operation'], row['concurrency'], row['calls'], row['errors']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the operations of the scripts")
+    parser.add_argument('--endpoint', help="run against this server instead of a local mock")
+    parser.add_argument('--operations', default=','.join(name for name, _ in OPERATIONS),
+                        help="comma separated operations (default: all)")
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help="comma separated numbers of concurrent calls")
+    parser.add_argument('--requests', type=int, default=100,
+                        help="calls per operation and level of concurrency")
+    parser.add_argument('--audio-length', type=float, default=10.0,
+                        help="seconds of audio recognized and uploaded")
+    parser.add_argument('--poll', type=float, default=0.1,
+                        help="first delay of the status polling, in seconds")
+    parser.add_argument('--startup', action='store_true',
+                        help="time the startup of the commands of stt.py instead")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="runs of every command with --startup")
+    parser.add_argument('--report', help="write the measures to this JSON file")
+    mock_server.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    operations = dict(OPERATIONS)
+    names = [name.strip() for name in args.operations.split(',') if name.strip()]
+    unknown = [name for name in names if name not in operations]
+    if unknown:
+        print("Unknown operations: %s (choose from %s)"
+              % (', '.join(unknown), ', '.join(operations)))
+        return -1
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    directory = tempfile.mkdtemp(prefix='stt-benchmark-')
+    # The upload manifests of the benchmark models are kept apart
+    os.environ['STT_CACHE_DIR'] = directory
+    server = None
+    if args.endpoint:
+        endpoint, username, password = args.endpoint, env.get_username(), env.get_password()
+    else:
+        server = mock_server.start(**mock_server.service_options(args))
+        endpoint, username, password = server.url, 'mock', 'mock'
+        os.environ.update(STT_ENDPOINT=endpoint, USERNAME=username, PASSWORD=password,
+                          STT_WS_ENDPOINT=endpoint.replace('http://', 'ws://'))
+    client = stt_client.SpeechClient(endpoint, username, password, pool_size=max(levels),
+                                     timeout=env.get_timeout(),
+                                     max_retries=env.get_max_retries())
+
+    rows = []
+    fixtures = {'poll': args.poll}
+    devnull = open(os.devnull, 'w')
+    try:
+        fixtures['corpus'], fixtures['audio'] = make_fixtures(directory, args.audio_length)
+        if args.startup or set(names) & set(['get_language_model', 'list_words']):
+            fixtures['language_id'] = _language_model(client)
+            with contextlib.redirect_stdout(devnull):
+                uploader.upload_corpus(client, fixtures['language_id'], fixtures['corpus'])
+            waiter.wait_for_corpus(client, fixtures['language_id'], 'corpus.txt',
+                                   initial_delay=args.poll)
+
+        if args.startup:
+            rows = startup_benchmark(client, fixtures, args.repeat)
+            names = []
+        else:
+            print("%-22s %5s %6s %6s %9s %9s %9s %9s %9s"
+                  % ('operation', 'conc', 'calls', 'errors', 'ops/s', 'p50 ms', 'p95 ms',
+                     'p99 ms', 'max ms'))
+        for name in names:
+            for concurrency in levels:
+                # The uploads report their progress, which is not measured
+                with contextlib.redirect_stdout(devnull):
+                    measures = run_operation(operations[name], client, fixtures,
+                                             args.requests, concurrency)
+                row = summarize(name, concurrency, *measures)
+                rows.append(row)
+                print_row(row)
+    finally:
+        if 'language_id' in fixtures:
+            client.delete_language_model(fixtures['language_id'])
+        devnull.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for row in rows:
+        if 'first_error' in row:
+            print("%s: %s" % (row['operation'], row['first_error']))
+        elif row['errors'] and 'command' in row:
+            print("%s: %d runs failed" % (row['command'], row['errors']))
+    if server:
+        service = server.service
+        print("\nMock service: %d requests, %d answered 429"
+              % (service.requests, service.throttled))
+        server.shutdown()
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(rows, f, indent=1)
+    return -1 if any(row['errors'] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
 
 ##########################################################################
 # Create a new custom acoustic model
@@ -15,11 +10,9 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 model_name = env.get_arg("acoustic model name")
 print("\nCreate a new acoustic custom model: "+model_name)
 
-headers = {'Content-Type' : "application/json"}
-data = {"name" : model_name, "base_model_name" : "en-US_NarrowbandModel", "description" : "My narrowband acoustic model"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations"
-jsonObject = json.dumps(data).encode('utf-8')
-resp = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers, data=jsonObject)
+client = stt_client.get_client()
+resp = client.create_acoustic_model(model_name, base_model_name="en-US_NarrowbandModel",
+                                    description="My narrowband acoustic model")
 
 print("Create acoustic models returns: ", resp.status_code)
 if resp.status_code != 201:
@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
 
 ##########################################################################
 # Delete a custom acoustic model
@@ -14,9 +9,8 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 print("\nDeleting custom acoustic models...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations/"+env.get_acoustic_id()
-resp = requests.delete(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+resp = client.delete_acoustic_model(env.get_acoustic_id())
 
 print("Delete acoustic models returns: ", resp.status_code)
 if resp.status_code != 200:
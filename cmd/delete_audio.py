@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
 
 
 ##########################################################################
@@ -16,9 +11,8 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 print("\nDeleting audio source ...")
 
 audio_name = env.get_arg("name of audio source")
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations/"+env.get_acoustic_id()+"/audio/"+audio_name
-r = requests.delete(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+r = client.delete_audio(env.get_acoustic_id(), audio_name)
 
 print("Delete audio source returns: ", r.status_code)
 if r.status_code != 200:
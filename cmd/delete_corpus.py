@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
 
 ##########################################################################
 # Delete a corpus file from a custom language model
@@ -16,9 +11,8 @@ corpusName = env.get_arg("corpus filename")
 
 print("\nDeleting corpus ...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/corpora/"+corpusName
-r = requests.delete(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+r = client.delete_corpus(env.get_language_id(), corpusName)
 
 print("Delete corpus returns: ", r.status_code)
 if r.status_code != 200:
@@ -57,6 +57,10 @@ def get_acoustic_id ():
         sys.exit(-1)
 
 
+def has_option(option):
+    return option in sys.argv[1:]
+
+
 def get_arg(help_string):
     if len(sys.argv)==1:
         print("Please specify ", help_string)
@@ -65,3 +69,61 @@ def get_arg(help_string):
         return str(sys.argv[1])
 
 
+##########################################################################
+# Optional tuning of the HTTP connection pool shared by the scripts.
+# o STT_POOL_SIZE: number of keep-alive connections kept per host
+# o STT_CONNECT_TIMEOUT / STT_READ_TIMEOUT: timeouts in seconds
+# o STT_MAX_RETRIES: retries on connection errors, 429 and 5xx responses
+##########################################################################
+
+def get_pool_size():
+    return int(os.environ.get('STT_POOL_SIZE', 10))
+
+
+def get_timeout():
+    return (float(os.environ.get('STT_CONNECT_TIMEOUT', 10)),
+            float(os.environ.get('STT_READ_TIMEOUT', 300)))
+
+
+def get_max_retries():
+    return int(os.environ.get('STT_MAX_RETRIES', 5))
+
+
+##########################################################################
+# Maximum time in seconds to wait for a corpus, an audio resource or a
+# training job to complete (STT_WAIT_TIMEOUT, default 6 hours).
+##########################################################################
+
+def get_wait_timeout():
+    return float(os.environ.get('STT_WAIT_TIMEOUT', 6 * 3600))
+
+
+##########################################################################
+# Directory where the scripts keep their local caches (STT_CACHE_DIR,
+# default ~/.cache/stt-custom-model)
+##########################################################################
+
+def get_cache_dir(name):
+    base = os.environ.get('STT_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'stt-custom-model'))
+    path = os.path.join(base, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+##########################################################################
+# Maximum size in MB of the transcript cache (STT_TRANSCRIPT_CACHE_MB,
+# default 500)
+##########################################################################
+
+def get_transcript_cache_size():
+    return int(float(os.environ.get('STT_TRANSCRIPT_CACHE_MB', 500)) * 1024 * 1024)
+
+
+##########################################################################
+# Metrics of the requests to the service (STT_METRICS, see metrics.py):
+# a .prom or .jsonl file name, or any other value for a summary at exit
+##########################################################################
+
+def get_metrics():
+    return os.environ.get('STT_METRICS')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os, re, sys, time
+from concurrent.futures import ThreadPoolExecutor
+import env
+import stt_client
+import transcribe
+import transcript_cache
+
+##########################################################################
+# Measure the Word Error Rate and Character Error Rate of the held-out
+# audio files, by comparing their transcripts with the reference documents
+# (Audio/N.wav is compared with Documents/N.txt).
+#
+# The test set is transcribed with the base models, with the custom
+# language model (LANGUAGE_ID) and with the custom language and acoustic
+# models (ACOUSTIC_ID), so the gain of each customization can be seen.
+# The results are kept in the transcript cache (transcript_cache.py), so
+# evaluating again after a retrain only transcribes with the models that
+# changed.
+#
+# The edit distances are computed with a bit-parallel algorithm, fast
+# enough to align thousands of documents, word by word and character by
+# character, in seconds.
+##########################################################################
+
+CONFIGURATIONS = ('base', 'lm', 'lm+am')
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+# Output by the service for the pauses of the speaker
+HESITATION = '%hesitation'
+
+
+def normalize(text):
+    return TOKEN_RE.findall(text.lower().replace(HESITATION, ' '))
+
+
+##########################################################################
+# Edit distance
+##########################################################################
+
+def edit_distance(reference, hypothesis):
+    # Levenshtein distance between two sequences of words or characters,
+    # with the bit-parallel algorithm of Myers (1999): the differences
+    # between consecutive cells of a column of the alignment matrix are
+    # kept as bits of Python integers, so the whole column is updated with
+    # a few integer operations for every reference token.
+    m = len(hypothesis)
+    if not m:
+        return len(reference)
+    match = {}
+    for j, token in enumerate(hypothesis):
+        match[token] = match.get(token, 0) | (1 << j)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    positive, negative, distance = mask, 0, m
+    for token in reference:
+        eq = match.get(token, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        ph = negative | (~(xh | positive) & mask)
+        mh = positive & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = mh << 1
+        positive = (mh | ~(xv | ph)) & mask
+        negative = ph & xv
+    return distance
+
+
+def error_counts(reference, hypothesis):
+    # (word errors, reference words, char errors, reference chars)
+    ref_words, hyp_words = normalize(reference), normalize(hypothesis)
+    ref_chars, hyp_chars = ' '.join(ref_words), ' '.join(hyp_words)
+    return (edit_distance(ref_words, hyp_words), len(ref_words),
+            edit_distance(ref_chars, hyp_chars), len(ref_chars))
+
+
+##########################################################################
+# Transcription
+##########################################################################
+
+def transcribe_all(client, audio_files, language_id, acoustic_id, cache, max_in_flight):
+    def transcribe_one(audio_file):
+        return transcribe.get_transcript(
+            cache.recognize(client, audio_file, language_id, acoustic_id))
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        return list(pool.map(transcribe_one, audio_files))
+
+
+def reference_path(audio_file, references_dir):
+    name = os.path.splitext(os.path.basename(audio_file))[0]
+    return os.path.join(references_dir, name + '.txt')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the WER of the custom models")
+    parser.add_argument('audio', help="directory, glob pattern or manifest of the test audio")
+    parser.add_argument('--references', default=os.path.join('..', 'data', 'Documents'),
+                        help="directory of the reference .txt files")
+    parser.add_argument('--models', default=','.join(CONFIGURATIONS),
+                        help="models to evaluate, among %s" % ', '.join(CONFIGURATIONS))
+    parser.add_argument('--max-in-flight', type=int, default=env.get_pool_size(),
+                        help="maximum concurrent recognition requests")
+    parser.add_argument('--report', help="write the error counts of every file to this JSON file")
+    args = parser.parse_args(argv)
+
+    audio_files = [f for f in transcribe.collect_audio_files(args.audio)
+                   if os.path.exists(reference_path(f, args.references))]
+    if not audio_files:
+        print("No audio file with a reference document in ", args.references)
+        return -1
+    references = []
+    for audio_file in audio_files:
+        with open(reference_path(audio_file, args.references), encoding='utf-8') as f:
+            references.append(f.read())
+
+    language_id, acoustic_id = transcribe.get_model_ids()
+    configurations = {'base': (None, None), 'lm': (language_id, None),
+                      'lm+am': (language_id, acoustic_id)}
+    client = stt_client.get_client()
+    if args.max_in_flight > env.get_pool_size():
+        client.set_pool_size(args.max_in_flight)
+    cache = transcript_cache.TranscriptCache()
+    report = {}
+    print("%d test files\n" % len(audio_files))
+    print("%-8s %8s %8s %10s %10s" % ("models", "WER", "CER", "transcribe", "align"))
+    for name in args.models.split(','):
+        lid, aid = configurations[name]
+        if (name != 'base' and not lid) or (name == 'lm+am' and not aid):
+            print("%-8s skipped, LANGUAGE_ID or ACOUSTIC_ID not set" % name)
+            continue
+        start = time.time()
+        hypotheses = transcribe_all(client, audio_files, lid, aid, cache, args.max_in_flight)
+        transcribed = time.time()
+        counts = [error_counts(r, h) for r, h in zip(references, hypotheses)]
+        aligned = time.time()
+        totals = [sum(c[k] for c in counts) for k in range(4)]
+        print("%-8s %7.2f%% %7.2f%% %9.1fs %9.2fs"
+              % (name, 100.0 * totals[0] / max(totals[1], 1),
+                 100.0 * totals[2] / max(totals[3], 1),
+                 transcribed - start, aligned - transcribed))
+        report[name] = dict((f, dict(zip(('word_errors', 'words', 'char_errors', 'chars'), c)))
+                            for f, c in zip(audio_files, counts))
+    print()
+    cache.print_stats()
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
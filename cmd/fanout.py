@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os, sys, time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import env
+import stt_client
+import uploader
+import waiter
+
+##########################################################################
+# Run one operation on many custom models at the same time, instead of
+# running a script once per model with LANGUAGE_ID or ACOUSTIC_ID set in
+# turn:
+#
+#   python fanout.py list --name 'dept-*'
+#   python fanout.py add-corpus corpus-2.txt corpus-3.txt --ids-file departments.txt
+#   python fanout.py train --name 'dept-*' --max-rps 10
+#   python fanout.py transcribe audio-set-test.txt --references ../data/Documents --name 'dept-*'
+#   python fanout.py add-audio audio-set1.zip --acoustic --ids 9e1c...,0b7d...
+#
+# The models are custom language models, or custom acoustic models with
+# --acoustic.  They are given by ID (--ids, --ids-file) or by a pattern of
+# their names, looked up in the inventory (see inventory.py).
+#
+# The operation runs on --workers models at a time.  Within a model, the
+# steps stay sequential, as the service processes one corpus, audio
+# resource or training job at a time per model.  Every request of the
+# client, and every retry, goes through two token buckets, one for the
+# model it is about (--max-rps-per-model) and one for all the requests
+# (--max-rps).  So the fan-out stays under the rate limit of the service
+# instance, and one model cannot take all of it.  The throughput grows
+# with the number of workers until --max-rps or the service limits it.
+# The results and failures of all the models are gathered into one
+# report.
+##########################################################################
+
+
+##########################################################################
+# Rate limiting
+##########################################################################
+
+class TokenBucket:
+    # rate tokens per second, with up to burst tokens saved while idle
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = burst or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token and returns the seconds to wait before using it.
+        # The tokens go below zero for the callers that have to wait, so
+        # that they are served in turn.
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+def model_of(path, params=None):
+    # The custom model a request is about: the one of its path, or the one
+    # it recognizes with
+    segments = path.split('?')[0].strip('/').split('/')
+    for n, segment in enumerate(segments[:-1]):
+        if segment in ('customizations', 'acoustic_customizations'):
+            return segments[n + 1]
+    params = params or {}
+    return params.get('language_customization_id') or params.get('acoustic_customization_id')
+
+
+class RateLimiter:
+    # Set as the rate_limiter of a SpeechClient, which calls acquire()
+    # before sending a request.  A rate of 0 is not limited.
+
+    def __init__(self, max_rps=0, max_rps_per_model=0, sleep=time.sleep):
+        self.total = TokenBucket(max_rps) if max_rps else None
+        self.max_rps_per_model = max_rps_per_model
+        self.buckets = {}
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.waited = 0.0
+
+    def acquire(self, path, params=None):
+        delays = []
+        model = model_of(path, params)
+        if self.max_rps_per_model and model:
+            with self.lock:
+                bucket = self.buckets.get(model)
+                if bucket is None:
+                    bucket = self.buckets[model] = TokenBucket(self.max_rps_per_model)
+            delays.append(bucket.reserve())
+            self.sleep(delays[-1])
+        # The token of the instance is only taken once the model may send,
+        # so no request of another model waits for it meanwhile
+        if self.total:
+            delays.append(self.total.reserve())
+            self.sleep(delays[-1])
+        with self.lock:
+            self.requests += 1
+            self.waited += sum(delays)
+
+
+##########################################################################
+# Operations, run for one model: each returns a dict of results and
+# raises an exception on failure
+##########################################################################
+
+def list_model(client, kind, customization_id, args):
+    if kind == 'language':
+        r = client.get_language_model(customization_id)
+        r.raise_for_status()
+        model = r.json()
+        r = client.list_corpora(customization_id)
+        r.raise_for_status()
+        resources = r.json()['corpora']
+    else:
+        r = client.get_acoustic_model(customization_id)
+        r.raise_for_status()
+        model = r.json()
+        r = client.list_audio(customization_id)
+        r.raise_for_status()
+        resources = r.json()['audio']
+    return {'status': model['status'], 'resources': len(resources),
+            'processing': sum(1 for x in resources if x.get('status') == 'being_processed'),
+            'updated': model.get('updated')}
+
+
+def add_resources(client, kind, customization_id, args):
+    # The files are added one after the other, each one once the previous
+    # one is processed
+    if kind == 'language':
+        upload, wait = uploader.upload_corpus, waiter.wait_for_corpus
+        list_names = uploader.corpus_names
+    else:
+        upload, wait = uploader.upload_audio, waiter.wait_for_audio
+        list_names = uploader.audio_names
+    # One listing of the resources for all the files
+    names = None if args.force else list_names(client, customization_id)
+    counts = {'uploaded': 0, 'skipped': 0}
+    for number, path in enumerate(args.files, 1):
+        name = os.path.basename(path)
+        result = upload(client, customization_id, path, name, force=args.force, names=names)
+        counts[result] += 1
+        if result == 'uploaded' and (number < len(args.files) or not args.no_wait):
+            wait(client, customization_id, name, timeout=env.get_wait_timeout())
+    return counts
+
+
+def train_model(client, kind, customization_id, args):
+    if kind == 'language':
+        r = client.train_language_model(customization_id)
+    else:
+        r = client.train_acoustic_model(customization_id, args.language_id)
+    if r.status_code != 200:
+        raise RuntimeError("training returns %d: %s" % (r.status_code, r.text))
+    if args.no_wait:
+        return {'status': 'training'}
+    start = time.time()
+    if kind == 'language':
+        model = waiter.wait_for_language_model(client, customization_id,
+                                               timeout=env.get_wait_timeout())
+    else:
+        model = waiter.wait_for_acoustic_model(client, customization_id,
+                                               timeout=env.get_wait_timeout())
+    return {'status': model['status'], 'training_seconds': round(time.time() - start, 1)}
+
+
+def transcribe_test_set(client, kind, customization_id, args):
+    # Transcribes the test set with the model, through the transcript
+    # cache, and measures the error rates when there are references
+    import evaluate
+    language_id, acoustic_id = ((customization_id, args.language_id) if kind == 'language'
+                                else (args.language_id, customization_id))
+    hypotheses = evaluate.transcribe_all(client, args.audio_files, language_id, acoustic_id,
+                                         args.cache, args.max_in_flight)
+    results = {'files': len(hypotheses)}
+    if args.reference_texts:
+        counts = [evaluate.error_counts(reference, hypothesis)
+                  for reference, hypothesis in zip(args.reference_texts, hypotheses)]
+        totals = [sum(c[k] for c in counts) for k in range(4)]
+        results['wer'] = round(100.0 * totals[0] / max(totals[1], 1), 2)
+        results['cer'] = round(100.0 * totals[2] / max(totals[3], 1), 2)
+    return results
+
+
+# name: (kind of model, or None for both, function, description)
+OPERATIONS = {
+    'list': (None, list_model, "status and resources of the models"),
+    'add-corpus': ('language', add_resources, "add corpus files to the language models"),
+    'add-audio': ('acoustic', add_resources, "add audio archives to the acoustic models"),
+    'train': (None, train_model, "train the models"),
+    'transcribe': (None, transcribe_test_set, "transcribe a test set with each model"),
+}
+
+
+##########################################################################
+# Fan-out
+##########################################################################
+
+def resolve_targets(client, kind, ids=None, ids_file=None, name=None):
+    # Returns the (customization_id, name) of the models, in the order
+    # given and without duplicates
+    import inventory
+    given = []
+    if ids:
+        given += [i.strip() for i in ids.split(',') if i.strip()]
+    if ids_file:
+        with open(ids_file) as f:
+            lines = [line.split('#', 1)[0].split() for line in f]
+        given += [line[0] for line in lines if line]
+
+    models = inventory.Inventory(client)
+    r = models.get(kind)
+    if r is not None and r.status_code not in (200, 304):
+        raise RuntimeError("listing the models returns %d: %s" % (r.status_code, r.text))
+    models.save()
+    names = dict((entry['customization_id'], entry.get('name')) for entry in models.entries(kind))
+    if name:
+        given += [row['id'] for row in models.query(kind=kind, name=name)]
+
+    targets = []
+    for customization_id in given:
+        if customization_id not in [t[0] for t in targets]:
+            targets.append((customization_id, names.get(customization_id)))
+    return targets
+
+
+def fan_out(client, targets, function, kind, args, workers):
+    # Runs function on every model with workers threads and returns the
+    # result of every model, in the order of the targets
+    def run(target):
+        customization_id, name = target
+        start = time.time()
+        try:
+            results = function(client, kind, customization_id, args)
+            error = None
+        except Exception as e:
+            results, error = None, str(e)
+        return {'customization_id': customization_id, 'name': name, 'ok': error is None,
+                'seconds': round(time.time() - start, 3), 'results': results, 'error': error}
+
+    done = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, target) for target in targets]
+        for future in as_completed(futures):
+            report = future.result()
+            done[report['customization_id']] = report
+            print("%-7s %s (%s) in %.1fs" % ('ok' if report['ok'] else 'FAILED',
+                                             report['customization_id'], report['name'] or '-',
+                                             report['seconds']))
+            sys.stdout.flush()
+    return [done[customization_id] for customization_id, _ in targets]
+
+
+def _summary(report):
+    if not report['ok']:
+        return report['error'][:100]
+    return ', '.join('%s=%s' % item for item in sorted(report['results'].items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an operation on many custom models")
+    parser.add_argument('operation', choices=sorted(OPERATIONS),
+                        help=", ".join("%s: %s" % (name, OPERATIONS[name][2])
+                                       for name in sorted(OPERATIONS)))
+    parser.add_argument('files', nargs='*',
+                        help="corpus files or audio archives to add, or the test set to "
+                        "transcribe (directory, glob pattern or manifest)")
+    parser.add_argument('--acoustic', action='store_true',
+                        help="the models are custom acoustic models")
+    parser.add_argument('--ids', help="comma separated customization IDs")
+    parser.add_argument('--ids-file', help="file of customization IDs, one per line")
+    parser.add_argument('--name', help="pattern of the names of the models, such as 'dept-*'")
+    parser.add_argument('--workers', type=int,
+                        help="models processed at the same time (default STT_POOL_SIZE)")
+    parser.add_argument('--max-rps', type=float, default=0,
+                        help="requests per second to the service, for all the models")
+    parser.add_argument('--max-rps-per-model', type=float, default=0,
+                        help="requests per second about one model")
+    parser.add_argument('--language-id',
+                        help="custom language model to train the acoustic models with, "
+                        "or to transcribe with")
+    parser.add_argument('--references', metavar='DIR',
+                        help="directory of the reference .txt files of the test set")
+    parser.add_argument('--max-in-flight', type=int, default=2,
+                        help="recognition requests per model at the same time")
+    parser.add_argument('--force', action='store_true', help="upload the files anyway")
+    parser.add_argument('--no-wait', action='store_true',
+                        help="do not wait for the last file or the training to be processed")
+    parser.add_argument('--report', help="write the results of every model to this JSON file")
+    args = parser.parse_args(argv)
+
+    kind, function, _ = OPERATIONS[args.operation]
+    model_kind = 'acoustic' if args.acoustic else 'language'
+    if kind and kind != model_kind:
+        parser.error("%s needs %s models" % (args.operation, kind))
+    if args.operation in ('add-corpus', 'add-audio', 'transcribe') and not args.files:
+        parser.error("%s needs files" % args.operation)
+    if not (args.ids or args.ids_file or args.name):
+        parser.error("give the models with --ids, --ids-file or --name")
+
+    args.reference_texts = None
+    if args.operation == 'transcribe':
+        import evaluate
+        import transcribe
+        import transcript_cache
+        args.audio_files = transcribe.collect_audio_files(args.files[0])
+        if args.references:
+            args.audio_files = [f for f in args.audio_files
+                                if os.path.exists(evaluate.reference_path(f, args.references))]
+            args.reference_texts = []
+            for audio_file in args.audio_files:
+                with open(evaluate.reference_path(audio_file, args.references),
+                          encoding='utf-8') as f:
+                    args.reference_texts.append(f.read())
+        args.cache = transcript_cache.TranscriptCache()
+
+    client = stt_client.get_client()
+    try:
+        targets = resolve_targets(client, model_kind, args.ids, args.ids_file, args.name)
+    except RuntimeError as e:
+        print(e)
+        return -1
+    if not targets:
+        print("No model matches")
+        return -1
+
+    limiter = RateLimiter(args.max_rps, args.max_rps_per_model)
+    client.rate_limiter = limiter
+    workers = args.workers or min(len(targets), env.get_pool_size())
+    # A connection for every thread sending requests: the transcriptions
+    # of a model send max_in_flight requests at a time
+    connections = workers * (args.max_in_flight if args.operation == 'transcribe' else 1)
+    if connections > env.get_pool_size():
+        client.set_pool_size(connections)
+    print("%s on %d %s models, %d at a time\n" % (args.operation, len(targets), model_kind, workers))
+    start = time.time()
+    reports = fan_out(client, targets, function, model_kind, args, workers)
+    elapsed = time.time() - start
+
+    failed = [r for r in reports if not r['ok']]
+    print("\n%-36s %-20s %8s  %s" % ('customization_id', 'name', 'seconds', 'results'))
+    for report in reports:
+        print("%-36s %-20s %8.1f  %s" % (report['customization_id'], (report['name'] or '-')[:20],
+                                         report['seconds'], _summary(report)))
+    print("\n%d models, %d failed in %.1fs: %d requests (%.1f per second), "
+          "%.1fs of waits for the rate limits in all"
+          % (len(reports), len(failed), elapsed, limiter.requests,
+             limiter.requests / max(elapsed, 1e-6), limiter.waited))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'operation': args.operation, 'kind': model_kind, 'seconds': elapsed,
+                       'requests': limiter.requests, 'models': reports}, f, indent=1)
+    return -1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
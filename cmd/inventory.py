@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+import argparse
+import fnmatch
+import hashlib
+import json
+import os, sys, time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+import env
+import stt_client
+
+##########################################################################
+# Local inventory of the base models, custom models, corpora and audio
+# resources of the service, used by the list_* scripts and for monitoring.
+#
+# The inventory keeps each listing of the service (the base models, the
+# custom language models, the custom acoustic models, the corpora of each
+# language model and the audio resources of each acoustic model) with the
+# time it was fetched and its ETag, in a JSON file of the cache directory
+# per endpoint and user.  The list_* scripts ask the service for their
+# listing every time, with the ETag so that a listing that did not change
+# is answered 304 without a body; with --cached, they use the one of the
+# inventory until it is older than the TTL of its kind, or BUSY_TTL while
+# one of its entries is in a non-terminal status.  The requests of
+# stt_client.py that change a resource expire the listings that hold it.
+#
+#   python inventory.py refresh
+#   python inventory.py query --kind corpus --status being_processed
+#   python inventory.py query --kind language --name 'customer-*' --base-model '*Narrowband*'
+#   python inventory.py watch
+#
+# - refresh fetches the listings that are expired (all of them with
+#   --force, or those older than --max-age seconds)
+# - query answers from the inventory alone, without any request to the
+#   service, unless --refresh is given
+# - watch polls only the resources in a non-terminal status, and prints
+#   their status changes until none is left.  With --forever, it also
+#   refreshes the expired listings, to notice the new jobs.
+##########################################################################
+
+# Seconds a listing is used before it is fetched again
+TTLS = {
+    'models': 24 * 3600,
+    'language': 300,
+    'acoustic': 300,
+    'corpora': 600,
+    'audio': 600,
+}
+
+# Seconds a listing is used while one of its entries is in a non-terminal
+# status
+BUSY_TTL = 30
+
+# Non-terminal statuses of the entries of each listing
+BUSY_STATUSES = {
+    'language': ('training', 'upgrading'),
+    'acoustic': ('training', 'upgrading'),
+    'corpora': ('being_processed',),
+    'audio': ('being_processed',),
+}
+
+# Field of the response that holds the entries of each listing, and kind
+# of these entries in a query
+FIELDS = {
+    'models': ('models', 'base'),
+    'language': ('customizations', 'language'),
+    'acoustic': ('customizations', 'acoustic'),
+    'corpora': ('corpora', 'corpus'),
+    'audio': ('audio', 'audio'),
+}
+
+KINDS = ('base', 'language', 'acoustic', 'corpus', 'audio')
+
+FETCH = {
+    'models': lambda client, _, etag: client.list_models(etag=etag),
+    'language': lambda client, _, etag: client.list_language_models(etag=etag),
+    'acoustic': lambda client, _, etag: client.list_acoustic_models(etag=etag),
+    'corpora': lambda client, i, etag: client.list_corpora(i, etag=etag),
+    'audio': lambda client, i, etag: client.list_audio(i, etag=etag),
+}
+
+
+def inventory_path(client):
+    # One inventory per endpoint and user
+    account = '%s\n%s' % (client.endpoint, client.session.auth[0])
+    return os.path.join(env.get_cache_dir('inventory'),
+                        hashlib.sha256(account.encode('utf-8')).hexdigest()[:16] + '.json')
+
+
+def stale_keys(path):
+    # The listings that a change of the resource at path makes stale
+    segments = path.split('?')[0].strip('/').split('/')
+    if len(segments) < 2 or segments[1] not in ('customizations', 'acoustic_customizations'):
+        return []
+    kind, resources = (('language', 'corpora') if segments[1] == 'customizations'
+                       else ('acoustic', 'audio'))
+    if len(segments) == 2:
+        return [kind]
+    return [kind, resources + '/' + unquote(segments[2])]
+
+
+def record_change(client, path):
+    # Called by stt_client.py for every request that changed a resource:
+    # the listings it makes stale are expired when the inventory is next
+    # loaded, by this process or another one
+    keys = stale_keys(path)
+    if keys:
+        with open(inventory_path(client) + '.stale', 'a') as f:
+            f.write(''.join(key + '\n' for key in keys))
+
+
+def _split(key):
+    # 'corpora/<customization_id>' -> ('corpora', '<customization_id>')
+    kind, _, customization_id = key.partition('/')
+    return kind, customization_id or None
+
+
+def _entry_id(entry):
+    return entry.get('customization_id') or entry['name']
+
+
+class Inventory:
+
+    def __init__(self, client, path=None):
+        self.client = client
+        self.path = path = path or inventory_path(client)
+        self.lock = threading.Lock()
+        self.listings = {}
+        self.changed = False
+        self.requests = self.not_modified = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                self.listings = json.load(f)['listings']
+        self.expire_stale()
+
+    def expire_stale(self):
+        # Expires the listings changed since they were fetched (see
+        # record_change).  The file is renamed before it is read, so that
+        # a change recorded meanwhile goes to a new file.
+        stale = '%s.stale.%d' % (self.path, os.getpid())
+        try:
+            os.replace(self.path + '.stale', stale)
+        except OSError:
+            return
+        with open(stale) as f:
+            keys = set(f.read().split())
+        os.remove(stale)
+        for key in keys:
+            if key in self.listings:
+                self.listings[key]['fetched'] = 0
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'listings': self.listings}, f)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+    ######################################################################
+    # Listings
+    ######################################################################
+
+    def entries(self, key):
+        listing = self.listings.get(key)
+        if listing is None:
+            return []
+        return listing['data'].get(FIELDS[_split(key)[0]][0], [])
+
+    def busy(self, key):
+        statuses = BUSY_STATUSES.get(_split(key)[0], ())
+        return [entry for entry in self.entries(key) if entry.get('status') in statuses]
+
+    def age(self, key):
+        listing = self.listings.get(key)
+        return None if listing is None else time.time() - listing['fetched']
+
+    def expired(self, key, max_age=None):
+        age = self.age(key)
+        if age is None:
+            return True
+        if max_age is None:
+            max_age = BUSY_TTL if self.busy(key) else TTLS[_split(key)[0]]
+        return age >= max_age
+
+    def fetch(self, key):
+        # Fetches the listing again, with the ETag of the one we have, and
+        # returns the response
+        kind, customization_id = _split(key)
+        listing = self.listings.get(key)
+        r = FETCH[kind](self.client, customization_id, listing and listing.get('etag'))
+        with self.lock:
+            self.requests += 1
+            if r.status_code == 304 and listing is not None:
+                self.not_modified += 1
+                listing['fetched'] = time.time()
+            elif r.status_code == 200:
+                self.listings[key] = {'fetched': time.time(), 'etag': r.headers.get('ETag'),
+                                      'data': r.json()}
+            elif r.status_code == 404:
+                self.listings.pop(key, None)
+            else:
+                return r
+            self.changed = True
+        return r
+
+    def get(self, key, cached=False):
+        # Returns the response when the listing was fetched, None when the
+        # one of the inventory is used: only with cached, while it is not
+        # expired
+        if not cached or self.expired(key):
+            return self.fetch(key)
+        return None
+
+    def refresh(self, force=False, max_age=None):
+        # Fetches the expired listings: the lists of models first, then
+        # the corpora and audio resources of the custom models they hold.
+        # Returns the responses that failed.
+        if force:
+            max_age = 0
+        failed = []
+
+        def update(keys):
+            keys = [key for key in keys if self.expired(key, max_age)]
+            with ThreadPoolExecutor(max_workers=env.get_pool_size()) as pool:
+                for r in pool.map(self.fetch, keys):
+                    if r.status_code not in (200, 304, 404):
+                        failed.append(r)
+
+        update(['models', 'language', 'acoustic'])
+        keys = (['corpora/' + _entry_id(m) for m in self.entries('language')] +
+                ['audio/' + _entry_id(m) for m in self.entries('acoustic')])
+        wanted = set(keys)
+        with self.lock:
+            # The resources of the models that were deleted
+            for key in list(self.listings):
+                if '/' in key and key not in wanted:
+                    del self.listings[key]
+                    self.changed = True
+        update(keys)
+        return failed
+
+    ######################################################################
+    # Watch
+    ######################################################################
+
+    def statuses(self):
+        return dict(((key, _entry_id(entry)), entry.get('status'))
+                    for key in self.listings for entry in self.entries(key))
+
+    def poll_busy(self):
+        # Polls the resources in a non-terminal status: each busy model on
+        # its own, which is cheaper than listing all the models, and the
+        # listing of the corpora or audio resources that are processed
+        models, keys = [], []
+        for key in list(self.listings):
+            kind, _ = _split(key)
+            busy = self.busy(key)
+            if busy and kind in ('language', 'acoustic'):
+                models += [(key, entry) for entry in busy]
+            elif busy:
+                keys.append(key)
+
+        def poll_model(item):
+            key, entry = item
+            if key == 'language':
+                r = self.client.get_language_model(entry['customization_id'])
+            else:
+                r = self.client.get_acoustic_model(entry['customization_id'])
+            with self.lock:
+                self.requests += 1
+                if r.status_code == 200:
+                    # The listing no longer matches its ETag
+                    entry.clear()
+                    entry.update(r.json())
+                    self.listings[key]['etag'] = None
+                    self.changed = True
+            return r
+
+        with ThreadPoolExecutor(max_workers=env.get_pool_size()) as pool:
+            list(pool.map(poll_model, models))
+            list(pool.map(self.fetch, keys))
+        return len(models) + len(keys)
+
+    def watch(self, interval=BUSY_TTL, forever=False, out=sys.stdout):
+        before = self.statuses()
+        while True:
+            if forever:
+                self.refresh()
+            if not self.poll_busy() and not forever:
+                return
+            after = self.statuses()
+            for (key, entry_id), status in sorted(after.items()):
+                if before.get((key, entry_id), status) != status:
+                    out.write("%s %-8s %s: %s -> %s\n"
+                              % (time.strftime('%H:%M:%S'), FIELDS[_split(key)[0]][1],
+                                 entry_id, before[(key, entry_id)], status))
+            out.flush()
+            before = after
+            self.save()
+            if not forever and not any(self.busy(key) for key in self.listings):
+                return
+            time.sleep(interval)
+
+    ######################################################################
+    # Queries
+    ######################################################################
+
+    def rows(self):
+        # One row per resource, with the base model of the custom model it
+        # belongs to
+        base_models = {}
+        for kind in ('language', 'acoustic'):
+            for entry in self.entries(kind):
+                base_models[entry['customization_id']] = entry.get('base_model_name')
+        for key in sorted(self.listings):
+            kind, customization_id = _split(key)
+            for entry in self.entries(key):
+                model_id = customization_id or entry.get('customization_id')
+                yield {'kind': FIELDS[kind][1], 'id': _entry_id(entry),
+                       'name': entry.get('name'), 'status': entry.get('status'),
+                       'base_model': entry['name'] if kind == 'models' else base_models.get(model_id),
+                       'customization_id': model_id, 'entry': entry}
+
+    def query(self, kind=None, statuses=None, name=None, base_model=None,
+              customization_id=None):
+        for row in self.rows():
+            if kind and row['kind'] != kind:
+                continue
+            if statuses and row['status'] not in statuses:
+                continue
+            if name and not fnmatch.fnmatch(row['name'] or '', name):
+                continue
+            if base_model and not fnmatch.fnmatch(row['base_model'] or '', base_model):
+                continue
+            if customization_id and customization_id not in (row['id'], row['customization_id']):
+                continue
+            yield row
+
+
+def print_listing(key, label, cached=False):
+    # Prints a listing as the list_* scripts do, and returns their exit
+    # status.  The listing is asked again to the service with its ETag, or
+    # with cached taken from the inventory while it is not expired.
+    inventory = Inventory(stt_client.get_client())
+    r = inventory.get(key, cached)
+    if r is None:
+        print("%s from the inventory, fetched %ds ago (drop --cached to fetch it again)"
+              % (label, inventory.age(key)))
+    else:
+        print("Get %s returns: " % label.lower(), r.status_code)
+        if r.status_code not in (200, 304):
+            print(r.text)
+            return -1
+    inventory.save()
+    if key not in inventory.listings:
+        return -1
+    print(json.dumps(inventory.listings[key]['data'], indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local inventory of the models and resources")
+    commands = parser.add_subparsers(dest='command')
+    refresh = commands.add_parser('refresh', help="fetch the expired listings")
+    refresh.add_argument('--force', action='store_true', help="fetch all the listings")
+    refresh.add_argument('--max-age', type=float,
+                         help="fetch the listings older than this number of seconds")
+    query = commands.add_parser('query', help="list the resources of the inventory")
+    query.add_argument('--kind', choices=KINDS)
+    query.add_argument('--status', action='append',
+                       help="keep the resources with this status (repeatable)")
+    query.add_argument('--name', help="pattern of the names, such as 'corpus-*'")
+    query.add_argument('--base-model', help="pattern of the base models")
+    query.add_argument('--customization-id',
+                       help="keep this custom model and its corpora or audio resources")
+    query.add_argument('--json', action='store_true', help="print one JSON line per resource")
+    query.add_argument('--refresh', action='store_true',
+                       help="fetch the expired listings first")
+    watch = commands.add_parser('watch', help="follow the resources being processed")
+    watch.add_argument('--interval', type=float, default=BUSY_TTL,
+                       help="seconds between two polls (default %(default)s)")
+    watch.add_argument('--forever', action='store_true',
+                       help="keep watching, refreshing the expired listings")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    inventory = Inventory(stt_client.get_client())
+    status = 0
+    # A query is answered without any request, unless the inventory is
+    # empty.  A watch starts from listings that are not expired, so that it
+    # knows about the recent jobs.
+    if args.command != 'query' or args.refresh or not inventory.listings:
+        failed = inventory.refresh(getattr(args, 'force', False), getattr(args, 'max_age', None))
+        for r in failed:
+            print("%s returns %d: %s" % (r.request.path_url, r.status_code, r.text))
+        status = -1 if failed else 0
+        if args.command == 'refresh':
+            print("%d listings, %d requests, %d not modified"
+                  % (len(inventory.listings), inventory.requests, inventory.not_modified))
+
+    if args.command == 'query':
+        for row in inventory.query(args.kind, args.status, args.name, args.base_model,
+                                   args.customization_id):
+            if args.json:
+                print(json.dumps(dict(row['entry'], kind=row['kind'], base_model=row['base_model'],
+                                      customization_id=row['customization_id'])))
+            else:
+                print("%-8s %-16s %-28s %-36s %s" % (row['kind'], row['status'] or '-',
+                                                     row['base_model'] or '-', row['id'],
+                                                     row['name'] or ''))
+    elif args.command == 'watch':
+        try:
+            inventory.watch(args.interval, args.forever)
+        except KeyboardInterrupt:
+            pass
+    inventory.save()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
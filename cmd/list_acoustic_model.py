@@ -1,24 +1,14 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import inventory
 
 ##########################################################################
 # Get the list of custom acoustice models
+# The list is asked again with the ETag of the local inventory (see
+# inventory.py); --cached uses the inventory while it is recent enough.
 ##########################################################################
 
 print("\nGetting custom acoustic models...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations"
-r = requests.get(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
-
-print("Get acoustice models returns: ", r.status_code)
-print(r.text)
-
-sys.exit(0)
+sys.exit(inventory.print_listing('acoustic', "Acoustice models", env.has_option('--cached')))
@@ -1,27 +1,15 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import inventory
 
 ##########################################################################
 # List the audio sources for an acoustic model
+# The list is asked again with the ETag of the local inventory (see
+# inventory.py); --cached uses the inventory while it is recent enough.
 ##########################################################################
 
 print("\nGetting audio sources ...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations/"+env.get_acoustic_id()+"/audio/"
-r = requests.get(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
-
-print("Get audio sources returns: ", r.status_code)
-if r.status_code != 200:
-   print("Failed to get corpus")
-   sys.exit(-1)
-else:
-   print(r.text)
-   sys.exit(0)
+sys.exit(inventory.print_listing('audio/' + env.get_acoustic_id(), "Audio sources",
+                                 env.has_option('--cached')))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os, time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import audio_prep
+import stt_client
+
+##########################################################################
+# Recognize a long recording as segments sent in parallel.
+#
+# The audio is cut about every segment_seconds, at the quietest point of
+# the last SEARCH_SECONDS before the cut, so that segments end in a pause
+# between words.  When no pause is found there (continuous speech), the
+# two segments overlap by OVERLAP_SECONDS around the cut, so that the
+# words cut in half are recognized whole in one of them.
+#
+# The segments are recognized concurrently with timestamps.  Their results
+# are shifted by the offset of the segment and put back in order.  In an
+# overlap, a word is kept from the segment that owns the middle of the
+# word, so words are neither lost nor repeated.  The stitched result has
+# the shape of a /v1/recognize response.
+##########################################################################
+
+SEGMENT_SECONDS = 60
+SEARCH_SECONDS = 15
+OVERLAP_SECONDS = 2
+# Number of frames averaged to find a pause rather than a quiet frame
+PAUSE_FRAMES = 10
+
+# start and end are the samples sent, keep_start and keep_end the part of
+# the timeline the segment owns
+Segment = namedtuple('Segment', 'start end keep_start keep_end')
+
+
+def plan_segments(samples, rate, segment_seconds=SEGMENT_SECONDS):
+    energies, size = audio_prep.frame_energies(samples, rate)
+    if not len(energies):
+        return [Segment(0, len(samples), 0, len(samples))]
+    floor = np.percentile(energies, 10)
+    threshold = max(floor + audio_prep.THRESHOLD_DB, audio_prep.MIN_SPEECH_DB)
+    target = max(1, int(segment_seconds * 1000 / audio_prep.FRAME_MS))
+    search = max(1, min(int(SEARCH_SECONDS * 1000 / audio_prep.FRAME_MS), target // 2))
+    kernel = np.ones(PAUSE_FRAMES) / PAUSE_FRAMES
+
+    # Cuts as (sample offset, True if in a pause)
+    cuts = []
+    position = 0
+    while len(energies) - position > target:
+        first = position + target - search
+        window = np.convolve(energies[first:position + target], kernel, mode='same')
+        best = int(np.argmin(window))
+        position = first + best
+        # A pause is quiet, and quieter than most of the speech around it
+        pause = window[best] < min(threshold, np.median(window) - audio_prep.THRESHOLD_DB)
+        cuts.append((position * size, pause))
+
+    overlap = int(OVERLAP_SECONDS * rate)
+    bounds = [(0, True)] + cuts + [(len(samples), True)]
+    segments = []
+    for (start, start_pause), (end, end_pause) in zip(bounds, bounds[1:]):
+        segments.append(Segment(start if start_pause else max(0, start - overlap),
+                                end if end_pause else min(len(samples), end + overlap),
+                                start, end))
+    return segments
+
+
+def _shift_result(result, offset, owns, keep):
+    # Shift the times of a result by offset, and keep the words for which
+    # keep(word, start, end) is true.  Returns None when no word is left.
+    result = dict(result)
+    alternatives = []
+    for number, alternative in enumerate(result['alternatives']):
+        alternative = dict(alternative)
+        timestamps = alternative.get('timestamps')
+        if timestamps is not None:
+            shifted = [[word, start + offset, end + offset] for word, start, end in timestamps]
+            if number == 0:
+                kept = [keep(*t) for t in shifted]
+            else:
+                kept = [owns(start, end) for _, start, end in shifted]
+            if number == 0 and not any(kept):
+                return None
+            alternative['timestamps'] = [t for t, k in zip(shifted, kept) if k]
+            if 'word_confidence' in alternative:
+                alternative['word_confidence'] = [c for c, k in
+                                                  zip(alternative['word_confidence'], kept) if k]
+            if not all(kept):
+                alternative['transcript'] = ''.join(t[0] + ' ' for t in alternative['timestamps'])
+        alternatives.append(alternative)
+    result['alternatives'] = alternatives
+    if 'word_alternatives' in result:
+        result['word_alternatives'] = [
+            dict(w, start_time=w['start_time'] + offset, end_time=w['end_time'] + offset)
+            for w in result['word_alternatives']
+            if owns(w['start_time'] + offset, w['end_time'] + offset)]
+    return result
+
+
+def stitch(segments, results, rate):
+    # A word is kept from the segment that owns its middle.  The times of
+    # a word recognized in both segments of an overlap differ slightly, so
+    # a word repeating the last kept one and overlapping it is dropped.
+    stitched = []
+    last = [None, 0.0]
+
+    for segment, response in zip(segments, results):
+        keep_start, keep_end = segment.keep_start / float(rate), segment.keep_end / float(rate)
+
+        def owns(start, end):
+            return keep_start <= (start + end) / 2.0 < keep_end
+
+        def keep(word, start, end):
+            if not owns(start, end) or (word == last[0] and start < last[1]):
+                return False
+            last[:] = [word, end]
+            return True
+
+        for result in response.get('results', []):
+            result = _shift_result(result, segment.start / float(rate), owns, keep)
+            if result is not None:
+                stitched.append(result)
+    return {'results': stitched, 'result_index': 0}
+
+
+def recognize_long(client, audio_file, language_id=None, acoustic_id=None,
+                   segment_seconds=SEGMENT_SECONDS, max_in_flight=8, encoding='wav',
+                   model=stt_client.BASE_MODEL, **params):
+    # Returns the stitched recognition result, raises requests.HTTPError
+    # when a segment fails after the retries of the client
+    start = time.time()
+    samples, rate = audio_prep.read_wav(audio_file)
+    target = audio_prep.model_rate(model)
+    samples = audio_prep.resample(samples, rate, target)
+    segments = plan_segments(samples, target, segment_seconds)
+    params['timestamps'] = True
+
+    def recognize_segment(segment):
+        segment_start = time.time()
+        data, content_type = audio_prep.encode(samples[segment.start:segment.end],
+                                               target, encoding)
+        r = client.recognize(data, content_type=content_type, model=model,
+                             language_customization_id=language_id,
+                             acoustic_customization_id=acoustic_id, **params)
+        r.raise_for_status()
+        return r.json(), time.time() - segment_start
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(segments)))) as pool:
+        responses = list(pool.map(recognize_segment, segments))
+    print("%s: %d segments of %.0fs of audio recognized in %.1fs (longest segment %.1fs)"
+          % (os.path.basename(audio_file), len(segments), len(samples) / float(target),
+             time.time() - start, max(elapsed for _, elapsed in responses)))
+    return stitch(segments, [response for response, _ in responses], target)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+import atexit
+import bisect
+import json
+import os
+import re
+import sys, time
+import threading
+import env
+
+##########################################################################
+# Metrics of the requests sent to the service.
+#
+# When STT_METRICS is set, every request of stt_client.py (and every
+# streaming recognition) is recorded with its method, URL template (the
+# path with the IDs and names replaced by placeholders), status, request
+# and response sizes, time to the first byte of the response (the headers,
+# as measured by requests), total duration and number of retries.  These
+# are aggregated per method and URL template into histograms, and a
+# summary of where the time went is printed on stderr when the program
+# exits.
+#
+# STT_METRICS is one of:
+# - a file name ending in .prom: the histograms are written there at exit,
+#   in the Prometheus text format (for the node exporter textfile collector
+#   or a push gateway)
+# - a file name ending in .jsonl: one JSON line is appended per request as
+#   it completes
+# - any other value, such as 1: only the summary is printed
+##########################################################################
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+HISTOGRAMS = (
+    ('duration', 'stt_request_duration_seconds', DURATION_BUCKETS,
+     "Duration of the requests, retries included"),
+    ('ttfb', 'stt_time_to_first_byte_seconds', DURATION_BUCKETS,
+     "Time from sending the request to receiving the response headers"),
+    ('request_bytes', 'stt_request_size_bytes', SIZE_BUCKETS, "Size of the request bodies"),
+    ('response_bytes', 'stt_response_size_bytes', SIZE_BUCKETS, "Size of the response bodies"),
+)
+
+# Placeholder of the path segment that follows each of these
+PLACEHOLDERS = {
+    'models': '{model_id}',
+    'customizations': '{customization_id}',
+    'acoustic_customizations': '{customization_id}',
+    'corpora': '{corpus_name}',
+    'words': '{word_name}',
+    'audio': '{audio_name}',
+}
+
+_QUERY_RE = re.compile(r'\?.*$')
+
+
+def url_template(path):
+    # /v1/customizations/5f3a.../corpora/corpus-1.txt ->
+    # /v1/customizations/{customization_id}/corpora/{corpus_name}
+    segments = _QUERY_RE.sub('', path).split('/')
+    for n in range(1, len(segments)):
+        # The segments are replaced in order, so a name that happens to be
+        # a collection name is not taken for one
+        placeholder = PLACEHOLDERS.get(segments[n - 1])
+        if placeholder and segments[n]:
+            segments[n] = placeholder
+    return '/'.join(segments)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Estimated by linear interpolation within the bucket, as the
+        # histogram_quantile function of Prometheus does
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if n == len(self.buckets):
+                    return self.buckets[-1]
+                low = self.buckets[n - 1] if n else 0.0
+                return low + (self.buckets[n] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Series:
+    # The measures of one method and URL template
+
+    def __init__(self):
+        self.histograms = dict((key, Histogram(buckets)) for key, _, buckets, _ in HISTOGRAMS)
+        self.statuses = {}
+        self.retries = 0
+
+
+class Metrics:
+
+    def __init__(self, output=None):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.prometheus_path = None
+        self.jsonl = None
+        if output and output.endswith('.prom'):
+            self.prometheus_path = output
+        elif output and output.endswith('.jsonl'):
+            self.jsonl = open(output, 'a', buffering=1)
+
+    def observe(self, method, template, status, duration, ttfb=None, request_bytes=0,
+                response_bytes=0, retries=0, **extra):
+        # status is the HTTP status, or the name of the exception of a
+        # request that got no response
+        values = {'duration': duration, 'ttfb': ttfb, 'request_bytes': request_bytes,
+                  'response_bytes': response_bytes}
+        with self.lock:
+            series = self.series.get((method, template))
+            if series is None:
+                series = self.series[(method, template)] = Series()
+            for key, value in values.items():
+                if value is not None:
+                    series.histograms[key].observe(value)
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.retries += retries
+            if self.jsonl:
+                line = dict(values, time=time.time() - duration, method=method, path=template,
+                            status=status, retries=retries, **extra)
+                self.jsonl.write(json.dumps(line) + '\n')
+
+    def record(self, method, path, response, duration):
+        # Records a response of requests
+        request_bytes = response.request.headers.get('Content-Length')
+        if request_bytes is None and isinstance(response.request.body, bytes):
+            request_bytes = len(response.request.body)
+        retries = getattr(response.raw, 'retries', None)
+        self.observe(method, url_template(path), response.status_code, duration,
+                     ttfb=response.elapsed.total_seconds(),
+                     request_bytes=int(request_bytes or 0),
+                     response_bytes=len(response.content),
+                     retries=len(retries.history) if retries else 0,
+                     transaction_id=response.headers.get('X-Global-Transaction-Id'))
+
+    def record_error(self, method, path, error, duration):
+        self.observe(method, url_template(path), type(error).__name__, duration)
+
+    ######################################################################
+    # Output
+    ######################################################################
+
+    def prometheus_text(self):
+        lines = ['# HELP stt_requests_total Requests by status',
+                 '# TYPE stt_requests_total counter']
+        with self.lock:
+            series = sorted(self.series.items())
+            for (method, template), s in series:
+                for status, count in sorted(s.statuses.items(), key=str):
+                    lines.append('stt_requests_total{method="%s",path="%s",status="%s"} %d'
+                                 % (method, template, status, count))
+            lines += ['# HELP stt_retries_total Retries of the requests',
+                      '# TYPE stt_retries_total counter']
+            for (method, template), s in series:
+                lines.append('stt_retries_total{method="%s",path="%s"} %d'
+                             % (method, template, s.retries))
+            for key, name, buckets, description in HISTOGRAMS:
+                lines += ['# HELP %s %s' % (name, description), '# TYPE %s histogram' % name]
+                for (method, template), s in series:
+                    h = s.histograms[key]
+                    labels = 'method="%s",path="%s"' % (method, template)
+                    total = 0
+                    for bound, count in zip(buckets + ('+Inf',), h.counts):
+                        total += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, total))
+                    lines.append('%s_sum{%s} %s' % (name, labels, repr(h.sum)))
+                    lines.append('%s_count{%s} %d' % (name, labels, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def print_summary(self, out=sys.stderr):
+        with self.lock:
+            rows = sorted(self.series.items(), key=lambda i: -i[1].histograms['duration'].sum)
+            if not rows:
+                return
+            out.write("\n%-72s %6s %6s %7s %9s %8s %8s %8s %8s %8s\n"
+                      % ('STT requests', 'calls', 'errors', 'retries', 'total s', 'mean ms',
+                         'p95 ms', 'ttfb ms', 'sent MB', 'recv MB'))
+            for (method, template), s in rows:
+                h = s.histograms
+                calls = h['duration'].count
+                errors = sum(count for status, count in s.statuses.items()
+                             if not isinstance(status, int) or status >= 400)
+                out.write("%-72s %6d %6d %7d %9.1f %8.1f %8.1f %8.1f %8.2f %8.2f\n"
+                          % ((method + ' ' + template)[:72], calls, errors, s.retries,
+                             h['duration'].sum, 1000 * h['duration'].sum / calls,
+                             1000 * h['duration'].quantile(0.95),
+                             1000 * h['ttfb'].sum / max(h['ttfb'].count, 1),
+                             h['request_bytes'].sum / 1e6, h['response_bytes'].sum / 1e6))
+            out.flush()
+
+    def close(self):
+        if self.prometheus_path:
+            with open(self.prometheus_path + '.tmp', 'w') as f:
+                f.write(self.prometheus_text())
+            os.replace(self.prometheus_path + '.tmp', self.prometheus_path)
+        if self.jsonl:
+            self.jsonl.close()
+            self.jsonl = None
+        self.print_summary()
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    # The metrics of the process, or None when STT_METRICS is not set
+    global _metrics
+    output = env.get_metrics()
+    if not output:
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(output)
+            atexit.register(_metrics.close)
+    return _metrics
@@ -0,0 +1,753 @@
+# -*- coding: utf-8 -*-
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import struct
+import sys, time
+import threading
+import uuid
+import wave
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+import word_cache
+
+##########################################################################
+# Local stand-in for the Speech to Text service, to run the scripts in
+# this directory offline and to benchmark them (see benchmark.py).
+#
+# It keeps the custom models, corpora, words and audio resources in
+# memory and implements the endpoints used by stt_client.py, the
+# WebSocket /v1/recognize used by streaming.py and the IAM token
+# endpoint.  Every request is accepted whatever the credentials.
+#
+# - Every request is answered after --latency seconds (plus up to
+#   --jitter seconds).
+# - A corpus is 'being_processed' for --analyze-seconds before it is
+#   'analyzed', an audio resource for --audio-seconds before it is 'ok',
+#   added words keep the model 'pending' for --words-seconds, and a model
+#   is 'training' for --train-seconds before it is 'available'.  As with
+#   the service, a model accepts one such job at a time and answers 409
+#   to the others.
+# - --rate-limit is the fraction of the requests answered 429, and
+#   --max-rps throttles the requests over that rate with 429.
+# - Transcripts are made of words drawn from a fixed vocabulary with a
+#   generator seeded by the checksum of the audio and the models: the same
+#   audio always gives the same transcript.  Recognizing takes
+#   --realtime-factor times the duration of the audio.
+# - The GET responses have an ETag, and a GET with a matching
+#   If-None-Match is answered 304 Not Modified.
+# - A word of a corpus is new to the base model (an OOV) when its CRC-32
+#   is a multiple of 5, so about one word in five.
+#
+#   STT_ENDPOINT=http://localhost:8080 USERNAME=user PASSWORD=pass \
+#   STT_WS_ENDPOINT=ws://localhost:8080 STT_IAM_URL=http://localhost:8080/identity/token
+#
+#   python mock_server.py --port 8080 --analyze-seconds 5 --train-seconds 30
+##########################################################################
+
+BASE_MODELS = ('en-US_NarrowbandModel', 'en-US_BroadbandModel')
+
+VOCABULARY = (
+    "the patient is a year old male female with history of chest pain "
+    "shortness breath denies fever chills nausea vomiting blood pressure "
+    "heart rate normal sinus rhythm examination reveals mild tenderness "
+    "abdomen lungs clear auscultation bilaterally no acute distress "
+    "assessment and plan continue current medications follow up in two "
+    "weeks diabetes hypertension hyperlipidemia milligrams daily"
+).split()
+
+WORDS_PER_SECOND = 2.5
+WORDS_PER_RESULT = 12
+# Audio of the WebSocket interface finalized in one result
+STREAM_RESULT_SECONDS = 5.0
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class ServiceError(Exception):
+
+    def __init__(self, code, message, headers=None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.headers = headers or {}
+
+
+def is_oov(word):
+    return zlib.crc32(word.encode('utf-8')) % 5 == 0
+
+
+def audio_duration(data, rate=8000):
+    # Duration of WAV data, or an estimate from the size of other formats
+    try:
+        with wave.open(io.BytesIO(data), 'rb') as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError, struct.error):
+        return len(data) / (2.0 * rate)
+
+
+def model_rate(model):
+    return 8000 if 'Narrowband' in model else 16000
+
+
+def now_iso():
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()) + '.%03dZ' % (time.time() % 1 * 1000)
+
+
+##########################################################################
+# Fake transcripts
+##########################################################################
+
+def fake_results(seed, duration, offset=0.0, timestamps=False, word_confidence=False,
+                 max_alternatives=1, final=True):
+    # Results of duration seconds of audio, as /v1/recognize returns them
+    rng = random.Random(seed)
+    count = int(round(duration * WORDS_PER_SECOND)) if duration > 0.2 else 0
+    step = duration / count if count else 0
+    results = []
+    for first in range(0, count, WORDS_PER_RESULT):
+        words = []
+        for n in range(first, min(first + WORDS_PER_RESULT, count)):
+            start = offset + n * step
+            words.append((rng.choice(VOCABULARY), round(start, 2),
+                          round(start + step * 0.8, 2), round(rng.uniform(0.3, 1.0), 3)))
+        best = {'transcript': ''.join(w[0] + ' ' for w in words),
+                'confidence': round(sum(w[3] for w in words) / len(words), 3)}
+        if timestamps:
+            best['timestamps'] = [[w, s, e] for w, s, e, _ in words]
+        if word_confidence:
+            best['word_confidence'] = [[w, c] for w, _, _, c in words]
+        alternatives = [best]
+        for _ in range(1, max_alternatives):
+            changed = list(words)
+            k = rng.randrange(len(changed))
+            changed[k] = (rng.choice(VOCABULARY),) + changed[k][1:]
+            alternatives.append({'transcript': ''.join(w[0] + ' ' for w in changed)})
+        results.append({'alternatives': alternatives, 'final': final})
+    return results
+
+
+def transcript_seed(data, params):
+    digest = hashlib.sha256(data)
+    for name in ('model', 'language_customization_id', 'acoustic_customization_id'):
+        digest.update(('%s=%s;' % (name, params.get(name, ''))).encode('utf-8'))
+    return digest.hexdigest()
+
+
+##########################################################################
+# In-memory state of the service
+##########################################################################
+
+class MockService:
+
+    def __init__(self, latency=0.0, jitter=0.0, analyze_seconds=1.0, audio_seconds=1.0,
+                 words_seconds=0.5, train_seconds=5.0, realtime_factor=0.0,
+                 rate_limit=0.0, max_rps=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.analyze_seconds = analyze_seconds
+        self.audio_seconds = audio_seconds
+        self.words_seconds = words_seconds
+        self.train_seconds = train_seconds
+        self.realtime_factor = realtime_factor
+        self.rate_limit = rate_limit
+        self.max_rps = max_rps
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.models = {}
+        self.tokens = max_rps
+        self.last_refill = time.time()
+        self.requests = self.throttled = 0
+
+    ######################################################################
+    # Latency and throttling
+    ######################################################################
+
+    def admit(self):
+        # Raises a 429 ServiceError for a throttled request, otherwise
+        # waits for the latency of the service
+        with self.lock:
+            self.requests += 1
+            throttled = self.rate_limit and self.random.random() < self.rate_limit
+            if self.max_rps and not throttled:
+                now = time.time()
+                self.tokens = min(self.max_rps, self.tokens + (now - self.last_refill) * self.max_rps)
+                self.last_refill = now
+                throttled = self.tokens < 1
+                if not throttled:
+                    self.tokens -= 1
+            if throttled:
+                self.throttled += 1
+            delay = self.latency + self.jitter * self.random.random()
+        if delay:
+            time.sleep(delay)
+        if throttled:
+            raise ServiceError(429, "Too many requests", {'Retry-After': '1'})
+
+    ######################################################################
+    # Status transitions
+    ######################################################################
+
+    def _schedule(self, model, seconds, apply):
+        model['_pending'].append((time.time() + seconds, apply))
+        model['_pending'].sort(key=lambda p: p[0])
+
+    def _advance(self, model):
+        # Apply the status changes that are due
+        now = time.time()
+        while model['_pending'] and model['_pending'][0][0] <= now:
+            _, apply = model['_pending'].pop(0)
+            apply()
+
+    def _busy(self, model):
+        return model['_pending'] or model['status'] in ('training', 'upgrading')
+
+    def _model(self, kind, customization_id):
+        model = self.models.get(customization_id)
+        if model is None or model['_kind'] != kind:
+            raise ServiceError(404, "Invalid customization_id '%s'" % customization_id)
+        self._advance(model)
+        return model
+
+    def _new_id(self):
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    @staticmethod
+    def _public(model):
+        return dict((k, v) for k, v in model.items() if not k.startswith('_'))
+
+    ######################################################################
+    # Custom models
+    ######################################################################
+
+    def create_model(self, kind, body):
+        if not body.get('name'):
+            raise ServiceError(400, "Required parameter 'name' is missing")
+        base = body.get('base_model_name', BASE_MODELS[0])
+        if base not in BASE_MODELS:
+            raise ServiceError(400, "Invalid base model '%s'" % base)
+        with self.lock:
+            customization_id = self._new_id()
+            self.models[customization_id] = {
+                'customization_id': customization_id, 'name': body['name'],
+                'description': body.get('description', ''), 'base_model_name': base,
+                'language': base.split('_')[0], 'owner': 'mock', 'created': now_iso(),
+                'updated': now_iso(), 'status': 'pending', 'progress': 0,
+                '_kind': kind, '_pending': [], '_resources': {}, '_words': {}}
+        return 201, {'customization_id': customization_id}
+
+    def list_models(self, kind):
+        with self.lock:
+            models = []
+            for model in self.models.values():
+                if model['_kind'] == kind:
+                    self._advance(model)
+                    models.append(self._public(model))
+        return 200, {'customizations': models}
+
+    def get_model(self, kind, customization_id):
+        with self.lock:
+            return 200, self._public(self._model(kind, customization_id))
+
+    def delete_model(self, kind, customization_id):
+        with self.lock:
+            model = self._model(kind, customization_id)
+            if model['status'] == 'training':
+                raise ServiceError(409, "The model is being trained")
+            del self.models[customization_id]
+        return 200, {}
+
+    def train_model(self, kind, customization_id):
+        with self.lock:
+            model = self._model(kind, customization_id)
+            if self._busy(model):
+                raise ServiceError(409, "The model is busy processing a request")
+            if model['status'] == 'pending':
+                raise ServiceError(400, "No training data: add resources to the model first")
+            model['status'], model['progress'] = 'training', 0
+
+            def trained():
+                model.update(status='available', progress=100, updated=now_iso())
+            self._schedule(model, self.train_seconds, trained)
+        return 200, {}
+
+    def reset_model(self, kind, customization_id):
+        with self.lock:
+            model = self._model(kind, customization_id)
+            if self._busy(model):
+                raise ServiceError(409, "The model is busy processing a request")
+            model['_resources'].clear()
+            model['_words'].clear()
+            model.update(status='pending', progress=0, updated=now_iso())
+        return 200, {}
+
+    ######################################################################
+    # Corpora and audio resources
+    ######################################################################
+
+    def add_resource(self, kind, customization_id, name, data, params):
+        with self.lock:
+            model = self._model(kind, customization_id)
+            if self._busy(model):
+                raise ServiceError(409, "Another request is being processed by the model")
+            if name in model['_resources'] and params.get('allow_overwrite') != 'true':
+                raise ServiceError(400, "Resource '%s' already exists" % name)
+            if kind == 'language':
+                counts = Counter(word_cache.tokenize(data.decode('utf-8', 'replace')))
+                oovs = dict((w, c) for w, c in counts.items() if is_oov(w))
+                resource = {'name': name, 'total_words': sum(counts.values()),
+                            'out_of_vocabulary_words': len(oovs), 'status': 'being_processed'}
+                self._remove_source(model, name)
+                seconds = self.analyze_seconds
+            else:
+                duration = audio_duration(data)
+                resource = {'name': name, 'duration': duration, 'status': 'being_processed',
+                            'details': {'type': 'audio' if data[:4] == b'RIFF' else 'archive'}}
+                seconds = self.audio_seconds
+            model['_resources'][name] = resource
+
+            def processed():
+                if kind == 'language':
+                    resource['status'] = 'analyzed'
+                    for word, count in oovs.items():
+                        entry = model['_words'].setdefault(
+                            word, {'word': word, 'sounds_like': [word], 'display_as': word,
+                                   'count': 0, 'source': []})
+                        entry['count'] += count
+                        entry['source'].append(name)
+                else:
+                    resource['status'] = 'ok'
+                if model['status'] in ('pending', 'available'):
+                    model['status'] = 'ready'
+            self._schedule(model, seconds, processed)
+        return 201, {}
+
+    def _remove_source(self, model, name):
+        for word in list(model['_words']):
+            entry = model['_words'][word]
+            if name in entry['source']:
+                entry['source'].remove(name)
+                if not entry['source']:
+                    del model['_words'][word]
+
+    def list_resources(self, kind, customization_id):
+        key = 'corpora' if kind == 'language' else 'audio'
+        with self.lock:
+            model = self._model(kind, customization_id)
+            return 200, {key: [dict(r) for r in model['_resources'].values()]}
+
+    def get_resource(self, kind, customization_id, name):
+        with self.lock:
+            resource = self._model(kind, customization_id)['_resources'].get(name)
+            if resource is None:
+                raise ServiceError(404, "Resource '%s' not found" % name)
+            return 200, dict(resource)
+
+    def delete_resource(self, kind, customization_id, name):
+        with self.lock:
+            model = self._model(kind, customization_id)
+            if name not in model['_resources']:
+                raise ServiceError(404, "Resource '%s' not found" % name)
+            if model['_resources'][name]['status'] == 'being_processed' or model['status'] == 'training':
+                raise ServiceError(409, "Resource '%s' is being processed" % name)
+            del model['_resources'][name]
+            if kind == 'language':
+                self._remove_source(model, name)
+        return 200, {}
+
+    ######################################################################
+    # Words
+    ######################################################################
+
+    def list_words(self, customization_id, params):
+        word_type = params.get('word_type', 'all')
+        sort = params.get('sort', 'alphabetical')
+        with self.lock:
+            words = [dict(w, source=list(w['source']))
+                     for w in self._model('language', customization_id)['_words'].values()]
+        if word_type == 'words':
+            words = [w for w in words if 'user' in w['source']]
+        elif word_type == 'corpora':
+            words = [w for w in words if set(w['source']) - set(['user'])]
+        descending = sort.startswith('-') or sort == 'count'
+        if sort.lstrip('+-') == 'count':
+            words.sort(key=lambda w: (-w['count'] if descending else w['count'], w['word']))
+        else:
+            words.sort(key=lambda w: w['word'], reverse=sort.startswith('-'))
+        return 200, {'words': words}
+
+    def add_words(self, customization_id, body):
+        words = body.get('words')
+        if not isinstance(words, list) or not all(isinstance(w, dict) and w.get('word') for w in words):
+            raise ServiceError(400, "The body must be {\"words\": [{\"word\": ...}, ...]}")
+        with self.lock:
+            model = self._model('language', customization_id)
+            if self._busy(model):
+                raise ServiceError(409, "Another request is being processed by the model")
+            previous = model['status']
+            model['status'] = 'pending'
+
+            def processed():
+                for w in words:
+                    entry = model['_words'].setdefault(
+                        w['word'], {'word': w['word'], 'count': 0, 'source': []})
+                    entry['sounds_like'] = w.get('sounds_like', [w['word']])
+                    entry['display_as'] = w.get('display_as', w['word'])
+                    if 'user' not in entry['source']:
+                        entry['source'].append('user')
+                model['status'] = 'ready' if previous in ('pending', 'available') else previous
+            self._schedule(model, self.words_seconds, processed)
+        return 201, {}
+
+    def get_word(self, customization_id, word):
+        with self.lock:
+            entry = self._model('language', customization_id)['_words'].get(word)
+            if entry is None:
+                raise ServiceError(404, "Word '%s' not found" % word)
+            return 200, dict(entry, source=list(entry['source']))
+
+    def delete_word(self, customization_id, word):
+        with self.lock:
+            model = self._model('language', customization_id)
+            if model['status'] == 'training':
+                raise ServiceError(409, "The model is being trained")
+            if model['_words'].pop(word, None) is None:
+                raise ServiceError(404, "Word '%s' not found" % word)
+        return 200, {}
+
+    ######################################################################
+    # Recognition
+    ######################################################################
+
+    def check_recognize(self, params):
+        model = params.get('model', BASE_MODELS[0])
+        if model not in BASE_MODELS:
+            raise ServiceError(404, "Model '%s' not found" % model)
+        with self.lock:
+            for kind in ('language', 'acoustic'):
+                customization_id = params.get(kind + '_customization_id')
+                if customization_id and self._model(kind, customization_id)['status'] != 'available':
+                    raise ServiceError(400, "Custom %s model '%s' is not available"
+                                       % (kind, customization_id))
+        return model
+
+    def recognize(self, data, params):
+        model = self.check_recognize(params)
+        duration = audio_duration(data, model_rate(model))
+        if self.realtime_factor:
+            time.sleep(duration * self.realtime_factor)
+        results = fake_results(transcript_seed(data, params), duration,
+                               timestamps=params.get('timestamps') == 'true',
+                               word_confidence=params.get('word_confidence') == 'true',
+                               max_alternatives=int(params.get('max_alternatives', 1)))
+        return 200, {'results': results, 'result_index': 0}
+
+
+##########################################################################
+# HTTP and WebSocket interface
+##########################################################################
+
+ROUTES = [
+    ('GET', r'/v1/models', lambda s, h: (200, {'models': [{'name': m, 'rate': model_rate(m)}
+                                                          for m in BASE_MODELS]})),
+    ('POST', r'/v1/recognize', lambda s, h: s.recognize(h.body, h.params)),
+    ('POST', r'/identity/token', lambda s, h: (200, {'access_token': 'mock-token',
+                                                     'token_type': 'Bearer',
+                                                     'expires_in': 3600})),
+]
+for _path, _kind in (('/v1/customizations', 'language'),
+                     ('/v1/acoustic_customizations', 'acoustic')):
+    _resources = _path + r'/([^/]+)/' + ('corpora' if _kind == 'language' else 'audio')
+    ROUTES += [
+        ('POST', _path, lambda s, h, k=_kind: s.create_model(k, h.json())),
+        ('GET', _path, lambda s, h, k=_kind: s.list_models(k)),
+        ('GET', _path + r'/([^/]+)', lambda s, h, i, k=_kind: s.get_model(k, i)),
+        ('DELETE', _path + r'/([^/]+)', lambda s, h, i, k=_kind: s.delete_model(k, i)),
+        ('POST', _path + r'/([^/]+)/train', lambda s, h, i, k=_kind: s.train_model(k, i)),
+        ('POST', _path + r'/([^/]+)/reset', lambda s, h, i, k=_kind: s.reset_model(k, i)),
+        ('GET', _resources, lambda s, h, i, k=_kind: s.list_resources(k, i)),
+        ('POST', _resources + r'/([^/]+)',
+         lambda s, h, i, n, k=_kind: s.add_resource(k, i, n, h.body, h.params)),
+        ('GET', _resources + r'/([^/]+)', lambda s, h, i, n, k=_kind: s.get_resource(k, i, n)),
+        ('DELETE', _resources + r'/([^/]+)',
+         lambda s, h, i, n, k=_kind: s.delete_resource(k, i, n)),
+    ]
+ROUTES += [
+    ('GET', r'/v1/customizations/([^/]+)/words', lambda s, h, i: s.list_words(i, h.params)),
+    ('POST', r'/v1/customizations/([^/]+)/words', lambda s, h, i: s.add_words(i, h.json())),
+    ('GET', r'/v1/customizations/([^/]+)/words/([^/]+)', lambda s, h, i, w: s.get_word(i, w)),
+    ('DELETE', r'/v1/customizations/([^/]+)/words/([^/]+)',
+     lambda s, h, i, w: s.delete_word(i, w)),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately: without this, the
+    # body waits for the delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def json(self):
+        try:
+            return json.loads(self.body.decode('utf-8') or '{}')
+        except ValueError:
+            raise ServiceError(400, "Malformed JSON body")
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_resource(self, data):
+        # A GET response has an ETag, and is answered 304 without a body
+        # when the request has that ETag in If-None-Match
+        etag = '"%s"' % hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()[:20]
+        if etag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_json(200, data, {'ETag': etag})
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        self.params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        if method == 'GET' and self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self.websocket()
+        self.body = self.read_body()
+        service = self.server.service
+        try:
+            service.admit()
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    code, data = handler(service, self, *[unquote(g) for g in match.groups()])
+                    if method == 'GET' and code == 200:
+                        return self.send_resource(data)
+                    return self.send_json(code, data)
+            raise ServiceError(404, "No route for %s %s" % (method, url.path))
+        except ServiceError as e:
+            self.send_json(e.code, {'code': e.code, 'error': str(e)}, e.headers)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    ######################################################################
+    # WebSocket /v1/recognize
+    ######################################################################
+
+    def read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            raise EOFError()
+        opcode, length = header[0] & 0x0f, header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack('>H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b'\0\0\0\0'
+        data = self.rfile.read(length)
+        if len(data) < length:
+            raise EOFError()
+        if header[1] & 0x80:
+            # Unmask 4 bytes at a time
+            padded = data + b'\0' * (-length % 4)
+            masks = (mask * (len(padded) // 4))
+            data = (int.from_bytes(padded, 'big') ^ int.from_bytes(masks, 'big')) \
+                .to_bytes(len(padded), 'big')[:length]
+        return opcode, data
+
+    def send_frame(self, opcode, data):
+        length = len(data)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        self.wfile.write(header + data)
+        self.wfile.flush()
+
+    def send_message(self, message):
+        self.send_frame(1, json.dumps(message).encode('utf-8'))
+
+    def websocket(self):
+        service = self.server.service
+        try:
+            service.admit()
+            model = service.check_recognize(self.params)
+        except ServiceError as e:
+            return self.send_json(e.code, {'code': e.code, 'error': str(e)}, e.headers)
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest())
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode('ascii'))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        # Every STREAM_RESULT_SECONDS of audio, an interim and a final
+        # result of that audio are sent
+        block = int(STREAM_RESULT_SECONDS * model_rate(model) * 2)
+        audio = b''
+        offset = 0.0
+        index = 0
+        options = {}
+
+        def send_results(data, final):
+            duration = len(data) / (2.0 * model_rate(model))
+            if service.realtime_factor:
+                time.sleep(duration * service.realtime_factor)
+            results = fake_results(transcript_seed(data, self.params), duration, offset,
+                                   timestamps=bool(options.get('timestamps')),
+                                   word_confidence=bool(options.get('word_confidence')),
+                                   final=final)
+            if results:
+                self.send_message({'results': results, 'result_index': index})
+            return len(results)
+
+        try:
+            while True:
+                opcode, data = self.read_frame()
+                if opcode == 8:
+                    self.send_frame(8, b'')
+                    return
+                if opcode == 9:
+                    self.send_frame(10, data)
+                elif opcode == 2:
+                    audio += data
+                    while len(audio) >= block:
+                        send_results(audio[:block], False)
+                        index += send_results(audio[:block], True)
+                        offset += STREAM_RESULT_SECONDS
+                        audio = audio[block:]
+                elif opcode == 1:
+                    message = json.loads(data.decode('utf-8'))
+                    if message.get('action') == 'start':
+                        options = message
+                        self.send_message({'state': 'listening'})
+                    elif message.get('action') == 'stop':
+                        index += send_results(audio, True)
+                        offset += len(audio) / (2.0 * model_rate(model))
+                        audio = b''
+                        self.send_message({'state': 'listening'})
+                    else:
+                        self.send_message({'error': "Unknown action"})
+        except (EOFError, ConnectionError):
+            return
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many clients connect at once when benchmarking
+    request_queue_size = 128
+
+    def __init__(self, address, service, verbose=False):
+        ThreadingHTTPServer.__init__(self, address, Handler)
+        self.service = service
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+
+def start(port=0, verbose=False, **options):
+    # Runs a mock server in a background thread; port 0 picks a free port.
+    # Returns the server, server.url is its endpoint.
+    server = MockServer(('127.0.0.1', port), MockService(**options), verbose)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_arguments(parser):
+    # The options of the service, shared with benchmark.py
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="up to this many seconds added at random to the latency")
+    parser.add_argument('--analyze-seconds', type=float, default=1.0,
+                        help="time a corpus is being processed")
+    parser.add_argument('--audio-seconds', type=float, default=1.0,
+                        help="time an audio resource is being processed")
+    parser.add_argument('--words-seconds', type=float, default=0.5,
+                        help="time added words are being processed")
+    parser.add_argument('--train-seconds', type=float, default=5.0,
+                        help="time a model is being trained")
+    parser.add_argument('--realtime-factor', type=float, default=0.0,
+                        help="recognition time per second of audio")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="fraction of the requests answered 429")
+    parser.add_argument('--max-rps', type=float, default=0.0,
+                        help="requests per second over which requests are answered 429")
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def service_options(args):
+    return dict(latency=args.latency, jitter=args.jitter, analyze_seconds=args.analyze_seconds,
+                audio_seconds=args.audio_seconds, words_seconds=args.words_seconds,
+                train_seconds=args.train_seconds, realtime_factor=args.realtime_factor,
+                rate_limit=args.rate_limit, max_rps=args.max_rps, seed=args.seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Speech to Text service")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--verbose', action='store_true', help="log every request")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockServer((args.host, args.port), MockService(**service_options(args)),
+                        args.verbose)
+    print("Mock Speech to Text service on", server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    service = server.service
+    print("\n%d requests, %d answered 429" % (service.requests, service.throttled))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os, re, sys, time
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import env
+import stt_client
+import uploader
+import waiter
+
+##########################################################################
+# Pack the audio files of a directory into archives that fit the size
+# limit of the service for an audio resource (100MB), and optionally add
+# them to the custom acoustic model.
+#
+# The first files (in natural order: 1.wav, 2.wav, ..., 10.wav) are held
+# out as a test set and listed in a manifest that transcribe.py --batch
+# can read.  The other files, except those of the --exclude-list written by
+# screen_audio.py, are bin-packed, largest first, into as few archives as
+# possible; a file that does not fit in an archive on its own is left out.
+# With --prepare, the audio files are first resampled, stripped of their
+# silences and encoded by audio_prep.py, so the archives hold less audio
+# to upload and to bill.
+#
+# Archives are written file by file, so the audio is never all in memory.
+# With --upload, each archive is added to the model as soon as it is
+# written, while the next ones are being packed.  The service processes
+# one audio resource of a model at a time, so the archives are uploaded
+# one after the other.
+##########################################################################
+
+MB = 1024 * 1024
+
+# Bytes of zip headers and tar blocks per file, over the file name
+ENTRY_OVERHEAD = 1024
+
+SAMPLE_SIZE = MB
+
+
+def natural_key(path):
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def list_audio(audio_dir):
+    files = [os.path.join(audio_dir, name) for name in os.listdir(audio_dir)
+             if name.lower().endswith('.wav')]
+    return sorted(files, key=natural_key)
+
+
+def read_exclude_list(path):
+    # The absolute paths of the files listed, relative to the list, by
+    # screen_audio.py --exclude-list
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return set(os.path.abspath(os.path.join(base, line)) for line in lines if line)
+
+
+def compression_ratios(files, count=5):
+    # Compress the beginning of a few files the way each format would and
+    # return the compressed/original size ratio for zip and tar.gz.
+    zip_size = gzip_size = original = 0
+    gzip_stream = zlib.compressobj(9, zlib.DEFLATED, 31)
+    for path in files[:count]:
+        with open(path, 'rb') as f:
+            data = f.read(SAMPLE_SIZE)
+        original += len(data)
+        zip_size += len(zlib.compress(data, 6))
+        gzip_size += len(gzip_stream.compress(data))
+    gzip_size += len(gzip_stream.flush())
+    if not original:
+        return 1.0, 1.0
+    return zip_size / float(original), gzip_size / float(original)
+
+
+def pack_bins(files, capacity):
+    # First fit decreasing: place every file, largest first, in the first
+    # archive with room left for it.
+    bins = []
+    for path in sorted(files, key=os.path.getsize, reverse=True):
+        size = os.path.getsize(path) + ENTRY_OVERHEAD
+        for b in bins:
+            if b['size'] + size <= capacity:
+                b['files'].append(path)
+                b['size'] += size
+                break
+        else:
+            bins.append({'files': [path], 'size': size})
+    return [sorted(b['files'], key=natural_key) for b in bins]
+
+
+def write_archive(path, files, archive_format):
+    if archive_format == 'zip':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for f in files:
+                archive.write(f, os.path.basename(f))
+    else:
+        with tarfile.open(path, 'w:gz') as archive:
+            for f in files:
+                archive.add(f, os.path.basename(f))
+    return os.path.getsize(path)
+
+
+def build_archives(files, output_dir, prefix, archive_format, capacity, limit):
+    # Yields the path of every archive as soon as it is written.  An
+    # archive that compressed worse than estimated is split in two.
+    extension = '.zip' if archive_format == 'zip' else '.tar.gz'
+    pending = pack_bins(files, capacity)
+    number = 0
+    while pending:
+        files = pending.pop(0)
+        number += 1
+        path = os.path.join(output_dir, '%s%d%s' % (prefix, number, extension))
+        size = write_archive(path, files, archive_format)
+        if size > limit:
+            os.remove(path)
+            number -= 1
+            if len(files) == 1:
+                print("Skipping %s: %.1f MB compressed, over the limit of an archive"
+                      % (files[0], size / float(MB)))
+                continue
+            half = len(files) // 2
+            pending[:0] = [files[:half], files[half:]]
+            continue
+        print("%s: %d files, %.1f MB" % (path, len(files), size / float(MB)))
+        yield path
+
+
+def prepare_audio(files, output_dir, encoding):
+    # Returns the prepared files, in the order of the original ones, without
+    # the files in which no speech is found
+    import audio_prep
+    audio_prep.check_encoding(encoding)
+    prepared_dir = os.path.join(output_dir, 'prepared')
+    os.makedirs(prepared_dir, exist_ok=True)
+    extension = audio_prep.EXTENSIONS[encoding]
+    prepared, bytes_in, bytes_out = [], 0, 0
+    for path, result, error in audio_prep.prepare_files(files, prepared_dir, encoding=encoding):
+        if isinstance(error, audio_prep.NoSpeechError):
+            print("Skipping %s: %s" % (path, error))
+            continue
+        if error:
+            raise RuntimeError("preparing %s: %s" % (path, error))
+        bytes_in += result.bytes_in
+        bytes_out += result.bytes_out
+        name = os.path.splitext(os.path.basename(path))[0] + extension
+        prepared.append(os.path.join(prepared_dir, name))
+    print("Prepared %d files as %s: %.1f MB -> %.1f MB"
+          % (len(prepared), encoding, bytes_in / float(MB), bytes_out / float(MB)))
+    return prepared
+
+
+def write_manifest(path, files):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'w') as manifest:
+        for f in files:
+            manifest.write(os.path.relpath(os.path.abspath(f), base) + '\n')
+
+
+def upload_archive(client, customization_id, path):
+    # Only one audio resource can be processed at a time: while another one
+    # is being processed the service answers 409, so wait and try again.
+    name = os.path.basename(path)
+    deadline = time.time() + env.get_wait_timeout()
+    for delay in waiter.backoff_delays(initial=10, maximum=120):
+        try:
+            uploader.upload_audio(client, customization_id, path)
+            break
+        except uploader.ConflictError:
+            if time.time() + delay > deadline:
+                raise
+        time.sleep(delay)
+    waiter.wait_for_audio(client, customization_id, name, timeout=env.get_wait_timeout())
+    print("%s added to the acoustic model" % name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack audio files into archives")
+    parser.add_argument('audio_dir', help="directory of the .wav files")
+    parser.add_argument('--output-dir', default='.', help="directory for the archives")
+    parser.add_argument('--prefix', default='audio-set', help="archive name prefix")
+    parser.add_argument('--max-size', type=float, default=100,
+                        help="size limit of an archive in MB")
+    parser.add_argument('--format', choices=('auto', 'zip', 'tgz'), default='auto',
+                        help="archive format, by default the one compressing best")
+    parser.add_argument('--holdout', type=int, default=5,
+                        help="number of files held out for testing")
+    parser.add_argument('--prepare', choices=('wav', 'flac', 'ogg'),
+                        help="resample the training audio, remove the silences and "
+                        "encode it before packing (see audio_prep.py)")
+    parser.add_argument('--exclude-list',
+                        help="leave out the files of this list (see screen_audio.py)")
+    parser.add_argument('--upload', action='store_true',
+                        help="add the archives to the custom acoustic model")
+    args = parser.parse_args(argv)
+
+    # The test set does not depend on the exclusion list, so that results
+    # stay comparable from one screening to the next
+    files = list_audio(args.audio_dir)
+    test_files, train_files = files[:args.holdout], files[args.holdout:]
+    if args.exclude_list:
+        excluded = read_exclude_list(args.exclude_list)
+        kept = [f for f in train_files if os.path.abspath(f) not in excluded]
+        print("%d files left out by %s" % (len(train_files) - len(kept), args.exclude_list))
+        train_files = kept
+    os.makedirs(args.output_dir, exist_ok=True)
+    if test_files:
+        manifest = os.path.join(args.output_dir, args.prefix + '-test.txt')
+        write_manifest(manifest, test_files)
+        print("%d test files listed in %s" % (len(test_files), manifest))
+    if args.prepare and train_files:
+        try:
+            train_files = prepare_audio(train_files, args.output_dir, args.prepare)
+        except RuntimeError as e:
+            print(e)
+            return -1
+
+    zip_ratio, gzip_ratio = compression_ratios(train_files)
+    archive_format = args.format
+    if archive_format == 'auto':
+        archive_format = 'zip' if zip_ratio <= gzip_ratio else 'tgz'
+    ratio = zip_ratio if archive_format == 'zip' else gzip_ratio
+
+    # Keep 1MB below the limit, and 2% of margin for the compression ratio
+    # to vary from file to file.
+    limit = int(args.max_size * MB) - MB
+    capacity = int(limit / max(ratio, 0.01) * 0.98)
+    print("Packing %d files as %s (estimated compression %.0f%%)"
+          % (len(train_files), archive_format, ratio * 100))
+
+    archives = build_archives(train_files, args.output_dir, args.prefix,
+                              archive_format, capacity, limit)
+    if not args.upload:
+        for _ in archives:
+            pass
+        return 0
+
+    client = stt_client.get_client()
+    customization_id = env.get_acoustic_id()
+    failed = 0
+    # One upload at a time, while the next archives are being packed
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = [pool.submit(upload_archive, client, customization_id, path)
+                   for path in archives]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print("Failed to add audio: ", e)
+    return -1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os, sys, time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import env
+import stt_client
+import transcribe
+import uploader
+import waiter
+
+##########################################################################
+# Run the whole training workflow of README.md from a configuration file:
+#
+# {
+#   "language_model": {"name": "custom-model-1",
+#                      "corpora": ["corpus-1.txt"]},
+#   "acoustic_model": {"name": "acoustic-model-1",
+#                      "audio": ["audio-set1.zip", "audio-set2.zip"]},
+#   "transcribe": "audio-set-test.txt"
+# }
+#
+# The steps form a dependency graph.  The language model branch (create,
+# add corpora, train) and the acoustic model branch (create, add audio)
+# are independent and run concurrently; training the acoustic model waits
+# for both, and the test set is transcribed at the end.  Corpora are added
+# one after the other, and so are audio resources, since the service only
+# processes one at a time per model.
+#
+# Completed steps are recorded in a state file next to the configuration,
+# so that a failed or interrupted run resumes where it stopped.  Paths in
+# the configuration are relative to the configuration file.  An existing
+# model can be used by giving its "customization_id" instead of creating
+# a new one.
+##########################################################################
+
+
+class Step:
+
+    def __init__(self, name, function, depends=()):
+        self.name = name
+        self.function = function
+        self.depends = list(depends)
+
+
+class State:
+    # Outputs and timings of the completed steps, saved after every step
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'completed': {}, 'outputs': {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def is_completed(self, name):
+        return name in self.data['completed']
+
+    @property
+    def outputs(self):
+        return self.data['outputs']
+
+    def complete(self, name, elapsed, outputs):
+        with self.lock:
+            self.data['completed'][name] = {'elapsed': elapsed, 'finished': time.time()}
+            self.data['outputs'].update(outputs or {})
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+def run_graph(steps, state, workers):
+    # Run every step once all its dependencies are completed.  Returns the
+    # wall time of the steps run, the failed steps and the steps that could
+    # not run because a step they depend on failed.
+    timings, failed = {}, []
+    pending = dict((s.name, s) for s in steps if not state.is_completed(s.name))
+    running = {}
+
+    def ready(step):
+        return all(state.is_completed(d) for d in step.depends)
+
+    def run(step):
+        start = time.time()
+        print("[%s] started" % step.name)
+        outputs = step.function(dict(state.outputs))
+        elapsed = time.time() - start
+        state.complete(step.name, elapsed, outputs)
+        print("[%s] done in %.1fs" % (step.name, elapsed))
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name, step in list(pending.items()):
+                if ready(step):
+                    running[pool.submit(run, step)] = step
+                    del pending[name]
+            if not running:
+                # The remaining steps depend on a failed one
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    timings[step.name] = future.result()
+                except Exception as e:
+                    print("[%s] FAILED: %s" % (step.name, e))
+                    failed.append(step.name)
+    return timings, failed, sorted(pending)
+
+
+##########################################################################
+# Steps of the workflow
+##########################################################################
+
+def _check(r, expected, what):
+    if r.status_code != expected:
+        raise RuntimeError("%s returns %d: %s" % (what, r.status_code, r.text))
+    return r
+
+
+def _resource_names(paths, kind):
+    # The corpora and audio resources are sent under the name of their
+    # file, which is also the name of their step: two files with the same
+    # name would replace each other on the service and in the state file
+    names = {}
+    for path in paths:
+        name = os.path.basename(path)
+        if name in names:
+            raise ValueError("the %s %s and %s are both named %s"
+                             % (kind, names[name], path, name))
+        names[name] = path
+    return [(path, name) for name, path in names.items()]
+
+
+def build_steps(config, base_dir, client):
+    # Raises ValueError when two corpora or audio resources have the same
+    # name
+    def path(name):
+        return os.path.join(base_dir, name)
+
+    steps = []
+    lm = config.get('language_model')
+    am = config.get('acoustic_model')
+    timeout = env.get_wait_timeout()
+
+    if lm:
+        def create_language_model(outputs):
+            if lm.get('customization_id'):
+                return {'language_id': lm['customization_id']}
+            r = _check(client.create_language_model(
+                lm['name'], lm.get('base_model_name', stt_client.BASE_MODEL),
+                lm.get('description', "My narrowband language model")),
+                201, "Create language model")
+            return {'language_id': r.json()['customization_id']}
+        steps.append(Step('create_language_model', create_language_model))
+
+        previous = 'create_language_model'
+        for corpus, corpus_name in _resource_names(lm.get('corpora', []), 'corpora'):
+            def add_corpus(outputs, corpus=corpus, name=corpus_name):
+                uploader.upload_corpus(client, outputs['language_id'], path(corpus), name)
+                waiter.wait_for_corpus(client, outputs['language_id'], name, timeout=timeout)
+            name = 'add_corpus:' + corpus_name
+            steps.append(Step(name, add_corpus, [previous]))
+            previous = name
+
+        def train_language_model(outputs):
+            _check(client.train_language_model(outputs['language_id']), 200,
+                   "Train language model")
+            waiter.wait_for_language_model(client, outputs['language_id'], timeout=timeout)
+        steps.append(Step('train_language_model', train_language_model, [previous]))
+
+    if am:
+        def create_acoustic_model(outputs):
+            if am.get('customization_id'):
+                return {'acoustic_id': am['customization_id']}
+            r = _check(client.create_acoustic_model(
+                am['name'], am.get('base_model_name', stt_client.BASE_MODEL),
+                am.get('description', "My narrowband acoustic model")),
+                201, "Create acoustic model")
+            return {'acoustic_id': r.json()['customization_id']}
+        steps.append(Step('create_acoustic_model', create_acoustic_model))
+
+        previous = 'create_acoustic_model'
+        for audio, audio_name in _resource_names(am.get('audio', []), 'audio files'):
+            def add_audio(outputs, audio=audio, name=audio_name):
+                uploader.upload_audio(client, outputs['acoustic_id'], path(audio), name)
+                waiter.wait_for_audio(client, outputs['acoustic_id'], name, timeout=timeout)
+            name = 'add_audio:' + audio_name
+            steps.append(Step(name, add_audio, [previous]))
+            previous = name
+
+        depends = [previous] + (['train_language_model'] if lm else [])
+
+        def train_acoustic_model(outputs):
+            _check(client.train_acoustic_model(outputs['acoustic_id'],
+                                               outputs.get('language_id')),
+                   200, "Train acoustic model")
+            waiter.wait_for_acoustic_model(client, outputs['acoustic_id'], timeout=timeout)
+        steps.append(Step('train_acoustic_model', train_acoustic_model, depends))
+
+    if config.get('transcribe'):
+        def transcribe_test_set(outputs):
+            audio_files = transcribe.collect_audio_files(path(config['transcribe']))
+            stats = transcribe.transcribe_batch(client, audio_files,
+                                                outputs.get('language_id'),
+                                                outputs.get('acoustic_id'),
+                                                env.get_pool_size(), force=True)
+            transcribe.print_stats(stats)
+            if stats['failed']:
+                raise RuntimeError("%d files failed" % stats['failed'])
+        depends = [s.name for s in steps if s.name.startswith('train_')]
+        steps.append(Step('transcribe', transcribe_test_set, depends))
+
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the training pipeline")
+    parser.add_argument('config', help="pipeline configuration file (JSON)")
+    parser.add_argument('--state', help="state file (default: <config>.state.json)")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the state of a previous run")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="number of steps run at the same time")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        config = json.load(f)
+    try:
+        steps = build_steps(config, os.path.dirname(os.path.abspath(args.config)),
+                            stt_client.get_client())
+    except ValueError as e:
+        parser.error(str(e))
+    state_path = args.state or os.path.splitext(args.config)[0] + '.state.json'
+    if args.restart and os.path.exists(state_path):
+        os.remove(state_path)
+    state = State(state_path)
+    skipped = [s.name for s in steps if state.is_completed(s.name)]
+    if skipped:
+        print("Resuming, already completed: %s" % ', '.join(skipped))
+
+    start = time.time()
+    timings, failed, blocked = run_graph(steps, state, args.workers)
+
+    print("\nStage wall times:")
+    for step in steps:
+        if step.name in timings:
+            print("  %-40s %8.1fs" % (step.name, timings[step.name]))
+        elif step.name in failed:
+            print("  %-40s   FAILED" % step.name)
+        elif step.name in blocked:
+            print("  %-40s  not run" % step.name)
+    print("Total: %.1fs" % (time.time() - start))
+    for key, value in sorted(state.outputs.items()):
+        print("%s: %s" % (key, value))
+    return -1 if failed or blocked else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
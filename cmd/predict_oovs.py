@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import sys, time
+import env
+import word_cache
+
+##########################################################################
+# Predict the Out-Of-Vocabulary words that a corpus would add to the
+# custom language model, using the local word cache instead of uploading
+# the corpus.  The cache is filled by add_corpus.py; with --refresh, the
+# words predicted as new or as custom words are first checked against the
+# model, which also notices the custom words deleted since.
+##########################################################################
+
+corpus_file = env.get_arg("corpus filename")
+top = 50
+
+start = time.time()
+cache = word_cache.WordCache(env.get_language_id())
+counts = word_cache.count_words(corpus_file)
+custom, base, new = cache.predict(counts)
+
+if env.has_option('--refresh'):
+    import stt_client
+    found = cache.refresh(stt_client.get_client(), set(new) | set(custom))
+    cache.save()
+    print("Refreshed %d words from the model" % found)
+    custom, base, new = cache.predict(counts)
+
+if cache.updated is None:
+    print("No cached words for this model yet, run add_corpus.py or use --refresh")
+else:
+    print("Word cache updated ", time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(cache.updated)))
+
+print("\nCorpus %s: %d words, %d distinct" % (corpus_file, sum(counts.values()), len(counts)))
+print(" - %d custom words already in the model" % len(custom))
+print(" - %d words known by the base model" % len(base))
+print(" - %d expected new OOVs (%d occurrences)" % (len(new), sum(new.values())))
+for word, count in new.most_common(top):
+    print("  %8d  %s" % (count, word))
+print("\nPredicted in %.0f ms" % ((time.time() - start) * 1000))
+
+sys.exit(0)
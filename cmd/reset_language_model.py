@@ -1,12 +1,7 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
 
 ##########################################################################
 # Resets a custom language model by removing all corpora, grammars, and words from
@@ -18,9 +13,8 @@ requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 print("\nResetting custom language model...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/reset"
-r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+r = client.reset_language_model(env.get_language_id())
 
 print("Reset model returns: ", r.status_code)
 print(r.text)
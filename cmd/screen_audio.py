@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+import argparse
+import csv
+import hashlib
+import json
+import os, struct, sys, time
+from multiprocessing import Pool
+import numpy as np
+import env
+import stt_client
+from audio_prep import FRAME_MS, MIN_SPEECH_DB, THRESHOLD_DB, model_rate
+
+##########################################################################
+# Screen audio files before they are packed for the acoustic model, and
+# list the ones that would waste training time: too short, at a lower
+# sample rate than the model, with too many channels, clipped, too quiet,
+# too noisy or mostly silent.
+#
+# Each file is memory-mapped and its samples are read in place as a NumPy
+# array, a block of frames at a time, so a file is never copied into
+# memory as a whole.  The files are screened on all CPU cores, and the
+# measures are cached under STT_CACHE_DIR by the SHA-256 of the file: a
+# file that did not change (same size and modification time) is not read
+# again, and one that was renamed or copied is only hashed, not measured
+# again.  The thresholds are applied to the
+# cached measures, so changing them does not screen the files again.
+#
+# The exclusion list has one file per line, relative to the list, with the
+# problems found as a comment.  pack_audio.py --exclude-list leaves these
+# files out of the archives.
+#
+#   python screen_audio.py ../data/Audio --report screening.csv --exclude-list excluded.txt
+#   python pack_audio.py ../data/Audio --exclude-list excluded.txt
+##########################################################################
+
+# Changes when the measures change, to ignore the cached ones
+VERSION = 1
+
+# Frames read at a time
+BLOCK_FRAMES = 1 << 20
+
+# A sample at this fraction of the full scale is clipped
+CLIP_LEVEL = 0.999
+
+MIN_DURATION = 1.0
+MAX_CHANNELS = 2
+MAX_CLIPPING = 0.001
+MIN_RMS_DB = -45.0
+MIN_SNR_DB = 10.0
+MAX_SILENCE = 0.8
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+REPORT_FIELDS = ('path', 'sha256', 'duration', 'rate', 'channels', 'clipping', 'rms_db',
+                 'snr_db', 'silence', 'problems')
+
+
+class AudioError(Exception):
+    pass
+
+
+##########################################################################
+# Reading
+##########################################################################
+
+def wav_layout(data):
+    # Returns the format tag, channels, sample rate, bytes per sample and
+    # the offset and size of the samples of the WAV file in data
+    if len(data) < 12 or bytes(data[:4]) != b'RIFF' or bytes(data[8:12]) != b'WAVE':
+        raise AudioError("not a WAV file")
+    fmt = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk, size = struct.unpack_from('<4sI', data, position)
+        position += 8
+        if chunk == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', data, position)
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                tag = struct.unpack_from('<H', data, position + 24)[0]
+            fmt = (tag, channels, rate, (bits + 7) // 8)
+        elif chunk == b'data':
+            if fmt is None:
+                raise AudioError("no fmt chunk before the data")
+            # The size of a file written as a stream may be left at 0 or
+            # at its largest value
+            if not size or position + size > len(data):
+                size = len(data) - position
+            return fmt + (position, size)
+        position += size + (size & 1)
+    raise AudioError("no data chunk")
+
+
+def _to_float(block, tag, width):
+    # Samples of a block of raw bytes (frames x channels x width) as
+    # float32 in [-1, 1], frames x channels
+    if tag == WAVE_FORMAT_IEEE_FLOAT and width == 4:
+        samples = block.view('<f4')
+    elif tag != WAVE_FORMAT_PCM:
+        raise AudioError("unsupported format %d" % tag)
+    elif width == 1:
+        samples = (block.astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = block.view('<i2').astype(np.float32) / 32768
+    elif width == 3:
+        raw = block.astype(np.int32)
+        values = raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        samples = values.astype(np.float32) / (1 << 23)
+    elif width == 4:
+        samples = block.view('<i4').astype(np.float32) / (1 << 31)
+    else:
+        raise AudioError("unsupported sample width %d" % width)
+    return samples.reshape(len(block), -1)
+
+
+def measure(path, known=()):
+    # Returns the SHA-256 of the file and its measures, or None for the
+    # measures when the SHA-256 is one of the known ones
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    sha256 = hashlib.sha256(data).hexdigest()
+    if sha256 in known:
+        return sha256, None
+    tag, channels, rate, width, offset, size = wav_layout(data)
+    if not channels or not rate or not width:
+        raise AudioError("invalid fmt chunk")
+    frame_bytes = channels * width
+    frames = size // frame_bytes
+    samples = data[offset:offset + frames * frame_bytes].reshape(frames, channels, width)
+
+    # Energy of every FRAME_MS frame of the mono mix, and the clipped
+    # samples of every channel
+    frame_size = max(1, rate * FRAME_MS // 1000)
+    block_frames = max(frame_size, BLOCK_FRAMES // frame_size * frame_size)
+    # The largest value of 8-bit samples is 127/128
+    clip_level = min(CLIP_LEVEL, 1 - 1.5 / (1 << (8 * width - 1)))
+    energies = []
+    clipped = 0
+    power = 0.0
+    for start in range(0, frames, block_frames):
+        block = _to_float(samples[start:start + block_frames], tag, width)
+        clipped += int(np.count_nonzero(np.abs(block) >= clip_level))
+        mono = block.mean(axis=1) if channels > 1 else block[:, 0]
+        power += float(np.dot(mono, mono))
+        count = len(mono) // frame_size
+        if count:
+            f = mono[:count * frame_size].reshape(count, frame_size)
+            energies.append(np.einsum('ij,ij->i', f, f) / frame_size)
+    energies = 10 * np.log10(np.concatenate(energies) + 1e-12) if energies else np.zeros(0)
+
+    result = {'duration': frames / float(rate), 'rate': rate, 'channels': channels,
+              'clipping': clipped / float(max(frames * channels, 1)),
+              'rms_db': float(10 * np.log10(power / max(frames, 1) + 1e-12)),
+              'snr_db': 0.0, 'silence': 1.0}
+    if len(energies):
+        # The noise floor is the level of the quietest frames and the
+        # speech level the one of the loudest, as in audio_prep.py
+        floor, loud = np.percentile(energies, (10, 90))
+        result['snr_db'] = float(loud - floor)
+        result['silence'] = float(np.mean(energies <= max(floor + THRESHOLD_DB, MIN_SPEECH_DB)))
+    return sha256, result
+
+
+# The SHA-256 of the cached measures, in the worker processes
+_known = frozenset()
+
+
+def _init_worker(known):
+    global _known
+    _known = known
+
+
+def _measure_file(path):
+    try:
+        sha256, result = measure(path, _known)
+    except (AudioError, OSError, ValueError) as e:
+        return path, None, {'error': str(e)}
+    return path, sha256, result
+
+
+##########################################################################
+# Screening
+##########################################################################
+
+def problems(result, rate=8000, min_duration=MIN_DURATION, max_clipping=MAX_CLIPPING,
+             min_rms_db=MIN_RMS_DB, min_snr_db=MIN_SNR_DB, max_silence=MAX_SILENCE):
+    # The problems of a file, from its measures
+    if 'error' in result:
+        return ['unreadable']
+    found = []
+    if result['rate'] < rate:
+        found.append('rate')
+    if result['channels'] > MAX_CHANNELS:
+        found.append('channels')
+    if result['duration'] < min_duration:
+        found.append('short')
+    if result['clipping'] > max_clipping:
+        found.append('clipped')
+    if result['rms_db'] < min_rms_db:
+        found.append('quiet')
+    if result['snr_db'] < min_snr_db:
+        found.append('noisy')
+    if result['silence'] > max_silence:
+        found.append('silent')
+    return found
+
+
+class ScreeningCache:
+    # Measures by SHA-256, and the SHA-256 of the files by path, size and
+    # modification time
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(env.get_cache_dir('screening'), 'measures.json')
+        self.files = {}
+        self.results = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == VERSION:
+                self.files = data['files']
+                self.results = data['results']
+
+    def lookup(self, path):
+        stat = os.stat(path)
+        entry = self.files.get(os.path.abspath(path))
+        if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2], self.results.get(entry[2])
+        return None, None
+
+    def add(self, path, sha256, result):
+        stat = os.stat(path)
+        self.files[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, sha256]
+        self.results[sha256] = result
+
+    def save(self):
+        # Forgets the files which no longer exist, and the measures of no
+        # remaining file
+        self.files = dict((path, entry) for path, entry in self.files.items()
+                          if os.path.exists(path))
+        used = set(entry[2] for entry in self.files.values())
+        self.results = dict((sha256, result) for sha256, result in self.results.items()
+                            if sha256 in used)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'version': VERSION, 'files': self.files, 'results': self.results}, f)
+        os.replace(tmp, self.path)
+
+
+def screen_files(paths, cache=None, workers=None):
+    # Yields (path, sha256, measures, cached) for every file, in the order
+    # of the paths; the files not in the cache are measured on all CPU
+    # cores, after hashing them: a renamed or copied file gets the
+    # measures cached for its content
+    found = {}
+    missing = []
+    for path in paths:
+        sha256, result = cache.lookup(path) if cache else (None, None)
+        if result is None:
+            missing.append(path)
+        else:
+            found[path] = (sha256, result, True)
+    if missing:
+        known = frozenset(cache.results) if cache else frozenset()
+        with Pool(workers, _init_worker, (known,)) as pool:
+            chunksize = max(1, min(64, len(missing) // (4 * (workers or os.cpu_count() or 1))))
+            for path, sha256, result in pool.imap_unordered(_measure_file, missing, chunksize):
+                cached = result is None
+                if cached:
+                    result = cache.results[sha256]
+                found[path] = (sha256, result, cached)
+                if cache and sha256:
+                    cache.add(path, sha256, result)
+    for path in paths:
+        yield (path,) + found[path]
+
+
+def write_report(path, rows):
+    if path.lower().endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, problems=' '.join(row['problems'])))
+
+
+def write_exclude_list(path, rows):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'w') as f:
+        for row in rows:
+            if row['problems']:
+                f.write("%s  # %s\n" % (os.path.relpath(os.path.abspath(row['path']), base),
+                                        ', '.join(row['problems'])))
+
+
+def main(argv=None):
+    import transcribe
+    parser = argparse.ArgumentParser(description="Screen audio files before training")
+    parser.add_argument('audio', help="audio file, directory, glob pattern or manifest")
+    parser.add_argument('--model', default=stt_client.BASE_MODEL,
+                        help="model whose sample rate the files need")
+    parser.add_argument('--report', help="write the measures to this CSV or JSON file")
+    parser.add_argument('--exclude-list', help="write the files to leave out to this file")
+    parser.add_argument('--min-duration', type=float, default=MIN_DURATION,
+                        help="shortest audio in seconds (default %(default)s)")
+    parser.add_argument('--max-clipping', type=float, default=MAX_CLIPPING,
+                        help="largest fraction of clipped samples (default %(default)s)")
+    parser.add_argument('--min-rms', type=float, default=MIN_RMS_DB,
+                        help="lowest level in dBFS (default %(default)s)")
+    parser.add_argument('--min-snr', type=float, default=MIN_SNR_DB,
+                        help="lowest estimated signal to noise ratio in dB (default %(default)s)")
+    parser.add_argument('--max-silence', type=float, default=MAX_SILENCE,
+                        help="largest fraction of silence (default %(default)s)")
+    parser.add_argument('--workers', type=int, help="number of processes")
+    parser.add_argument('--no-cache', action='store_true', help="measure every file again")
+    args = parser.parse_args(argv)
+
+    if os.path.isfile(args.audio) and args.audio.lower().endswith('.wav'):
+        paths = [args.audio]
+    else:
+        paths = transcribe.collect_audio_files(args.audio)
+    cache = None if args.no_cache else ScreeningCache()
+    thresholds = dict(rate=model_rate(args.model), min_duration=args.min_duration,
+                      max_clipping=args.max_clipping, min_rms_db=args.min_rms,
+                      min_snr_db=args.min_snr, max_silence=args.max_silence)
+
+    start = time.time()
+    rows = []
+    counts = {}
+    measured = 0
+    for path, sha256, result, cached in screen_files(paths, cache, args.workers):
+        measured += not cached
+        found = problems(result, **thresholds)
+        rows.append(dict(result, path=path, sha256=sha256, problems=found))
+        for problem in found:
+            counts[problem] = counts.get(problem, 0) + 1
+        if found:
+            print("%-40s %s" % (path, ', '.join(found) if 'error' not in result
+                                else 'unreadable: ' + result['error']))
+    if cache:
+        cache.save()
+
+    excluded = sum(1 for row in rows if row['problems'])
+    duration = sum(row.get('duration', 0) for row in rows)
+    kept = sum(row.get('duration', 0) for row in rows if not row['problems'])
+    print("\n%d files screened in %.1fs (%d measured), %d to exclude: %s"
+          % (len(rows), time.time() - start, measured, excluded,
+             ', '.join('%d %s' % (counts[p], p) for p in sorted(counts)) or 'none'))
+    print("Audio kept: %.1f of %.1f minutes" % (kept / 60, duration / 60))
+    if args.report:
+        write_report(args.report, rows)
+    if args.exclude_list:
+        write_exclude_list(args.exclude_list, rows)
+        print("Exclusion list written to %s" % args.exclude_list)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
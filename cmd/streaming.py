@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+import os, sys, time
+import threading
+from urllib.parse import urlencode
+import requests
+import websocket
+import env
+import metrics
+
+##########################################################################
+# Streaming recognition over the WebSocket interface of the service.
+#
+# The audio is sent in fixed-size binary chunks while the results are
+# received on the same connection, so interim and final hypotheses can be
+# shown and written out as soon as the service produces them instead of
+# after the whole file has been recognized.
+#
+# Protocol:
+# - send a text message {"action": "start", ...} with the recognize options
+# - send the audio as binary messages
+# - send a text message {"action": "stop"}
+# - the service answers with {"state": "listening"} once it is ready, then
+#   with {"results": [...], "result_index": n} messages, and again with
+#   {"state": "listening"} when all the audio has been processed.
+##########################################################################
+
+IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+
+DEFAULT_CHUNK_SIZE = 8192
+
+
+def get_iam_token(apikey):
+    iam_url = os.environ.get('STT_IAM_URL', IAM_URL)
+    data = {'grant_type': "urn:ibm:params:oauth:grant-type:apikey",
+            'apikey': apikey}
+    r = requests.post(iam_url, data=data, timeout=env.get_timeout())
+    r.raise_for_status()
+    return r.json()['access_token']
+
+
+def websocket_url(endpoint):
+    if endpoint.startswith('https://'):
+        return 'wss://' + endpoint[len('https://'):]
+    if endpoint.startswith('http://'):
+        return 'ws://' + endpoint[len('http://'):]
+    return endpoint
+
+
+def connect(model="en-US_NarrowbandModel", language_customization_id=None,
+            acoustic_customization_id=None):
+    params = {'model': model}
+    if language_customization_id:
+        params['language_customization_id'] = language_customization_id
+    if acoustic_customization_id:
+        params['acoustic_customization_id'] = acoustic_customization_id
+
+    # IAM credentials need a bearer token, the legacy credentials use
+    # basic authentication on the handshake.
+    header = []
+    username, password = env.get_username(), env.get_password()
+    if username == 'apikey':
+        params['access_token'] = get_iam_token(password)
+    else:
+        credentials = ('%s:%s' % (username, password)).encode('utf-8')
+        header.append('Authorization: Basic ' +
+                      base64.b64encode(credentials).decode('ascii'))
+
+    # STT_WS_ENDPOINT can point the stream at another server, such as a
+    # local stand-in, otherwise it is derived from STT_ENDPOINT.
+    endpoint = os.environ.get('STT_WS_ENDPOINT') or websocket_url(env.get_endpoint())
+    url = endpoint.rstrip('/') + "/v1/recognize?" + urlencode(params)
+    return websocket.create_connection(url, header=header,
+                                       timeout=env.get_timeout()[1],
+                                       sslopt={'cert_reqs': 0})
+
+
+def send_audio(ws, audio_file, content_type, chunk_size):
+    start = {'action': 'start', 'content-type': content_type,
+             'interim_results': True}
+    ws.send(json.dumps(start))
+    with open(audio_file, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            ws.send(chunk, websocket.ABNF.OPCODE_BINARY)
+    ws.send(json.dumps({'action': 'stop'}))
+
+
+def recognize_stream(ws, audio_file, content_type="audio/wav",
+                     chunk_size=DEFAULT_CHUNK_SIZE, on_interim=None,
+                     on_final=None):
+    # Stream the audio from a separate thread and handle the results as
+    # they arrive.  Returns the timing statistics of the recognition.
+    stats = {'first_result': None, 'first_final': None, 'finals': 0}
+    errors = []
+    recorder = metrics.get_metrics()
+
+    def sender():
+        try:
+            send_audio(ws, audio_file, content_type, chunk_size)
+        except Exception as e:
+            errors.append(e)
+
+    start = time.time()
+    thread = threading.Thread(target=sender)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        received = _receive(ws, start, stats, on_interim, on_final)
+    except Exception as e:
+        if recorder:
+            recorder.observe('WS', '/v1/recognize', type(e).__name__, time.time() - start)
+        raise
+    thread.join()
+    if errors:
+        raise errors[0]
+    stats['elapsed'] = time.time() - start
+    if recorder:
+        recorder.observe('WS', '/v1/recognize', 101, stats['elapsed'],
+                         ttfb=stats['first_result'], request_bytes=os.path.getsize(audio_file),
+                         response_bytes=received)
+    return stats
+
+
+def _receive(ws, start, stats, on_interim, on_final):
+    # Handles the messages until all the audio is recognized, returns the
+    # number of bytes received
+    received = 0
+    listening = 0
+    while True:
+        data = ws.recv()
+        received += len(data)
+        message = json.loads(data)
+        if 'error' in message:
+            raise RuntimeError(message['error'])
+        if message.get('state') == 'listening':
+            # The first one acknowledges the start message, the second
+            # one tells that all the audio has been recognized.
+            listening += 1
+            if listening == 2:
+                break
+            continue
+        for result in message.get('results', []):
+            transcript = result['alternatives'][0]['transcript']
+            now = time.time() - start
+            if stats['first_result'] is None:
+                stats['first_result'] = now
+            if result.get('final'):
+                if stats['first_final'] is None:
+                    stats['first_final'] = now
+                stats['finals'] += 1
+                if on_final:
+                    on_final(transcript)
+            elif on_interim:
+                on_interim(transcript)
+    return received
+
+
+def transcribe_streaming(audio_file, output_path, language_id=None,
+                         acoustic_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Print the hypotheses as they come and append every final result to
+    # the transcript file, so nothing but the current result is kept.
+    interactive = sys.stdout.isatty()
+
+    with open(output_path, 'w') as output_file:
+        def on_interim(transcript):
+            if interactive:
+                sys.stdout.write('\r' + transcript)
+                sys.stdout.flush()
+
+        def on_final(transcript):
+            sys.stdout.write(('\r' if interactive else '') + transcript + '\n')
+            sys.stdout.flush()
+            output_file.write(transcript)
+            output_file.flush()
+
+        ws = connect(language_customization_id=language_id,
+                     acoustic_customization_id=acoustic_id)
+        try:
+            return recognize_stream(ws, audio_file, chunk_size=chunk_size,
+                                    on_interim=on_interim, on_final=on_final)
+        finally:
+            ws.close()
+
+
+def print_stats(stats):
+    def seconds(value):
+        return "n/a" if value is None else "%.3fs" % value
+
+    print("\nTime to first result: %s, to first final result: %s, total: %.3fs"
+          % (seconds(stats['first_result']), seconds(stats['first_final']),
+             stats['elapsed']))
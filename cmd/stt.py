@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import os, sys, time
+
+##########################################################################
+# Single entry point for the scripts of this directory:
+#
+#   python stt.py list-corpus
+#   python stt.py add-corpus corpus-1.txt
+#   python stt.py batch nightly.stt
+#
+# A command runs its script in this process, with the arguments that
+# follow it, and only imports the modules that script needs.
+#
+# The batch command runs a script of commands, one per line, in a single
+# process: the interpreter starts once, and all the commands share the
+# pool of connections of stt_client.get_client().  In a batch script,
+# blank lines and lines starting with '#' are skipped, and a line of
+# NAME=value assignments sets environment variables for the next commands,
+# while assignments before a command only apply to it:
+#
+#   LANGUAGE_ID=5f3a...
+#   add-corpus corpus-1.txt
+#   train-lm
+#   ACOUSTIC_ID=9e1c... train-am --no-wait
+#
+# The batch stops at the first command that fails, unless --keep-going is
+# given.
+##########################################################################
+
+COMMANDS = [
+    ('list-models', 'list_all_models', "list the base models"),
+    ('create-lm', 'create_language_model', "create a custom language model"),
+    ('list-lm', 'list_language_model', "list the custom language models"),
+    ('delete-lm', 'delete_language_model', "delete the custom language model"),
+    ('reset-lm', 'reset_language_model', "reset the custom language model"),
+    ('train-lm', 'train_language_model', "train the custom language model"),
+    ('add-corpus', 'add_corpus', "add a corpus file"),
+    ('list-corpus', 'list_corpus', "list the corpora"),
+    ('delete-corpus', 'delete_corpus', "delete a corpus"),
+    ('sync-corpus', 'sync_corpus', "upload the changed shards of a corpus"),
+    ('predict-oovs', 'predict_oovs', "predict the new words of a corpus"),
+    ('sync-words', 'sync_words', "make the custom words match a list"),
+    ('create-am', 'create_acoustic_model', "create a custom acoustic model"),
+    ('list-am', 'list_acoustic_model', "list the custom acoustic models"),
+    ('delete-am', 'delete_acoustic_model', "delete the custom acoustic model"),
+    ('train-am', 'train_acoustic_model', "train the custom acoustic model"),
+    ('add-audio', 'add_audio', "add an audio file or archive"),
+    ('list-audio', 'list_audio', "list the audio resources"),
+    ('delete-audio', 'delete_audio', "delete an audio resource"),
+    ('screen-audio', 'screen_audio', "list the audio files unfit for training"),
+    ('pack-audio', 'pack_audio', "pack audio files into archives"),
+    ('prepare-audio', 'audio_prep', "resample, trim and encode audio files"),
+    ('transcribe', 'transcribe', "transcribe audio files"),
+    ('store', 'transcript_store', "query the transcript store"),
+    ('evaluate', 'evaluate', "measure the word and character error rates"),
+    ('pipeline', 'pipeline', "run the whole workflow"),
+    ('fanout', 'fanout', "run an operation on many custom models"),
+    ('inventory', 'inventory', "query the local inventory of the models"),
+    ('mock-server', 'mock_server', "run a local stand-in for the service"),
+    ('benchmark', 'benchmark', "benchmark the operations of the scripts"),
+]
+MODULES = dict((name, module) for name, module, _ in COMMANDS)
+
+
+def usage():
+    print("usage: stt.py <command> [arguments]\n       stt.py batch [--keep-going] <file or ->\n")
+    print("commands:")
+    for name, _, description in COMMANDS:
+        print("  %-16s %s" % (name, description))
+    print("  %-16s %s" % ('batch', "run a script of commands in this process"))
+
+
+def run(command, argv):
+    # Runs the script of command as __main__ with argv as its arguments and
+    # returns its exit status
+    import runpy
+    module = MODULES[command]
+    saved = sys.argv
+    sys.argv = [module + '.py'] + list(argv)
+    try:
+        runpy.run_module(module, run_name='__main__', alter_sys=True)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code)
+        return 1
+    except Exception as e:
+        # An error of one command stops the batch only without --keep-going
+        print("%s failed: %s" % (command, e))
+        return 1
+    finally:
+        sys.argv = saved
+        sys.stdout.flush()
+
+
+def _assignment(token):
+    name, sep, _ = token.partition('=')
+    return sep and name.replace('_', 'A').isalnum() and not name[0].isdigit()
+
+
+def run_batch(lines, keep_going=False):
+    import shlex
+    timings = []
+    status = 0
+    for number, line in enumerate(lines, 1):
+        tokens = shlex.split(line, comments=True)
+        if not tokens:
+            continue
+        assignments = []
+        while tokens and _assignment(tokens[0]):
+            assignments.append(tokens.pop(0).split('=', 1))
+        if not tokens:
+            os.environ.update(assignments)
+            continue
+        command, argv = tokens[0], tokens[1:]
+        if command not in MODULES:
+            print("line %d: unknown command %s" % (number, command))
+            status = 1
+            if not keep_going:
+                break
+            continue
+
+        saved = dict((name, os.environ.get(name)) for name, _ in assignments)
+        os.environ.update(assignments)
+        start = time.time()
+        try:
+            code = run(command, argv)
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        timings.append((number, line.strip(), code, time.time() - start))
+        if code:
+            print("line %d: %s exits with status %s" % (number, command, code))
+            status = code
+            if not keep_going:
+                break
+
+    print("\n%-6s %-50s %6s %9s" % ('line', 'command', 'status', 'seconds'))
+    for number, line, code, elapsed in timings:
+        print("%-6d %-50s %6s %9.3f" % (number, line[:50], code, elapsed))
+    print("%d commands in %.3fs" % (len(timings), sum(t[3] for t in timings)))
+    return status
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help', 'help'):
+        usage()
+        return 0
+    if argv[0] == 'batch':
+        options = argv[1:]
+        keep_going = '--keep-going' in options
+        files = [o for o in options if o != '--keep-going']
+        if len(files) != 1:
+            usage()
+            return 2
+        if files[0] == '-':
+            return run_batch(sys.stdin.readlines(), keep_going)
+        with open(files[0]) as f:
+            return run_batch(f.readlines(), keep_going)
+    if argv[0] not in MODULES:
+        print("Unknown command: %s\n" % argv[0])
+        usage()
+        return 2
+    return run(argv[0], argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
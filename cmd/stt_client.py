@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+import json
+import os, time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from requests.packages.urllib3.util.retry import Retry
+from urllib.parse import quote
+import env
+import inventory
+import metrics
+
+requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+
+##########################################################################
+# Client for the Watson Speech to Text customization and recognition API.
+#
+# All requests go through a single requests.Session so that TCP and TLS
+# connections are kept alive and reused across calls, instead of paying a
+# new handshake for every request.  Throttled (429) and failed (5xx)
+# requests are retried with exponential backoff.
+#
+# Every method returns the requests.Response so that callers can check
+# the status code and print the body, as the scripts in this directory do.
+##########################################################################
+
+BASE_MODEL = "en-US_NarrowbandModel"
+
+# Statuses that are safe to retry for any method: the request was rejected
+# before the service did anything with it.
+ALWAYS_RETRY_STATUS = (429, 503)
+
+# Statuses that are only retried for idempotent methods.
+IDEMPOTENT_RETRY_STATUS = (500, 502, 504)
+
+AUDIO_CONTENT_TYPES = {
+    '.zip': "application/zip",
+    '.gz': "application/gzip",
+    '.tgz': "application/gzip",
+    '.wav': "audio/wav",
+    '.flac': "audio/flac",
+    '.ogg': "audio/ogg",
+    '.mp3': "audio/mp3",
+}
+
+
+# The rate limiter of the request being sent by the thread
+_attempt = threading.local()
+
+
+class _Retry(Retry):
+
+    def sleep(self, response=None):
+        # A retry is one more request for the rate limiter: it waits for a
+        # token after the backoff as the first attempt does
+        super(_Retry, self).sleep(response)
+        acquire = getattr(_attempt, 'acquire', None)
+        if acquire is not None:
+            acquire()
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # POST is not idempotent, but a throttled or unavailable response
+        # means the request was never processed and can be sent again.
+        if status_code in ALWAYS_RETRY_STATUS:
+            return bool(self.total)
+        return super(_Retry, self).is_retry(method, status_code, has_retry_after)
+
+
+def _query_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+def content_type_for(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return AUDIO_CONTENT_TYPES.get(extension, "application/octet-stream")
+
+
+class SpeechClient:
+
+    def __init__(self, endpoint, username, password, pool_size=10,
+                 timeout=(10, 300), max_retries=5, backoff_factor=0.5,
+                 verify=False):
+        self.endpoint = endpoint.rstrip('/')
+        self.timeout = timeout
+
+        self.retry = _Retry(total=max_retries,
+                            backoff_factor=backoff_factor,
+                            status_forcelist=IDEMPOTENT_RETRY_STATUS,
+                            respect_retry_after_header=True,
+                            raise_on_status=False)
+
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.verify = verify
+        self.set_pool_size(pool_size)
+        self.metrics = metrics.get_metrics()
+        # Object with an acquire(path, params) method called before every
+        # request and before every retry, such as the fanout.RateLimiter
+        self.rate_limiter = None
+
+    def close(self):
+        self.session.close()
+
+    def set_pool_size(self, pool_size):
+        # Keeps up to pool_size connections open, which should be the number
+        # of threads sending requests: the connections beyond are closed
+        # after every request
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=self.retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, path, params=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if params:
+            params = dict((k, _query_value(v)) for k, v in params.items()
+                          if v is not None)
+        if self.rate_limiter is not None:
+            limiter = self.rate_limiter
+            limiter.acquire(path, params)
+            _attempt.acquire = lambda: limiter.acquire(path, params)
+        try:
+            if self.metrics is None:
+                r = self.session.request(method, self.endpoint + path,
+                                         params=params, **kwargs)
+            else:
+                start = time.time()
+                try:
+                    r = self.session.request(method, self.endpoint + path,
+                                             params=params, **kwargs)
+                except requests.RequestException as e:
+                    self.metrics.record_error(method, path, e, time.time() - start)
+                    raise
+                self.metrics.record(method, path, r, time.time() - start)
+        finally:
+            _attempt.acquire = None
+        if method != 'GET' and r.status_code < 400:
+            # The listings of the inventory that this change makes stale
+            # are fetched again by the next list_* script
+            inventory.record_change(self, path)
+        return r
+
+    def _json(self, method, path, data=None, params=None, etag=None):
+        # With the ETag of a previous response, an unchanged resource is
+        # answered 304 without a body
+        headers = {'Content-Type': "application/json"}
+        if etag:
+            headers['If-None-Match'] = etag
+        if data is not None:
+            data = json.dumps(data).encode('utf-8')
+        return self.request(method, path, params=params, headers=headers,
+                            data=data)
+
+    ######################################################################
+    # Base models
+    ######################################################################
+
+    def list_models(self, etag=None):
+        return self._json('GET', "/v1/models", etag=etag)
+
+    ######################################################################
+    # Custom language models
+    ######################################################################
+
+    def create_language_model(self, name, base_model_name=BASE_MODEL,
+                              description="My narrowband language model"):
+        data = {"name": name, "base_model_name": base_model_name,
+                "description": description}
+        return self._json('POST', "/v1/customizations", data=data)
+
+    def list_language_models(self, etag=None):
+        return self._json('GET', "/v1/customizations", etag=etag)
+
+    def get_language_model(self, customization_id, etag=None):
+        return self._json('GET', "/v1/customizations/" + quote(customization_id),
+                          etag=etag)
+
+    def delete_language_model(self, customization_id):
+        return self._json('DELETE', "/v1/customizations/" + quote(customization_id))
+
+    def train_language_model(self, customization_id, **params):
+        return self._json('POST', "/v1/customizations/" +
+                          quote(customization_id) + "/train", params=params)
+
+    def reset_language_model(self, customization_id):
+        return self._json('POST', "/v1/customizations/" +
+                          quote(customization_id) + "/reset")
+
+    ######################################################################
+    # Corpora
+    ######################################################################
+
+    def _corpora_path(self, customization_id, corpus_name=None):
+        path = "/v1/customizations/" + quote(customization_id) + "/corpora"
+        if corpus_name is not None:
+            path += "/" + quote(corpus_name, safe='')
+        return path
+
+    def add_corpus(self, customization_id, corpus_name, corpus_file,
+                   allow_overwrite=False):
+        params = {'allow_overwrite': 'true'} if allow_overwrite else None
+        headers = {'Content-Type': "application/json"}
+        return self.request('POST',
+                            self._corpora_path(customization_id, corpus_name),
+                            params=params, headers=headers, data=corpus_file)
+
+    def list_corpora(self, customization_id, etag=None):
+        return self._json('GET', self._corpora_path(customization_id), etag=etag)
+
+    def get_corpus(self, customization_id, corpus_name):
+        return self._json('GET', self._corpora_path(customization_id, corpus_name))
+
+    def delete_corpus(self, customization_id, corpus_name):
+        return self._json('DELETE', self._corpora_path(customization_id, corpus_name))
+
+    ######################################################################
+    # Custom words
+    ######################################################################
+
+    def _words_path(self, customization_id, word=None):
+        path = "/v1/customizations/" + quote(customization_id) + "/words"
+        if word is not None:
+            path += "/" + quote(word, safe='')
+        return path
+
+    def list_words(self, customization_id, word_type=None, sort=None):
+        params = {}
+        if word_type is not None:
+            params['word_type'] = word_type
+        if sort is not None:
+            params['sort'] = sort
+        return self._json('GET', self._words_path(customization_id), params=params)
+
+    def add_words(self, customization_id, words):
+        return self._json('POST', self._words_path(customization_id),
+                          data={"words": words})
+
+    def get_word(self, customization_id, word):
+        return self._json('GET', self._words_path(customization_id, word))
+
+    def delete_word(self, customization_id, word):
+        return self._json('DELETE', self._words_path(customization_id, word))
+
+    ######################################################################
+    # Custom acoustic models
+    ######################################################################
+
+    def create_acoustic_model(self, name, base_model_name=BASE_MODEL,
+                              description="My narrowband acoustic model"):
+        data = {"name": name, "base_model_name": base_model_name,
+                "description": description}
+        return self._json('POST', "/v1/acoustic_customizations", data=data)
+
+    def list_acoustic_models(self, etag=None):
+        return self._json('GET', "/v1/acoustic_customizations", etag=etag)
+
+    def get_acoustic_model(self, customization_id, etag=None):
+        return self._json('GET', "/v1/acoustic_customizations/" +
+                          quote(customization_id), etag=etag)
+
+    def delete_acoustic_model(self, customization_id):
+        return self._json('DELETE', "/v1/acoustic_customizations/" +
+                          quote(customization_id))
+
+    def train_acoustic_model(self, customization_id,
+                             custom_language_model_id=None):
+        params = {}
+        if custom_language_model_id:
+            params['custom_language_model_id'] = custom_language_model_id
+        return self._json('POST', "/v1/acoustic_customizations/" +
+                          quote(customization_id) + "/train", params=params)
+
+    def reset_acoustic_model(self, customization_id):
+        return self._json('POST', "/v1/acoustic_customizations/" +
+                          quote(customization_id) + "/reset")
+
+    ######################################################################
+    # Audio resources
+    ######################################################################
+
+    def _audio_path(self, customization_id, audio_name=None):
+        path = "/v1/acoustic_customizations/" + quote(customization_id) + "/audio"
+        if audio_name is not None:
+            path += "/" + quote(audio_name, safe='')
+        return path
+
+    def add_audio(self, customization_id, audio_name, audio_file,
+                  content_type=None, allow_overwrite=False):
+        if content_type is None:
+            content_type = content_type_for(audio_name)
+        params = {'allow_overwrite': 'true'} if allow_overwrite else None
+        headers = {'Content-Type': content_type}
+        return self.request('POST',
+                            self._audio_path(customization_id, audio_name),
+                            params=params, headers=headers, data=audio_file)
+
+    def list_audio(self, customization_id, etag=None):
+        return self._json('GET', self._audio_path(customization_id), etag=etag)
+
+    def get_audio(self, customization_id, audio_name):
+        return self._json('GET', self._audio_path(customization_id, audio_name))
+
+    def delete_audio(self, customization_id, audio_name):
+        return self._json('DELETE', self._audio_path(customization_id, audio_name))
+
+    ######################################################################
+    # Recognition
+    ######################################################################
+
+    def recognize(self, audio, content_type="audio/wav", model=BASE_MODEL,
+                  language_customization_id=None,
+                  acoustic_customization_id=None, **params):
+        params['model'] = model
+        if language_customization_id:
+            params['language_customization_id'] = language_customization_id
+        if acoustic_customization_id:
+            params['acoustic_customization_id'] = acoustic_customization_id
+        headers = {'Content-Type': content_type}
+        return self.request('POST', "/v1/recognize", params=params,
+                            headers=headers, data=audio)
+
+
+def from_env():
+    return SpeechClient(env.get_endpoint(), env.get_username(),
+                        env.get_password(), pool_size=env.get_pool_size(),
+                        timeout=env.get_timeout(),
+                        max_retries=env.get_max_retries())
+
+
+_client = None
+
+
+def get_client():
+    # One client per process, so that every caller shares the same pool.
+    global _client
+    if _client is None:
+        _client = from_env()
+    return _client
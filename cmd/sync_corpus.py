@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os, re, sys, time
+from concurrent.futures import ThreadPoolExecutor
+import env
+import stt_client
+import uploader
+import waiter
+import word_cache
+
+##########################################################################
+# Make the corpora of the language model (LANGUAGE_ID) match a corpus
+# built as shards by data/build_corpus.py --shard-dir, then train the
+# model once.
+#
+# The shards are named after their content, so a shard already on the
+# model is unchanged and keeps its analysis.  Only the new shards are
+# uploaded and analyzed, one at a time as the service requires, and the
+# corpora with the same prefix that are no longer in the manifest are
+# deleted.  After an edit of the documents, the time spent uploading and
+# analyzing depends on the size of the change, not of the corpus.
+#
+#   python ../data/build_corpus.py --shard-dir shards ../data/Documents
+#   python sync_corpus.py shards
+##########################################################################
+
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def plan(manifest, corpora):
+    # Returns the shards to upload and the corpus names to delete.  corpora
+    # is the 'corpora' list of the service; a shard whose analysis failed
+    # is uploaded again.
+    pattern = re.compile(re.escape(manifest['prefix']) + r'-[0-9a-f]{16}\.txt$')
+    current = dict((c['name'], c) for c in corpora if pattern.match(c['name']))
+    wanted = set(shard['name'] for shard in manifest['shards'])
+    upload = []
+    names = set()
+    for shard in manifest['shards']:
+        corpus = current.get(shard['name'])
+        if corpus is None or corpus['status'] in waiter.CORPUS_FAILED:
+            # Identical shards have the same name and are uploaded once
+            if shard['name'] not in names:
+                upload.append(shard)
+                names.add(shard['name'])
+    delete = sorted(name for name in current if name not in wanted)
+    return upload, delete
+
+
+def delete_corpora(client, language_id, names):
+    # Returns the names that could not be deleted
+    def delete(name):
+        r = client.delete_corpus(language_id, name)
+        if r.status_code not in (200, 404):
+            print("Deleting corpus %s returns %d: %s" % (name, r.status_code, r.text))
+            return name
+        return None
+
+    with ThreadPoolExecutor(max_workers=env.get_pool_size()) as pool:
+        return [name for name in pool.map(delete, names) if name is not None]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Upload the changed shards of a corpus")
+    parser.add_argument('shard_dir', help="directory written by build_corpus.py --shard-dir")
+    parser.add_argument('--dry-run', action='store_true', help="only show the changes")
+    parser.add_argument('--no-train', action='store_true',
+                        help="do not train the model after the changes")
+    args = parser.parse_args(argv)
+
+    manifest = read_manifest(args.shard_dir)
+    language_id = env.get_language_id()
+    client = stt_client.get_client()
+    timeout = env.get_wait_timeout()
+    start = time.time()
+
+    r = client.list_corpora(language_id)
+    if r.status_code != 200:
+        print("Listing corpora returns %d: %s" % (r.status_code, r.text))
+        return -1
+    corpora = r.json()['corpora']
+    upload, delete = plan(manifest, corpora)
+    total = sum(shard['bytes'] for shard in manifest['shards'])
+    changed = sum(shard['bytes'] for shard in upload)
+    print("%d shards (%.1f MB): %d to upload (%.1f MB), %d corpora to delete"
+          % (len(manifest['shards']), total / 1e6, len(upload), changed / 1e6, len(delete)))
+    if args.dry_run:
+        for shard in upload:
+            print("  + %s" % shard['name'])
+        for name in delete:
+            print("  - %s" % name)
+        return 0
+
+    try:
+        # The service analyzes one corpus at a time: wait for the ones left
+        # by a previous run
+        for corpus in corpora:
+            if corpus['status'] == 'being_processed':
+                waiter.wait_for_corpus(client, language_id, corpus['name'], timeout=timeout)
+
+        failed = delete_corpora(client, language_id, delete)
+        if failed:
+            print("%d corpora could not be deleted" % len(failed))
+            return -1
+        deleted = time.time()
+
+        names = set(corpus['name'] for corpus in corpora) - set(delete)
+        for number, shard in enumerate(upload, 1):
+            path = os.path.join(args.shard_dir, shard['name'])
+            uploader.upload_corpus(client, language_id, path, shard['name'], force=True,
+                                   names=names)
+            waiter.wait_for_corpus(client, language_id, shard['name'], timeout=timeout)
+            print("%d/%d %s analyzed" % (number, len(upload), shard['name']))
+        analyzed = time.time()
+    except (uploader.UploadError, waiter.WaitError) as e:
+        print("Failed to update the corpora: ", e)
+        return -1
+
+    if upload:
+        # Keep the word cache of predict_oovs.py up to date
+        r = client.list_words(language_id)
+        if r.status_code == 200:
+            cache = word_cache.WordCache(language_id)
+            cache.set_words(r.json()['words'])
+            for shard in upload:
+                cache.learn_corpus(word_cache.count_words(os.path.join(args.shard_dir,
+                                                                       shard['name'])))
+            cache.save()
+
+    r = client.get_language_model(language_id)
+    needs_training = upload or delete or (r.status_code == 200 and r.json()['status'] == 'ready')
+    trained = analyzed
+    if needs_training and not args.no_train:
+        r = client.train_language_model(language_id)
+        if r.status_code != 200:
+            print("Train language model returns %d: %s" % (r.status_code, r.text))
+            return -1
+        try:
+            waiter.wait_for_language_model(client, language_id, timeout=timeout)
+        except waiter.WaitError as e:
+            print("Training failed: ", e)
+            return -1
+        trained = time.time()
+
+    print("Deleting %.1fs, uploading and analyzing %.1fs, training %.1fs, total %.1fs"
+          % (deleted - start, analyzed - deleted, trained - analyzed, time.time() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import argparse
+import csv
+import json
+import sys, time
+from concurrent.futures import ThreadPoolExecutor
+import env
+import stt_client
+import waiter
+import word_cache
+
+##########################################################################
+# Make the custom words of the language model (LANGUAGE_ID) match a list
+# of words, such as corrected sounds_like and display_as values for the
+# OOVs listed by add_corpus.py.
+#
+# The list is a JSON file (the response of the /words listing, as saved by
+# add_corpus.py, or a list of such entries) or a CSV file with the columns
+# word, sounds_like and display_as.  In the CSV file, the pronunciations of
+# a word are separated by ';', and an empty cell leaves the current value
+# of the word.
+#
+# The words of the model are listed once and compared with the list:
+# - new and changed words are added with POST /words, in batches of at
+#   most --batch-size words and BATCH_BYTES bytes.  The service processes
+#   one batch at a time, so each batch waits for the model to be ready.
+# - with --delete, the words of the model that are not in the list are
+#   deleted, by parallel requests
+#
+#   python sync_words.py words.csv --dry-run
+#   python sync_words.py words.csv --delete
+##########################################################################
+
+BATCH_WORDS = 1000
+BATCH_BYTES = 1000000
+
+
+def _pronunciations(value):
+    return [p.strip() for p in value.split(';') if p.strip()]
+
+
+def read_words(path):
+    # Returns the desired words as {word: entry}; an entry only holds the
+    # fields that are given
+    entries = []
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data['words']
+        for item in data:
+            entries.append({'word': item} if isinstance(item, str) else item)
+    else:
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = list(csv.reader(f))
+        if rows and rows[0] and rows[0][0].strip().lower() == 'word':
+            rows = rows[1:]
+        for row in rows:
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            entry = {'word': row[0].strip()}
+            if len(row) > 1 and _pronunciations(row[1]):
+                entry['sounds_like'] = _pronunciations(row[1])
+            if len(row) > 2 and row[2].strip():
+                entry['display_as'] = row[2].strip()
+            entries.append(entry)
+
+    words = {}
+    for entry in entries:
+        entry = dict((k, entry[k]) for k in ('word', 'sounds_like', 'display_as')
+                     if entry.get(k))
+        if entry['word'] in words:
+            print("%s is listed more than once, keeping the last one" % entry['word'])
+        words[entry['word']] = entry
+    return words
+
+
+def diff_words(desired, current, delete=False):
+    # Returns the entries to add (new or changed words, with the current
+    # value of the fields that are not given) and the words to delete
+    add = []
+    for word, entry in sorted(desired.items()):
+        existing = current.get(word)
+        if existing is None:
+            add.append(entry)
+            continue
+        merged = {'word': word,
+                  'sounds_like': entry.get('sounds_like', existing.get('sounds_like', [])),
+                  'display_as': entry.get('display_as', existing.get('display_as', word))}
+        if (merged['sounds_like'] != existing.get('sounds_like', [])
+                or merged['display_as'] != existing.get('display_as', word)):
+            add.append(merged)
+    remove = sorted(set(current) - set(desired)) if delete else []
+    return add, remove
+
+
+def batches(entries, max_words=BATCH_WORDS, max_bytes=BATCH_BYTES):
+    batch, size = [], 0
+    for entry in entries:
+        entry_size = len(json.dumps(entry)) + 2
+        if batch and (len(batch) >= max_words or size + entry_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
+
+
+def add_words(client, language_id, entries, batch_size, wait=True):
+    # Without wait, returns as soon as the last batch is accepted
+    timeout = env.get_wait_timeout()
+    chunks = list(batches(entries, batch_size))
+    for number, batch in enumerate(chunks, 1):
+        start = time.time()
+        r = client.add_words(language_id, batch)
+        if r.status_code == 409:
+            # The model is still processing a previous request
+            waiter.wait_for_language_model(client, language_id, done=waiter.MODEL_READY,
+                                           timeout=timeout)
+            r = client.add_words(language_id, batch)
+        if r.status_code != 201:
+            raise RuntimeError("adding words returns %d: %s" % (r.status_code, r.text))
+        if wait or number < len(chunks):
+            waiter.wait_for_language_model(client, language_id, done=waiter.MODEL_READY,
+                                           timeout=timeout, initial_delay=1.0)
+        print("Batch %d: %d words added in %.1fs" % (number, len(batch), time.time() - start))
+
+
+def delete_words(client, language_id, words):
+    # Returns the words that could not be deleted
+    def delete(word):
+        r = client.delete_word(language_id, word)
+        if r.status_code not in (200, 404):
+            print("Deleting %s returns %d: %s" % (word, r.status_code, r.text))
+            return word
+        return None
+
+    with ThreadPoolExecutor(max_workers=env.get_pool_size()) as pool:
+        return [w for w in pool.map(delete, words) if w is not None]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Make the custom words match a list")
+    parser.add_argument('words', help="CSV or JSON file of the desired words")
+    parser.add_argument('--delete', action='store_true',
+                        help="delete the words of the model that are not in the list")
+    parser.add_argument('--dry-run', action='store_true', help="only show the changes")
+    parser.add_argument('--batch-size', type=int, default=BATCH_WORDS,
+                        help="largest number of words added by one request")
+    parser.add_argument('--no-wait', action='store_true',
+                        help="do not wait for the last batch to be processed")
+    args = parser.parse_args(argv)
+
+    desired = read_words(args.words)
+    language_id = env.get_language_id()
+    client = stt_client.get_client()
+    start = time.time()
+    r = client.list_words(language_id)
+    if r.status_code != 200:
+        print("Listing words returns %d: %s" % (r.status_code, r.text))
+        return -1
+    listed = r.json()['words']
+    current = dict((w['word'], w) for w in listed)
+    add, remove = diff_words(desired, current, args.delete)
+    print("%d words in the list, %d in the model: %d to add or change, %d to delete"
+          % (len(desired), len(current), len(add), len(remove)))
+
+    if args.dry_run:
+        for entry in add:
+            print("  %s %s" % ('~' if entry['word'] in current else '+', json.dumps(entry)))
+        for word in remove:
+            print("  - %s" % word)
+        return 0
+
+    failed = delete_words(client, language_id, remove) if remove else []
+    if remove:
+        print("%d words deleted, %d failed" % (len(remove) - len(failed), len(failed)))
+    try:
+        if add:
+            add_words(client, language_id, add, args.batch_size, wait=not args.no_wait)
+    except (RuntimeError, waiter.WaitError) as e:
+        print("Failed to add words: ", e)
+        return -1
+
+    # Keep the word cache of predict_oovs.py up to date without listing
+    # the words again
+    cache = word_cache.WordCache(language_id)
+    cache.set_words(listed)
+    cache.update_words(add)
+    for word in set(remove) - set(failed):
+        cache.words.pop(word.lower(), None)
+    cache.save()
+    print("Words synchronized in %.1fs" % (time.time() - start))
+    return -1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
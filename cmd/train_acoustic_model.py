@@ -1,25 +1,39 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
+import waiter
 
 ##########################################################################
 # Initiates the training of a custom acoustic model with new audio resources
 # using a language model as the base
 # A status of available means that the custom model is trained and ready to use.
+# The script waits for the training to complete (use --no-wait to return right away)
 ##########################################################################
 
 print("\nTrain custom acoustic model...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/acoustic_customizations/"+env.get_acoustic_id()+"/train?custom_language_model_id="+env.get_language_id()
-r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+r = client.train_acoustic_model(env.get_acoustic_id(),
+                                custom_language_model_id=env.get_language_id())
 
 print("Train acoustic model returns: ", r.status_code)
+if r.status_code != 200:
+   print("Failed to train acoustic model")
+   print(r.text)
+   sys.exit(-1)
+
+if env.has_option('--no-wait'):
+   sys.exit(0)
+
+print("Checking status of training...")
+try:
+   waiter.wait_for_acoustic_model(client, env.get_acoustic_id(),
+                                  timeout=env.get_wait_timeout(),
+                                  on_status=waiter.print_status)
+except waiter.WaitError as e:
+   print("Training failed: ", e)
+   sys.exit(-1)
 
+print("Training done!")
 sys.exit(0)
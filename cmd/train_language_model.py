@@ -1,25 +1,38 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
-import sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import sys
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+import stt_client
+import waiter
 
 ##########################################################################
 # Initiate the training of a custom language model with new resources such as
 # corpora, grammars, and custom words
 # A status of available means that the custom model is trained and ready to use.
+# The script waits for the training to complete (use --no-wait to return right away)
 ##########################################################################
 
 print("\nTrain custom language model...")
 
-headers = {'Content-Type' : "application/json"}
-uri = env.get_endpoint() + "/v1/customizations/"+env.get_language_id()+"/train"
-r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers)
+client = stt_client.get_client()
+r = client.train_language_model(env.get_language_id())
 
 print("Train language model returns: ", r.status_code)
+if r.status_code != 200:
+   print("Failed to train language model")
+   print(r.text)
+   sys.exit(-1)
+
+if env.has_option('--no-wait'):
+   sys.exit(0)
+
+print("Checking status of training...")
+try:
+   waiter.wait_for_language_model(client, env.get_language_id(),
+                                  timeout=env.get_wait_timeout(),
+                                  on_status=waiter.print_status)
+except waiter.WaitError as e:
+   print("Training failed: ", e)
+   sys.exit(-1)
 
+print("Training done!")
 sys.exit(0)
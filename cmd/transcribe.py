@@ -1,14 +1,14 @@
 # -*- coding: utf-8 -*-
-import requests
-import json
-import codecs
+import argparse
+import glob
 import os, sys, time
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+import threading
+import wave
+import requests
+from concurrent.futures import ThreadPoolExecutor
 import env
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-headers = {'Content-Type' : "audio/wav"}
+import stt_client
+import transcript_cache
 
 ##########################################################################
 # Transcribe an audio file using a custom language and acoustic model
@@ -16,41 +16,272 @@ headers = {'Content-Type' : "audio/wav"}
 # - the base model
 # - the language_customization_id
 # - the acoustic_customization_id
+#
+# With --batch, a directory, a glob pattern or a manifest file (one audio
+# path per line) is transcribed by a pool of worker threads sharing one
+# connection pool.  Audio files whose transcript is newer than the audio
+# are skipped.
+#
+# Results are kept in a local cache by audio checksum and models, so the
+# same audio is not sent again until the audio or a custom model changes
+# (--no-cache to always ask the service).
+#
+# With --prepare, the audio is resampled to the rate of the model, its
+# silences are removed and it is encoded as WAV, FLAC or Ogg/Opus before
+# being sent (see audio_prep.py).
+#
+# With --split, long recordings are cut at pauses into segments that are
+# recognized in parallel and stitched back together (see long_audio.py).
+#
+# With --store, the word timings, confidences and alternatives are asked
+# for and kept in a transcript store (see transcript_store.py).
+#
+# With --stream, the audio is sent in chunks over the WebSocket interface
+# and the results are printed and written as soon as they are recognized.
 ##########################################################################
 
-print("\nTranscribe an audio using: ")
+# Recognition parameters of the structured output (--store)
+STRUCTURED_PARAMS = {'timestamps': True, 'word_confidence': True, 'max_alternatives': 3}
+
+
+def get_model_ids():
+    return os.environ.get('LANGUAGE_ID'), os.environ.get('ACOUSTIC_ID')
+
+
+def print_models(language_id, acoustic_id):
+    print("\nTranscribe an audio using: ")
+    if language_id:
+        print(" - custom language model (id: %s)" % language_id)
+    else:
+        print(" - base language model")
+    if acoustic_id:
+        print(" - custom acoustic model (id: %s)" % acoustic_id)
+    else:
+        print(" - base acoustic model")
+
+
+def transcript_path(audio_file):
+    return os.path.splitext(audio_file)[0] + '.transcript'
+
+
+def audio_duration(audio_file):
+    try:
+        with wave.open(audio_file, 'rb') as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError):
+        return 0.0
+
+
+def is_up_to_date(audio_file):
+    output = transcript_path(audio_file)
+    return (os.path.exists(output) and
+            os.path.getmtime(output) >= os.path.getmtime(audio_file))
+
+
+def recognize_file(client, audio_file, language_id, acoustic_id, preprocess=None, **params):
+    # Returns the recognition result, raises requests.HTTPError on failure.
+    # preprocess holds the options of audio_prep.prepare, to resample the
+    # audio, remove the silences and encode it before sending it; the times
+    # of the result are those of the original audio all the same.
+    if preprocess:
+        import audio_prep
+        prepared = audio_prep.prepare(audio_file, **preprocess)
+        r = client.recognize(prepared.data, content_type=prepared.content_type,
+                             model="en-US_NarrowbandModel",
+                             language_customization_id=language_id,
+                             acoustic_customization_id=acoustic_id, **params)
+        r.raise_for_status()
+        if prepared.segments:
+            return audio_prep.restore_times(r.json(), prepared.segments)
+        return r.json()
+    with open(audio_file, 'rb') as f:
+        r = client.recognize(f, content_type="audio/wav", model="en-US_NarrowbandModel",
+                             language_customization_id=language_id,
+                             acoustic_customization_id=acoustic_id, **params)
+    r.raise_for_status()
+    return r.json()
+
+
+def get_transcript(response):
+    # The best alternative of every result
+    transcript = ""
+    for result in response['results']:
+        if result['alternatives']:
+            transcript += result['alternatives'][0]['transcript']
+    return transcript
+
+
+def write_transcript(audio_file, transcript):
+    with open(transcript_path(audio_file), 'w') as output_file:
+        output_file.write(transcript)
+
+
+def collect_audio_files(source):
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*.wav')))
+    if glob.has_magic(source):
+        return sorted(glob.glob(source))
+    # Manifest file: one audio file per line, relative to the manifest
+    base = os.path.dirname(source)
+    with open(source) as manifest:
+        lines = [line.strip() for line in manifest]
+    return [os.path.join(base, line) for line in lines
+            if line and not line.startswith('#')]
+
+
+def recognize(client, audio_file, language_id, acoustic_id, cache=None, preprocess=None,
+              split=None, max_in_flight=1, **params):
+    # Returns the recognition result, raises requests.HTTPError on failure.
+    # With split, long audio is sent as segments of about split seconds.
+    # params are other parameters of the recognize request.
+    def request():
+        if split:
+            import long_audio
+            encoding = preprocess['encoding'] if preprocess else 'wav'
+            return long_audio.recognize_long(client, audio_file, language_id, acoustic_id,
+                                             split, max_in_flight, encoding, **params)
+        return recognize_file(client, audio_file, language_id, acoustic_id, preprocess,
+                              **params)
+
+    if cache:
+        return cache.fetch(client, audio_file, language_id, acoustic_id, request,
+                           preprocess=preprocess, split=split, **params)
+    return request()
+
+
+def transcribe_batch(client, audio_files, language_id, acoustic_id,
+                     max_in_flight, force=False, cache=None, preprocess=None, split=None,
+                     store=None):
+    stats = {'done': 0, 'skipped': 0, 'failed': 0, 'audio_seconds': 0.0}
+    lock = threading.Lock()
+
+    def transcribe_one(audio_file):
+        try:
+            # The files already use the max_in_flight requests: the
+            # segments of a split file are recognized one at a time
+            result = recognize(client, audio_file, language_id, acoustic_id,
+                               cache, preprocess, split, 1,
+                               **(STRUCTURED_PARAMS if store else {}))
+            write_transcript(audio_file, get_transcript(result))
+            if store:
+                store.add(audio_file, result, language_id=language_id,
+                          acoustic_id=acoustic_id)
+        except Exception as e:
+            with lock:
+                stats['failed'] += 1
+            print("FAILED  %s: %s" % (audio_file, e))
+            return
+        duration = audio_duration(audio_file)
+        with lock:
+            stats['done'] += 1
+            stats['audio_seconds'] += duration
+        print("done    %s (%.1fs of audio)" % (audio_file, duration))
+
+    # The semaphore keeps at most max_in_flight files queued or running,
+    # so that huge batches do not build up an unbounded list of futures.
+    slots = threading.BoundedSemaphore(max_in_flight)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for audio_file in audio_files:
+            if not force and is_up_to_date(audio_file):
+                stats['skipped'] += 1
+                continue
+            slots.acquire()
+            future = pool.submit(transcribe_one, audio_file)
+            future.add_done_callback(lambda f: slots.release())
+    stats['elapsed'] = time.time() - start
+    return stats
+
+
+def print_stats(stats):
+    elapsed = max(stats['elapsed'], 1e-6)
+    print("\nTranscribed %d files, skipped %d up to date, %d failed in %.1fs"
+          % (stats['done'], stats['skipped'], stats['failed'], stats['elapsed']))
+    print("Throughput: %.2f files/s, %.2f audio-seconds/s"
+          % (stats['done'] / elapsed, stats['audio_seconds'] / elapsed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transcribe audio files")
+    parser.add_argument('audio', help="audio file to transcribe, or with --batch "
+                        "a directory, glob pattern or manifest file")
+    parser.add_argument('--batch', action='store_true',
+                        help="transcribe many files concurrently")
+    parser.add_argument('--max-in-flight', type=int, default=env.get_pool_size(),
+                        help="maximum concurrent requests in batch mode")
+    parser.add_argument('--stream', action='store_true',
+                        help="stream the audio over a WebSocket and output "
+                        "results incrementally")
+    parser.add_argument('--chunk-size', type=int, default=8192,
+                        help="size in bytes of the audio chunks sent when streaming")
+    parser.add_argument('--force', action='store_true',
+                        help="transcribe even if the transcript is up to date")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="do not use the cached results")
+    parser.add_argument('--prepare', choices=('wav', 'flac', 'ogg'),
+                        help="resample the audio, remove the silences and send it "
+                        "in this encoding (see audio_prep.py)")
+    parser.add_argument('--split', type=float, metavar='SECONDS',
+                        help="send long audio as segments of about this length, "
+                        "cut at pauses and recognized in parallel")
+    parser.add_argument('--store', metavar='DIR',
+                        help="also keep the word timings, confidences and alternatives "
+                        "in this transcript store (see transcript_store.py)")
+    args = parser.parse_args(argv)
 
-try:
-    language_id = "&language_customization_id="+os.environ['LANGUAGE_ID']
-    print(" - custom language model (id: %s)" % os.environ['LANGUAGE_ID'])
-except:
-    language_id = ""
-    print(" - base language model")
+    language_id, acoustic_id = get_model_ids()
+    print_models(language_id, acoustic_id)
 
-try:
-    acoustic_id = "&acoustic_customization_id="+os.environ['ACOUSTIC_ID']
-    print(" - custom acoustic model (id: %s)" % os.environ['ACOUSTIC_ID'])
-except:
-    acoustic_id = ""
-    print(" - base acoustic model")
+    if args.stream:
+        import streaming
+        print("Transcription: ")
+        stats = streaming.transcribe_streaming(args.audio, transcript_path(args.audio),
+                                               language_id, acoustic_id,
+                                               chunk_size=args.chunk_size)
+        streaming.print_stats(stats)
+        return 0
 
+    client = stt_client.get_client()
+    # A connection for every request in flight, or the connections beyond
+    # the pool are closed after every request
+    if args.max_in_flight > env.get_pool_size():
+        client.set_pool_size(args.max_in_flight)
+    cache = None if args.no_cache else transcript_cache.TranscriptCache()
+    preprocess = {'encoding': args.prepare} if args.prepare else None
+    store = None
+    if args.store:
+        import transcript_store
+        store = transcript_store.TranscriptStore(args.store)
+    if args.batch:
+        audio_files = collect_audio_files(args.audio)
+        print("\nTranscribing %d files, %d at a time..." % (len(audio_files), args.max_in_flight))
+        stats = transcribe_batch(client, audio_files, language_id, acoustic_id,
+                                 args.max_in_flight, force=args.force, cache=cache,
+                                 preprocess=preprocess, split=args.split, store=store)
+        print_stats(stats)
+        if cache:
+            cache.print_stats()
+        return -1 if stats['failed'] else 0
 
-audio_file = env.get_arg("audio file to transcribe")
-uri = env.get_endpoint() + "/v1/recognize?model=en-US_NarrowbandModel"+language_id+acoustic_id
-with open(audio_file, 'rb') as f:
-    r = requests.post(uri, auth=(env.get_username(),env.get_password()), verify=False, headers=headers, data=f)
+    try:
+        result = recognize(client, args.audio, language_id, acoustic_id, cache, preprocess,
+                           args.split, args.max_in_flight,
+                           **(STRUCTURED_PARAMS if store else {}))
+    except requests.HTTPError as e:
+        print("Transcribe returns: ", e.response.status_code)
+        print(e.response.text)
+        return -1
+    print(result)
+    transcript = get_transcript(result)
 
-output_file = open(audio_file.replace('.wav','') + '.transcript','w')
-transcript = ""
-print(r.json())
-for result in r.json()['results']:
-    for alternative in result['alternatives']:
-        transcript += alternative['transcript']
+    print("Transcription: ")
+    print(transcript)
 
-print("Transcription: ")
-print(transcript)
+    write_transcript(args.audio, transcript)
+    if store:
+        store.add(args.audio, result, language_id=language_id, acoustic_id=acoustic_id)
+    return 0
 
-output_file.write(transcript)
-output_file.close()
 
-sys.exit(0)
+if __name__ == '__main__':
+    sys.exit(main())
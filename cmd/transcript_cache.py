@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import env
+import stt_client
+import uploader
+
+##########################################################################
+# On-disk cache of recognition results.
+#
+# A result is stored under the SHA-256 of the audio, the base model, the
+# custom models and the other recognition parameters.  For a custom model,
+# the key also holds the time the model was last updated: once a model is
+# retrained, the results obtained with the previous version are no longer
+# found and are eventually evicted.
+#
+# The cache is bounded (STT_TRANSCRIPT_CACHE_MB): when it grows over the
+# limit, the least recently used results are removed.  A hit refreshes
+# the modification time of the file, which serves as the last use time.
+##########################################################################
+
+# Evict down to this fraction of the limit, so eviction does not run on
+# every new result
+LOW_WATER = 0.9
+
+
+def model_version(client, kind, customization_id):
+    # The time the custom model was last changed
+    if not customization_id:
+        return None
+    if kind == 'language':
+        r = client.get_language_model(customization_id)
+    else:
+        r = client.get_acoustic_model(customization_id)
+    r.raise_for_status()
+    return r.json().get('updated')
+
+
+class TranscriptCache:
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or env.get_cache_dir('transcripts')
+        self.max_bytes = max_bytes or env.get_transcript_cache_size()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evicted = 0
+        self.bytes_saved = 0
+        self.versions = {}
+        self.checksums = {}
+        self.size = sum(e.stat().st_size for e in os.scandir(self.directory)
+                        if e.name.endswith('.json'))
+
+    def key(self, audio_sha256, params):
+        data = json.dumps([audio_sha256, params], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self.path(key)
+        tmp = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(result, f)
+        size = os.path.getsize(tmp)
+        with self.lock:
+            # A result stored again replaces the previous one
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp, path)
+            self.size += size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith('.json'):
+                st = e.stat()
+                entries.append((st.st_mtime, st.st_size, e.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evicted += 1
+
+    def _models(self, client, language_id, acoustic_id):
+        # The custom model versions are asked once per run
+        with self.lock:
+            versions = self.versions.get((language_id, acoustic_id))
+        if versions is None:
+            versions = [model_version(client, 'language', language_id),
+                        model_version(client, 'acoustic', acoustic_id)]
+            with self.lock:
+                self.versions[(language_id, acoustic_id)] = versions
+        return {'language_customization_id': [language_id, versions[0]],
+                'acoustic_customization_id': [acoustic_id, versions[1]]}
+
+    def _checksum(self, audio_file):
+        st = os.stat(audio_file)
+        signature = (os.path.abspath(audio_file), st.st_size, st.st_mtime)
+        checksum = self.checksums.get(signature)
+        if checksum is None:
+            checksum = self.checksums[signature] = uploader.file_sha256(audio_file)
+        return checksum
+
+    def fetch(self, client, audio_file, language_id, acoustic_id, request,
+              model=stt_client.BASE_MODEL, **params):
+        # Returns the recognition result of an audio file, from the cache or
+        # from request().  params are the other settings the result depends
+        # on.  Raises requests.HTTPError on failure.
+        key_params = dict((k, v) for k, v in params.items() if v is not None)
+        key_params['model'] = model
+        key_params.update(self._models(client, language_id, acoustic_id))
+        key = self.key(self._checksum(audio_file), key_params)
+        result = self.get(key)
+        if result is not None:
+            with self.lock:
+                self.bytes_saved += os.path.getsize(audio_file)
+            return result
+        result = request()
+        self.put(key, result)
+        return result
+
+    def recognize(self, client, audio_file, language_id=None, acoustic_id=None,
+                  model=stt_client.BASE_MODEL, **params):
+        def request():
+            with open(audio_file, 'rb') as f:
+                r = client.recognize(f, content_type=stt_client.content_type_for(audio_file),
+                                     model=model, language_customization_id=language_id,
+                                     acoustic_customization_id=acoustic_id, **params)
+            r.raise_for_status()
+            return r.json()
+        return self.fetch(client, audio_file, language_id, acoustic_id, request,
+                          model=model, **params)
+
+    def print_stats(self):
+        total = max(self.hits + self.misses, 1)
+        print("Transcript cache: %d hits, %d misses (%.0f%% hit rate), %.1f MB of audio "
+              "not sent, %d evicted, %.1f MB used"
+              % (self.hits, self.misses, 100.0 * self.hits / total,
+                 self.bytes_saved / 1e6, self.evicted, self.size / 1e6))
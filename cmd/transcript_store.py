@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os, sys
+import threading
+import numpy as np
+
+##########################################################################
+# Store of structured transcripts, filled by transcribe.py --store.
+#
+# Every recognition result is appended, with its timestamps, confidences
+# and alternatives, to results.jsonl.  The recognized words are also
+# appended to columns of fixed size values, one file per column:
+#
+#   file.u4        index of the transcript in files.txt
+#   word.u4        index of the word in words.txt
+#   start.f4       start time in seconds
+#   end.f4         end time in seconds
+#   confidence.f4  word confidence (NaN when not requested)
+#
+# The columns are memory-mapped NumPy arrays, so queries over thousands
+# of transcripts, such as the words recognized with a low confidence,
+# only read the columns they need.
+#
+#   python transcript_store.py transcripts stats
+#   python transcript_store.py transcripts low-confidence --threshold 0.5
+##########################################################################
+
+COLUMNS = (('file', 'u4'), ('word', 'u4'), ('start', 'f4'), ('end', 'f4'),
+           ('confidence', 'f4'))
+
+
+def result_words(result):
+    # (word, start, end, confidence) of the best alternative of every final
+    # result
+    for r in result.get('results', []):
+        if not r.get('final', True) or not r.get('alternatives'):
+            continue
+        best = r['alternatives'][0]
+        timestamps = best.get('timestamps', [])
+        confidences = best.get('word_confidence', [])
+        if len(confidences) != len(timestamps):
+            confidences = [[None, float('nan')]] * len(timestamps)
+        for (word, start, end), (_, confidence) in zip(timestamps, confidences):
+            yield word, start, end, confidence
+
+
+class TranscriptStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.files = self._read_lines('files.txt')
+        self.words = self._read_lines('words.txt')
+        self.word_ids = dict((w, n) for n, w in enumerate(self.words))
+        self._truncate()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_lines(self, name):
+        if not os.path.exists(self.path(name)):
+            return []
+        with open(self.path(name), encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+
+    def _truncate(self):
+        # Drop the rows of a transcript interrupted before it was listed in
+        # files.txt; rows are in the order of the transcripts
+        rows = int(np.searchsorted(self.column('file'), len(self.files)))
+        for name, dtype in COLUMNS:
+            path = self.path(name + '.' + dtype)
+            if os.path.exists(path) and os.path.getsize(path) > rows * 4:
+                os.truncate(path, rows * 4)
+
+    def add(self, audio_file, result, **info):
+        # Append a recognition result of audio_file; info is stored with it
+        words = list(result_words(result))
+        with self.lock:
+            file_id = len(self.files)
+            self.files.append(audio_file)
+            new_words = []
+            ids = []
+            for word, _, _, _ in words:
+                if word not in self.word_ids:
+                    self.word_ids[word] = len(self.words)
+                    self.words.append(word)
+                    new_words.append(word)
+                ids.append(self.word_ids[word])
+            columns = {'file': [file_id] * len(words), 'word': ids,
+                       'start': [w[1] for w in words], 'end': [w[2] for w in words],
+                       'confidence': [w[3] for w in words]}
+            # The columns and the words are written before the file name, so
+            # a transcript listed in files.txt is complete
+            for name, dtype in COLUMNS:
+                with open(self.path(name + '.' + dtype), 'ab') as f:
+                    f.write(np.array(columns[name], dtype='<' + dtype).tobytes())
+            with open(self.path('words.txt'), 'a', encoding='utf-8') as f:
+                f.writelines(w + '\n' for w in new_words)
+            with open(self.path('results.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(dict(info, audio=audio_file, file_id=file_id,
+                                        results=result.get('results', []))) + '\n')
+            with open(self.path('files.txt'), 'a', encoding='utf-8') as f:
+                f.write(audio_file + '\n')
+
+    def column(self, name):
+        dtype = dict(COLUMNS)[name]
+        path = self.path(name + '.' + dtype)
+        if not os.path.exists(path) or not os.path.getsize(path):
+            return np.zeros(0, dtype='<' + dtype)
+        return np.memmap(path, dtype='<' + dtype, mode='r')
+
+    def current_words(self):
+        # Mask of the words of the latest transcript of every audio file
+        latest = {}
+        for file_id, audio_file in enumerate(self.files):
+            latest[audio_file] = file_id
+        current = np.zeros(len(self.files), dtype=bool)
+        current[list(latest.values())] = True
+        return current[self.column('file')]
+
+    def low_confidence(self, threshold):
+        # Returns the indexes of the current words below threshold
+        confidence = self.column('confidence')
+        return np.flatnonzero(self.current_words() & (confidence < threshold))
+
+
+def print_stats(store):
+    mask = store.current_words()
+    confidence = store.column('confidence')[mask]
+    speech = (store.column('end')[mask] - store.column('start')[mask]).sum()
+    print("%d transcripts of %d audio files, %d words, %d distinct"
+          % (len(store.files), len(set(store.files)), mask.sum(), len(store.words)))
+    if len(confidence):
+        print("Mean word confidence %.3f, %.1f minutes of recognized speech"
+              % (np.nanmean(confidence), speech / 60))
+
+
+def print_low_confidence(store, threshold, top, occurrences):
+    indexes = store.low_confidence(threshold)
+    word_ids = store.column('word')[indexes]
+    counts = np.bincount(word_ids, minlength=len(store.words))
+    sums = np.bincount(word_ids, weights=store.column('confidence')[indexes],
+                       minlength=len(store.words))
+    total = store.current_words().sum()
+    print("%d of %d words below a confidence of %.2f" % (len(indexes), total, threshold))
+    print("\n   count  mean conf  word")
+    for word_id in np.argsort(-counts, kind='stable')[:top]:
+        if not counts[word_id]:
+            break
+        print("%8d  %9.3f  %s" % (counts[word_id], sums[word_id] / counts[word_id],
+                                  store.words[word_id]))
+    if occurrences:
+        print("\n  confidence     start  file: word")
+        file_ids = store.column('file')[indexes]
+        starts = store.column('start')[indexes]
+        confidence = store.column('confidence')[indexes]
+        for k in np.argsort(confidence, kind='stable')[:occurrences]:
+            print("  %10.3f  %8.2f  %s: %s" % (confidence[k], starts[k],
+                                              store.files[file_ids[k]],
+                                              store.words[word_ids[k]]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the transcript store")
+    parser.add_argument('store', help="directory of the store")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('stats', help="size and mean confidence of the store")
+    low = commands.add_parser('low-confidence', help="words recognized with a low confidence")
+    low.add_argument('--threshold', type=float, default=0.5)
+    low.add_argument('--top', type=int, default=50, help="number of words listed")
+    low.add_argument('--occurrences', type=int, default=0,
+                     help="also list this many of the least confident occurrences")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(os.path.join(args.store, 'files.txt')):
+        print("No transcript store in ", args.store)
+        return -1
+    store = TranscriptStore(args.store)
+    if args.command == 'stats':
+        print_stats(store)
+    else:
+        print_low_confidence(store, args.threshold, args.top, args.occurrences)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os, sys, time
+import threading
+import env
+
+##########################################################################
+# Upload corpora and audio resources, skipping the ones already uploaded.
+#
+# Every file is sent from a bounded read buffer with progress reporting.
+# After an upload, the SHA-256 of the file is recorded in a manifest per
+# customization ID.  Before uploading, the resources listed by the service
+# are compared with the manifest: a file whose name is listed with the
+# same checksum is skipped, and a changed file replaces the old resource.
+# Re-running a pipeline therefore only sends what changed.  A caller that
+# uploads many files lists the resources once and passes their names.
+##########################################################################
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ProgressFile:
+    # File-like object handed to requests: reads at most chunk_size bytes
+    # at a time and reports the progress of the upload.  It has a length,
+    # so the request is sent with a Content-Length, and supports seek/tell,
+    # so that a retried request starts again from the beginning.
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE, report_every=1.0):
+        self.name = os.path.basename(path)
+        self.file = open(path, 'rb')
+        self.size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+        self.report_every = report_every
+        self.sent = 0
+        self.start = self.last_report = time.time()
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        chunk = self.file.read(size)
+        self.sent += len(chunk)
+        now = time.time()
+        if chunk and (now - self.last_report >= self.report_every or self.sent == self.size):
+            self.last_report = now
+            self.report()
+        return chunk
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=0):
+        position = self.file.seek(offset, whence)
+        self.sent = position
+        return position
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        percent = 100.0 * self.sent / self.size if self.size else 100.0
+        sys.stdout.write("%s: %3.0f%% %.1f/%.1f MB %.2f MB/s\n"
+                         % (self.name, percent, self.sent / 1e6, self.size / 1e6,
+                            self.sent / elapsed / 1e6))
+        sys.stdout.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UploadManifest:
+    # Checksums of the files uploaded to one customization
+
+    _lock = threading.Lock()
+
+    def __init__(self, customization_id):
+        self.path = os.path.join(env.get_cache_dir('uploads'), customization_id + '.json')
+        self.entries = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def get(self, name):
+        return self.entries.get(name, {}).get('sha256')
+
+    def record(self, name, sha256, size):
+        # Reload first: other threads may have recorded uploads meanwhile
+        with self._lock:
+            self.entries = self._load()
+            self.entries[name] = {'sha256': sha256, 'size': size,
+                                  'uploaded': time.time()}
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+class UploadError(Exception):
+    pass
+
+
+class ConflictError(UploadError):
+    # The model is busy processing another resource (409)
+    pass
+
+
+def _upload(list_names, add, customization_id, path, name, force, names):
+    # Returns 'skipped' or 'uploaded', raises UploadError on failure.
+    # names holds the resources of the customization when the caller
+    # already listed them; otherwise they are listed here, unless force is
+    # set and the manifest tells whether the resource is there to overwrite.
+    name = name or os.path.basename(path)
+    manifest = UploadManifest(customization_id)
+    sha256 = file_sha256(path)
+    if names is None and not force:
+        names = list_names()
+    exists = name in names if names is not None else manifest.get(name) is not None
+    if exists and not force and manifest.get(name) == sha256:
+        print("%s is already uploaded and unchanged, skipping" % name)
+        return 'skipped'
+
+    with ProgressFile(path) as f:
+        r = add(customization_id, name, f, allow_overwrite=exists)
+    if r.status_code == 409:
+        raise ConflictError("uploading %s returns 409: %s" % (name, r.text))
+    if r.status_code != 201:
+        raise UploadError("uploading %s returns %d: %s" % (name, r.status_code, r.text))
+    manifest.record(name, sha256, os.path.getsize(path))
+    if names is not None:
+        names.add(name)
+    return 'uploaded'
+
+
+def corpus_names(client, customization_id):
+    r = client.list_corpora(customization_id)
+    r.raise_for_status()
+    return set(c['name'] for c in r.json()['corpora'])
+
+
+def audio_names(client, customization_id):
+    r = client.list_audio(customization_id)
+    r.raise_for_status()
+    return set(a['name'] for a in r.json()['audio'])
+
+
+def upload_corpus(client, customization_id, path, name=None, force=False, names=None):
+    return _upload(lambda: corpus_names(client, customization_id), client.add_corpus,
+                   customization_id, path, name, force, names)
+
+
+def upload_audio(client, customization_id, path, name=None, force=False, names=None):
+    return _upload(lambda: audio_names(client, customization_id), client.add_audio,
+                   customization_id, path, name, force, names)
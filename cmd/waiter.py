@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+import requests
+
+##########################################################################
+# Wait for a corpus, an audio resource or a custom model to reach a
+# terminal status.
+#
+# The status is polled with exponential backoff and jitter: a resource
+# that is ready quickly is noticed quickly, while a long training job is
+# polled less and less often.  The wait gives up when an overall deadline
+# is reached, and stops as soon as the resource reports a failure status
+# instead of polling forever.  A connection error or timeout of a poll
+# does not end the wait: the status is polled again after the next delay.
+##########################################################################
+
+CORPUS_DONE = ('analyzed',)
+CORPUS_FAILED = ('undetermined',)
+
+AUDIO_DONE = ('ok',)
+AUDIO_FAILED = ('invalid',)
+
+MODEL_DONE = ('available',)
+MODEL_READY = ('ready', 'available')
+MODEL_FAILED = ('failed',)
+
+
+class WaitError(Exception):
+    pass
+
+
+class WaitTimeout(WaitError):
+    pass
+
+
+class WaitFailed(WaitError):
+
+    def __init__(self, status, resource):
+        WaitError.__init__(self, "status is '%s'" % status)
+        self.status = status
+        self.resource = resource
+
+
+def backoff_delays(initial=2.0, maximum=60.0, factor=2.0, jitter=0.5):
+    # Each delay is drawn between (1 - jitter) and 1 times the current
+    # backoff, so that many waiters do not poll the service in lockstep.
+    delay = initial
+    while True:
+        yield delay * (1 - jitter * random.random())
+        delay = min(delay * factor, maximum)
+
+
+def wait_for_status(fetch, done, failed=(), timeout=None, on_status=None,
+                    initial_delay=2.0, max_delay=60.0, sleep=time.sleep):
+    # fetch() returns the JSON description of the resource, which has a
+    # 'status' field.  Returns that description once the status is one of
+    # done, raises WaitFailed for a failed status and WaitTimeout when the
+    # deadline passes.  A request that fails to reach the service is
+    # retried like a non-terminal status, until the deadline.
+    start = time.time()
+    delays = backoff_delays(initial_delay, max_delay)
+    while True:
+        try:
+            resource = fetch()
+        except requests.RequestException as e:
+            state = "failing (%s)" % e
+        else:
+            status = resource['status']
+            state = "still '%s'" % status
+            if on_status:
+                on_status(status, time.time() - start)
+            if status in done:
+                return resource
+            if status in failed:
+                raise WaitFailed(status, resource)
+
+        delay = next(delays)
+        if timeout is not None:
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                raise WaitTimeout("%s after %ds" % (state, timeout))
+            delay = min(delay, remaining)
+        sleep(delay)
+
+
+def _fetcher(method, *args):
+    def fetch():
+        r = method(*args)
+        if r.status_code != 200:
+            raise WaitError("status request returns %d: %s" % (r.status_code, r.text))
+        return r.json()
+    return fetch
+
+
+def print_status(status, elapsed):
+    print("status: ", status, "(", int(elapsed), ")")
+
+
+def wait_for_corpus(client, customization_id, corpus_name, **kwargs):
+    return wait_for_status(_fetcher(client.get_corpus, customization_id, corpus_name),
+                           CORPUS_DONE, CORPUS_FAILED, **kwargs)
+
+
+def wait_for_audio(client, customization_id, audio_name, **kwargs):
+    return wait_for_status(_fetcher(client.get_audio, customization_id, audio_name),
+                           AUDIO_DONE, AUDIO_FAILED, **kwargs)
+
+
+def wait_for_language_model(client, customization_id, done=MODEL_DONE, **kwargs):
+    return wait_for_status(_fetcher(client.get_language_model, customization_id),
+                           done, MODEL_FAILED, **kwargs)
+
+
+def wait_for_acoustic_model(client, customization_id, done=MODEL_DONE, **kwargs):
+    return wait_for_status(_fetcher(client.get_acoustic_model, customization_id),
+                           done, MODEL_FAILED, **kwargs)
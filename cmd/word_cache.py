@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import env
+
+##########################################################################
+# Local cache of the words of a custom language model.
+#
+# The cache is a JSON file per customization ID holding:
+# - the custom words of the model (the OOVs found in its corpora and the
+#   words added by the user), from the /words listing
+# - the words seen in uploaded corpora that did not become custom words,
+#   i.e. words the base model already knows
+#
+# With both, the words of a candidate corpus can be sorted offline into
+# custom words, base vocabulary and expected new OOVs, before uploading it.
+##########################################################################
+
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z'\-]*")
+
+# Above this number of words to check, one listing of all the words is
+# cheaper than one request per word.
+MAX_WORD_REQUESTS = 200
+
+
+def tokenize(text):
+    return [word.lower() for word in WORD_RE.findall(text)]
+
+
+def count_words(path):
+    counts = Counter()
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            counts.update(tokenize(line))
+    return counts
+
+
+class WordCache:
+
+    def __init__(self, customization_id):
+        self.customization_id = customization_id
+        self.path = os.path.join(env.get_cache_dir('words'), customization_id + '.json')
+        self.words = {}
+        self.base_words = set()
+        self.updated = None
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.words = data['words']
+            self.base_words = set(data['base_words'])
+            self.updated = data['updated']
+
+    def save(self):
+        self.updated = time.time()
+        data = {'words': self.words, 'base_words': sorted(self.base_words),
+                'updated': self.updated}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    def set_words(self, words):
+        # words is the 'words' list of the /words response
+        self.words = {}
+        self.update_words(words)
+
+    def update_words(self, words):
+        for word in words:
+            entry = dict(word)
+            self.words[entry.pop('word').lower()] = entry
+        self.base_words.difference_update(self.words)
+
+    def learn_corpus(self, counts):
+        # After a corpus has been analyzed, its words that are not custom
+        # words are known by the base model.
+        self.base_words.update(word for word in counts if word not in self.words)
+
+    def predict(self, counts):
+        custom, base, new = Counter(), Counter(), Counter()
+        for word, count in counts.items():
+            if word in self.words:
+                custom[word] = count
+            elif word in self.base_words:
+                base[word] = count
+            else:
+                new[word] = count
+        return custom, base, new
+
+    def refresh(self, client, words=None):
+        # Without a list of words, or with too many of them, fetch all the
+        # words of the model.  Otherwise only ask for the given words, and
+        # forget the ones the model no longer has.
+        if words is None or self.updated is None or len(words) > MAX_WORD_REQUESTS:
+            r = client.list_words(self.customization_id)
+            r.raise_for_status()
+            self.set_words(r.json()['words'])
+            return len(self.words)
+
+        def get_word(word):
+            r = client.get_word(self.customization_id, word)
+            if r.status_code == 404:
+                return None
+            r.raise_for_status()
+            return r.json()
+
+        with ThreadPoolExecutor(max_workers=env.get_pool_size()) as pool:
+            results = list(pool.map(get_word, sorted(words)))
+        # The words not found were deleted from the model, or never in it
+        for word, result in zip(sorted(words), results):
+            if result is None:
+                self.words.pop(word.lower(), None)
+        found = [w for w in results if w is not None]
+        self.update_words(found)
+        return len(found)
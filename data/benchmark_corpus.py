@@ -0,0 +1,111 @@
+###########################################################################
+# Benchmark build_corpus.py against the sed baseline
+#
+#   sed -f fixup.sed Documents/*.txt > corpus-1.txt
+#
+# on a synthetic corpus of medical dictation like documents containing
+# the filler strings removed by fixup.sed.  Every variant is timed and its
+# output compared with the output of sed.
+#
+# Usage: python benchmark_corpus.py [--documents N] [--sentences N]
+###########################################################################
+
+import argparse
+import filecmp
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+import build_corpus
+
+WORDS = ("patient", "history", "discharge", "dictation", "pain", "chest",
+         "blood", "pressure", "normal", "denies", "fever", "medications",
+         "examination", "abdomen", "soft", "nontender", "lungs", "clear",
+         "heart", "regular", "rate", "rhythm", "follow", "up", "with",
+         "the", "and", "of", "in", "is", "was", "no", "for", "a")
+
+FILLERS = ("{period}", "{comma}", "YYYY", "xxx", "XXXXX", "[skip]",
+           " dication", " dicharge", " wsould", "HEENT:", ".Next")
+
+
+def sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 20))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), rng.choice(FILLERS))
+    text = ' '.join(words)
+    return text[0].upper() + text[1:] + '.'
+
+
+def generate(directory, documents, sentences, seed=1):
+    rng = random.Random(seed)
+    paths = []
+    for n in range(documents):
+        path = os.path.join(directory, '%d.txt' % n)
+        with open(path, 'w') as f:
+            f.write("__DICTATION_%d:\n" % n)
+            for _ in range(sentences):
+                line = ' '.join(sentence(rng) for _ in range(rng.randint(1, 4)))
+                f.write(line + '\n')
+        paths.append(path)
+    return sorted(paths)
+
+
+def timed(label, function, reference=None, output=None):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    same = ''
+    if reference is not None:
+        same = 'identical' if filecmp.cmp(reference, output, shallow=False) else 'DIFFERENT'
+    print("%-28s %8.2fs  %s" % (label, elapsed, same))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark build_corpus.py against sed")
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--sentences', type=int, default=200,
+                        help="lines per document")
+    parser.add_argument('--workers', type=int, default=cpu_count())
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        docs = os.path.join(tmp, 'Documents')
+        os.mkdir(docs)
+        paths = generate(docs, args.documents, args.sentences)
+        size = sum(os.path.getsize(p) for p in paths)
+        print("Synthetic corpus: %d documents, %.1f MB\n" % (len(paths), size / 1e6))
+
+        reference = os.path.join(tmp, 'sed.txt')
+
+        def run_sed():
+            with open(reference, 'w') as out:
+                subprocess.check_call(['sed', '-f', build_corpus.DEFAULT_RULES] + paths,
+                                      stdout=out)
+
+        def run_build(output, workers):
+            def run():
+                with open(output, 'w', encoding='utf-8', errors='surrogateescape',
+                          newline='') as out:
+                    build_corpus.build_corpus(paths, out, workers=workers,
+                                              tmp_dir=tmp)
+            return run
+
+        base = timed("sed", run_sed)
+        for workers in sorted(set((1, args.workers))):
+            output = os.path.join(tmp, 'build-%d.txt' % workers)
+            elapsed = timed("build_corpus, %d worker(s)" % workers,
+                            run_build(output, workers), reference, output)
+            print("%28s %8.2fx the speed of sed" % ('', base / elapsed))
+    finally:
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
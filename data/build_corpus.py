@@ -0,0 +1,569 @@
+###########################################################################
+# Build the corpus file from the plain text documents, applying the
+# substitutions of fixup.sed, without shelling out to sed.
+#
+#   python build_corpus.py -o corpus-1.txt Documents/*.txt
+#
+# is equivalent to
+#
+#   sed -f fixup.sed Documents/*.txt > corpus-1.txt
+#
+# The sed script is translated once into Python regular expressions.  The
+# documents are streamed through the substitutions in blocks of lines, so
+# memory use does not depend on the size of the corpus, and the list of
+# documents is split into shards processed on the CPU cores, one per
+# WORKER_SIZE bytes of documents.  The shards are concatenated in the order
+# of the documents, so the corpus is the same whatever the number of
+# workers.
+#
+# Each block of lines is read once and all the substitutions are applied
+# to it in turn, in memory, so the output is the same as the output of sed.
+# The rules are not merged into one pattern, as the later rules match text
+# left by the earlier ones (xxx then xx).  Instead, a rule whose pattern
+# does not start with a literal string, but contains one, is only applied
+# to the lines containing it, and the group references of the replacements
+# are expanded with str.format rather than by re.  On one core, this is
+# about 1.1 times the speed of sed on the corpus of benchmark_corpus.py.
+#
+# With --shard-dir, the corpus is written as shards of about --shard-size
+# bytes cut at content-defined line boundaries and named after their
+# content (see ShardWriter), for cmd/sync_corpus.py to upload only the
+# shards that changed:
+#
+#   python build_corpus.py --shard-dir shards Documents/*.txt
+###########################################################################
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zlib
+from multiprocessing import Pool, cpu_count
+
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixup.sed')
+
+BLOCK_SIZE = 1 << 20
+
+SHARD_SIZE = 1 << 20
+
+# Length of the literal string every match of a rule contains, from which
+# the rule is applied only to the lines containing it (see _on_lines)
+MIN_LITERAL = 3
+
+# Documents per worker process below which the processes cost more time
+# than they save
+WORKER_SIZE = 16 << 20
+
+# POSIX character classes used in bracket expressions
+CHARACTER_CLASSES = {
+    'alpha': 'a-zA-Z', 'digit': '0-9', 'alnum': 'a-zA-Z0-9',
+    'upper': 'A-Z', 'lower': 'a-z', 'space': ' \\t\\n\\r\\f\\v',
+    'blank': ' \\t', 'punct': '!-/:-@\\[-`{-~', 'xdigit': '0-9A-Fa-f',
+    'cntrl': '\\x00-\\x1f\\x7f', 'print': ' -~', 'graph': '!-~',
+}
+
+
+class Rule:
+
+    def __init__(self, pattern, replacement, flags):
+        self.pattern = pattern
+        self.replacement = replacement
+        self.is_global = 'g' in flags
+        self.ignore_case = 'I' in flags or 'i' in flags
+
+
+###########################################################################
+# Parsing of the sed script
+###########################################################################
+
+def _split_command(command, delimiter):
+    # Split "pattern<d>replacement<d>flags", honouring escaped delimiters
+    # and escaped newlines in the replacement.
+    parts, current, i = [], '', 0
+    while i < len(command) and len(parts) < 2:
+        c = command[i]
+        if c == '\\' and i + 1 < len(command):
+            if command[i + 1] == delimiter:
+                current += delimiter
+            else:
+                current += command[i:i + 2]
+            i += 2
+        elif c == delimiter:
+            parts.append(current)
+            current = ''
+            i += 1
+        else:
+            current += c
+            i += 1
+    if len(parts) != 2:
+        raise ValueError("unterminated substitution: " + command)
+    parts.append(command[i:].strip())
+    return parts
+
+
+def parse_sed_script(text):
+    # Join the lines continued with a backslash (escaped newline in the
+    # replacement), then parse every "s" command.
+    commands, current = [], ''
+    for line in text.split('\n'):
+        if line.endswith('\\') and not line.endswith('\\\\'):
+            current += line + '\n'
+            continue
+        commands.append(current + line)
+        current = ''
+
+    rules = []
+    for command in commands:
+        command = command.strip(' \t')
+        if not command or command.startswith('#'):
+            continue
+        if command[0] != 's' or len(command) < 2:
+            raise ValueError("only s commands are supported: " + command)
+        pattern, replacement, flags = _split_command(command[2:], command[1])
+        rules.append(Rule(pattern, replacement, flags))
+    return rules
+
+
+def load_rules(path):
+    with open(path) as rules_file:
+        return parse_sed_script(rules_file.read())
+
+
+###########################################################################
+# Translation of basic regular expressions and replacements
+###########################################################################
+
+def _translate_bracket(pattern, i):
+    # pattern[i] is '['; returns the Python class and the index after it
+    j = i + 1
+    negated = j < len(pattern) and pattern[j] == '^'
+    if negated:
+        j += 1
+    out = ''
+    first = True
+    while j < len(pattern):
+        c = pattern[j]
+        if c == ']' and not first:
+            break
+        if pattern.startswith('[:', j):
+            end = pattern.index(':]', j)
+            out += CHARACTER_CLASSES[pattern[j + 2:end]]
+            j = end + 2
+        elif c in '\\[]':
+            out += '\\' + c
+            j += 1
+        else:
+            out += c
+            j += 1
+        first = False
+    # sed works on one line at a time, so a negated class never matches a
+    # newline.
+    if negated:
+        return '[^\\n' + out + ']', j + 1
+    return '[' + out + ']', j + 1
+
+
+def bre_to_python(pattern, group_offset=0):
+    out = ''
+    i = 0
+    at_start = True
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            n = pattern[i + 1]
+            i += 2
+            if n in '(){}|+?':
+                out += n
+                at_start = n in '(|'
+                continue
+            elif n.isdigit():
+                out += '(?:\\%d)' % (int(n) + group_offset)
+            elif n == 'n':
+                out += '\\n'
+            elif n == 't':
+                out += '\\t'
+            else:
+                out += re.escape(n)
+        elif c == '[':
+            bracket, i = _translate_bracket(pattern, i)
+            out += bracket
+        elif c == '*' and at_start:
+            out += '\\*'
+            i += 1
+        elif c in '.*^$':
+            out += c
+            i += 1
+            at_start = c == '^' and at_start
+            continue
+        else:
+            out += re.escape(c)
+            i += 1
+        at_start = False
+    return out
+
+
+def required_literal(pattern):
+    # Returns the longest string of literal characters that every match of
+    # the basic regular expression contains, outside of groups, and whether
+    # the pattern starts with it
+    if '\\|' in pattern:
+        return '', False
+    longest, prefix = '', False
+    run, start, depth = '', 0, 0
+    i = 0
+    while i <= len(pattern):
+        position = i
+        c = pattern[i] if i < len(pattern) else ''
+        literal = None
+        if c == '\\' and i + 1 < len(pattern):
+            n = pattern[i + 1]
+            i += 2
+            if n == '(':
+                depth += 1
+            elif n == ')':
+                depth -= 1
+            elif n in '{?+':
+                # The last character may not be matched
+                run = run[:-1]
+                if n == '{':
+                    i = pattern.index('\\}', i) + 2
+            elif not n.isalnum():
+                literal = n
+        elif c == '[':
+            i = _translate_bracket(pattern, i)[1]
+        elif c == '*' and i > 0:
+            run = run[:-1]
+            i += 1
+        else:
+            if c and c not in '.^$':
+                literal = c
+            i += 1
+        if literal is not None and depth == 0:
+            if not run:
+                start = position
+            run += literal
+        else:
+            if len(run) > len(longest):
+                longest, prefix = run, start == 0
+            run = ''
+    return longest, prefix
+
+
+def sed_to_format(replacement, group_offset=0):
+    # Returns the replacement as a str.format template of the groups of the
+    # match (group n is field n - 1), and whether it refers to any group
+    refers = False
+    out = ''
+    i = 0
+    while i < len(replacement):
+        c = replacement[i]
+        if c == '\\' and i + 1 < len(replacement):
+            n = replacement[i + 1]
+            i += 2
+            if n.isdigit():
+                out += '{%d}' % (int(n) + group_offset - 1)
+                refers = True
+                continue
+            c = {'n': '\n', '\n': '\n', 't': '\t'}.get(n, n)
+        elif c == '&':
+            out += '{%d}' % (group_offset - 1)
+            refers = True
+            i += 1
+            continue
+        else:
+            i += 1
+        out += c.replace('{', '{{').replace('}', '}}')
+    return out, refers
+
+
+###########################################################################
+# Compiled substitution programs
+###########################################################################
+
+def _first_per_line(regex, expand):
+    # Without 'g' sed only replaces the first match of each line.  Matches
+    # on a line that already had one are put back unchanged.
+    def substitute(text):
+        replaced_line = [None]
+
+        def replace(m):
+            line_start = text.rfind('\n', 0, m.start())
+            if line_start == replaced_line[0]:
+                return m.group(0)
+            replaced_line[0] = line_start
+            return expand(m)
+        return regex.sub(replace, text)
+    return substitute
+
+
+def _on_lines(literal, substitute):
+    # Applies substitute only to the lines containing literal: sed matches
+    # within a line, and the search of a string is much faster than the
+    # one of a pattern that does not start with it, such as '.Next'
+    def on_lines(text):
+        out = []
+        end = 0
+        i = text.find(literal)
+        while i >= 0:
+            start = text.rfind('\n', end, i) + 1 or end
+            out.append(text[end:start])
+            end = text.find('\n', i) + 1 or len(text)
+            out.append(substitute(text[start:end]))
+            i = text.find(literal, end)
+        out.append(text[end:])
+        return ''.join(out)
+    return on_lines
+
+
+def compile_rule(rule):
+    # Returns a function applying the substitution to a block of lines.
+    # The pattern is wrapped in a group so that '&' is group 1.
+    flags = re.MULTILINE | (re.IGNORECASE if rule.ignore_case else 0)
+    regex = re.compile('(' + bre_to_python(rule.pattern, 1) + ')', flags)
+    template, refers = sed_to_format(rule.replacement, 1)
+    if refers:
+        # re would expand a template with group references in Python code
+        # for every match: a single str.format call is faster
+        expand = lambda m: template.format(*m.groups(''))
+        replacement = expand
+    else:
+        # A plain string is substituted by re without calling back into
+        # Python, once its backslashes are escaped
+        literal = template.format()
+        expand = lambda m: literal
+        replacement = literal.replace('\\', '\\\\')
+    if not rule.is_global:
+        substitute = _first_per_line(regex, expand)
+    else:
+        substitute = lambda text: regex.sub(replacement, text)
+    required, prefix = required_literal(rule.pattern)
+    if len(required) >= MIN_LITERAL and not prefix and not rule.ignore_case:
+        return _on_lines(required, substitute)
+    return substitute
+
+
+def compile_rules(rules):
+    return [compile_rule(rule) for rule in rules]
+
+
+def apply_program(program, text):
+    for substitute in program:
+        text = substitute(text)
+    return text
+
+
+###########################################################################
+# Streaming pipeline
+###########################################################################
+
+def read_lines(paths, terminate_last=False):
+    # Like sed, every line is newline terminated except the last line of
+    # the last file if it has no newline.  terminate_last is set for the
+    # shards that are followed by other documents.
+    for n, path in enumerate(paths):
+        with open(path, encoding='utf-8', errors='surrogateescape', newline='') as f:
+            for line in f:
+                if not line.endswith('\n') and (terminate_last or n < len(paths) - 1):
+                    line += '\n'
+                yield line
+
+
+def read_blocks(lines, block_size=BLOCK_SIZE):
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield ''.join(block)
+            block, size = [], 0
+    if block:
+        yield ''.join(block)
+
+
+def process(paths, program, output, terminate_last=False):
+    for block in read_blocks(read_lines(paths, terminate_last)):
+        output.write(apply_program(program, block))
+
+
+def _process_shard(task):
+    paths, rules_path, terminate_last, tmp_dir = task
+    program = compile_rules(load_rules(rules_path))
+    fd, tmp_name = tempfile.mkstemp(suffix='.shard', dir=tmp_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as output:
+        process(paths, program, output, terminate_last)
+    return tmp_name
+
+
+def shard(paths, count):
+    size = max(1, -(-len(paths) // count))
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+def build_corpus(paths, output, rules_path=DEFAULT_RULES, workers=1,
+                 tmp_dir=None):
+    size = sum(os.path.getsize(path) for path in paths)
+    workers = min(workers, cpu_count(), -(-size // WORKER_SIZE))
+    if workers <= 1:
+        program = compile_rules(load_rules(rules_path))
+        process(paths, program, output)
+        return
+
+    # Several shards per worker keep the cores busy when some documents
+    # are much longer than others.
+    shards = shard(paths, workers * 4)
+    tasks = [(shard_paths, rules_path, n < len(shards) - 1, tmp_dir)
+             for n, shard_paths in enumerate(shards)]
+    with Pool(workers) as pool:
+        for tmp_name in pool.imap(_process_shard, tasks):
+            if hasattr(output, 'buffer'):
+                # A file is copied without decoding and encoding it again
+                output.flush()
+                with open(tmp_name, 'rb') as f:
+                    shutil.copyfileobj(f, output.buffer)
+            else:
+                with open(tmp_name, encoding='utf-8', errors='surrogateescape',
+                          newline='') as f:
+                    shutil.copyfileobj(f, output)
+            os.remove(tmp_name)
+
+
+###########################################################################
+# Content-defined shards
+###########################################################################
+
+class ShardWriter:
+    # Output of build_corpus writing the corpus as shards instead of one
+    # file.  A line ends a shard when the CRC-32 of the line, as a fraction
+    # of 2**32, is below len(line) / shard_size, so shards hold shard_size
+    # bytes on average; shards are at least a quarter and at most four
+    # times that size.  The cuts only depend on the lines, so an edit of
+    # the documents changes the shard holding it, and the next shards are
+    # cut as before.  Every shard is named after the SHA-256 of its
+    # content, and manifest.json lists them in the order of the corpus.
+
+    def __init__(self, directory, prefix='corpus', shard_size=SHARD_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.lines = []
+        self.size = 0
+        self.partial = ''
+        self.shards = []
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._add_line(line + '\n')
+
+    def _add_line(self, line):
+        data = line.encode('utf-8', 'surrogateescape')
+        self.lines.append(data)
+        self.size += len(data)
+        if self.size < self.shard_size // 4:
+            return
+        if (zlib.crc32(data) < len(data) * (1 << 32) // self.shard_size
+                or self.size >= self.shard_size * 4):
+            self._cut()
+
+    def _cut(self):
+        if not self.lines:
+            return
+        data = b''.join(self.lines)
+        sha256 = hashlib.sha256(data).hexdigest()
+        name = '%s-%s.txt' % (self.prefix, sha256[:16])
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self.written += 1
+        self.shards.append({'name': name, 'sha256': sha256, 'bytes': len(data),
+                            'lines': len(self.lines)})
+        self.lines, self.size = [], 0
+
+    def close(self):
+        if self.partial:
+            # The last line keeps its missing newline, as with sed
+            self._add_line(self.partial)
+            self.partial = ''
+        self._cut()
+        manifest = {'prefix': self.prefix, 'shard_size': self.shard_size,
+                    'shards': self.shards}
+        path = os.path.join(self.directory, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + '.tmp', path)
+        # Shards of previous builds are no longer needed
+        names = set(shard['name'] for shard in self.shards)
+        for path in glob.glob(os.path.join(self.directory, self.prefix + '-*.txt')):
+            if os.path.basename(path) not in names:
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def expand_inputs(inputs):
+    paths = []
+    for name in inputs:
+        if os.path.isdir(name):
+            paths.extend(sorted(glob.glob(os.path.join(name, '*.txt'))))
+        elif glob.has_magic(name):
+            paths.extend(sorted(glob.glob(name)))
+        else:
+            paths.append(name)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a corpus file from text documents")
+    parser.add_argument('inputs', nargs='+',
+                        help="text files, glob patterns or directories")
+    parser.add_argument('-o', '--output', default='-',
+                        help="corpus file to write (default: standard output)")
+    parser.add_argument('--rules', default=DEFAULT_RULES,
+                        help="sed script with the substitutions (default: fixup.sed)")
+    parser.add_argument('--workers', type=int, default=cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument('--shard-dir',
+                        help="write the corpus as content-defined shards in this directory")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE,
+                        help="average size of the shards in bytes")
+    parser.add_argument('--shard-prefix', default='corpus',
+                        help="prefix of the names of the shards")
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if args.shard_dir:
+        with ShardWriter(args.shard_dir, args.shard_prefix, args.shard_size) as output:
+            build_corpus(paths, output, args.rules, args.workers, args.shard_dir)
+        print("%d shards, %d new, %d bytes in %s"
+              % (len(output.shards), output.written,
+                 sum(shard['bytes'] for shard in output.shards), args.shard_dir))
+        return 0
+    if args.output == '-':
+        output = open(sys.stdout.fileno(), 'w', encoding='utf-8',
+                      errors='surrogateescape', newline='', closefd=False)
+        tmp_dir = None
+    else:
+        output = open(args.output, 'w', encoding='utf-8',
+                      errors='surrogateescape', newline='')
+        tmp_dir = os.path.dirname(os.path.abspath(args.output))
+    with output:
+        build_corpus(paths, output, args.rules, args.workers, tmp_dir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
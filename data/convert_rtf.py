@@ -1,16 +1,104 @@
 ###########################################################################
 # Simple program to convert .rtf text files in the Documents directory to
 # plain text format.
+#
+# The files are converted by a pool of worker processes.  Text files that
+# are newer than their .rtf source are skipped, so an interrupted run can
+# simply be restarted.  A file that fails to convert is reported and does
+# not stop the others.
+#
+# Usage: python convert_rtf.py [input_dir] [output_dir] [--workers N] [--force]
 ###########################################################################
 
-import glob
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
 from striprtf.striprtf import rtf_to_text
 
+
+def rtf_files(input_dir):
+    for entry in os.scandir(input_dir):
+        if entry.is_file() and entry.name.lower().endswith('.rtf'):
+            yield entry
+
+
+def is_up_to_date(rtf_entry, txt_name):
+    try:
+        return os.path.getmtime(txt_name) >= rtf_entry.stat().st_mtime
+    except OSError:
+        return False
+
+
+def convert(task):
+    rtf_name, txt_name = task
+    # Write to a temporary file first so that an interrupted run never
+    # leaves a truncated text file that looks up to date.
+    tmp_name = txt_name + '.tmp'
+    try:
+        with open(rtf_name) as rtf_file:
+            content_txt = rtf_to_text(rtf_file.read())
+        with open(tmp_name, 'w') as txt_file:
+            txt_file.write(content_txt)
+        os.replace(tmp_name, txt_name)
+        return rtf_name, os.path.getsize(rtf_name), None
+    except Exception as e:
+        # A failed write leaves no partial file behind
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        return rtf_name, 0, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .rtf files to plain text")
+    parser.add_argument('input_dir', nargs='?', default='Documents',
+                        help="directory containing the .rtf files")
+    parser.add_argument('output_dir', nargs='?',
+                        help="directory for the .txt files (default: input_dir)")
+    parser.add_argument('--workers', type=int, default=cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument('--force', action='store_true',
+                        help="convert files even if the text file is up to date")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or args.input_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    skipped = [0]
+
+    def tasks():
+        for entry in rtf_files(args.input_dir):
+            txt_name = os.path.join(output_dir, entry.name[:-len('.rtf')] + '.txt')
+            if not args.force and is_up_to_date(entry, txt_name):
+                skipped[0] += 1
+                continue
+            yield entry.path, txt_name
+
+    converted = failed = total_bytes = 0
+    start = last_report = time.time()
+    with Pool(args.workers) as pool:
+        for rtf_name, size, error in pool.imap_unordered(convert, tasks(), chunksize=16):
+            if error:
+                failed += 1
+                print("Failed to convert %s: %s" % (rtf_name, error))
+            else:
+                converted += 1
+                total_bytes += size
+            if time.time() - last_report >= 5:
+                last_report = time.time()
+                print("%d converted, %d failed (%.0f files/s)"
+                      % (converted, failed, converted / (last_report - start)))
+
+    elapsed = max(time.time() - start, 1e-6)
+    print("Converted %d files, skipped %d up to date, %d failed in %.1fs"
+          % (converted, skipped[0], failed, elapsed))
+    print("Throughput: %.1f files/s, %.2f MB/s"
+          % (converted / elapsed, total_bytes / elapsed / 1e6))
+    return 1 if failed else 0
+
+
 if __name__ == '__main__':
-    rtf_files = glob.glob('Documents/*.rtf')
-    for rtf_name in rtf_files:
-        txt_name = rtf_name.replace('.rtf','.txt')
-        txt_file = open(txt_name, "x")
-        content_txt = rtf_to_text(open(rtf_name).read())
-        txt_file.write(content_txt)
-        txt_file.close()
+    sys.exit(main())
@@ -0,0 +1,277 @@
+###########################################################################
+# Remove duplicate sentences from a corpus and index its vocabulary.
+#
+#   python corpus_index.py build corpus-1.txt -o corpus-1.dedup.txt -i corpus-1.idx
+#   python corpus_index.py stats corpus-1.idx
+#   python corpus_index.py diff corpus-2.idx corpus-1.idx
+#
+# Every line of the corpus is a sentence.  Sentences are normalized (case,
+# punctuation and spacing) and hashed: a sentence whose hash was already
+# seen is an exact duplicate.  Near duplicates, such as templated phrases
+# differing by a word or two, are found with MinHash signatures of the
+# word trigrams and locality sensitive hashing: the signature is cut in
+# bands, and a sentence sharing a band with an earlier one is dropped if
+# the estimated similarity is above the threshold.
+#
+# The hashes of the kept sentences, the band buckets and the vocabulary
+# counts are kept in an SQLite index file rather than in memory, so
+# corpora larger than the memory can be processed.  The index is kept
+# after the run so that a new corpus can be compared with the ones
+# already uploaded before sending it.  build refuses an existing index,
+# unless --append is given to add another corpus to it.
+###########################################################################
+
+import argparse
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import struct
+import sys
+from collections import Counter
+
+NUM_PERMUTATIONS = 32
+BANDS = 8
+SHINGLE_SIZE = 3
+BATCH_SIZE = 10000
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS sentences (hash INTEGER PRIMARY KEY, count INTEGER);
+CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket INTEGER, hash INTEGER,
+                                    PRIMARY KEY (band, bucket)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS signatures (hash INTEGER PRIMARY KEY, signature BLOB);
+CREATE TABLE IF NOT EXISTS vocabulary (word TEXT PRIMARY KEY, count INTEGER) WITHOUT ROWID;
+"""
+
+
+def tokenize(sentence):
+    return TOKEN_RE.findall(sentence.lower())
+
+
+def _hash64(text):
+    # Signed, to fit in an SQLite integer
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return struct.unpack('<q', digest)[0]
+
+
+# For every bin, the order in which the other bins are tried when it is empty
+PROBES = [random.Random(n).sample(range(NUM_PERMUTATIONS), NUM_PERMUTATIONS)
+          for n in range(NUM_PERMUTATIONS)]
+
+
+def minhash(tokens):
+    # One permutation hashing: every shingle is hashed once and falls in
+    # one of NUM_PERMUTATIONS bins, which keep their smallest value.
+    # Empty bins borrow the value of the first non-empty bin in a fixed
+    # random order (optimal densification), so that short sentences still
+    # get full signatures.
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = {' '.join(tokens)}
+    else:
+        shingles = set(' '.join(tokens[i:i + SHINGLE_SIZE])
+                       for i in range(len(tokens) - SHINGLE_SIZE + 1))
+    bins = [None] * NUM_PERMUTATIONS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(),
+                           'little')
+        n, value = h % NUM_PERMUTATIONS, (h >> 32) & 0xffffff
+        if bins[n] is None or value < bins[n]:
+            bins[n] = value
+    signature = list(bins)
+    for n in range(NUM_PERMUTATIONS):
+        if signature[n] is None:
+            signature[n] = next(bins[j] for j in PROBES[n] if bins[j] is not None)
+    return signature
+
+
+def band_buckets(signature):
+    rows = NUM_PERMUTATIONS // BANDS
+    return [(band, _hash64(','.join(map(str, signature[band * rows:(band + 1) * rows]))))
+            for band in range(BANDS)]
+
+
+def similarity(signature, other):
+    return sum(1 for x, y in zip(signature, other) if x == y) / float(NUM_PERMUTATIONS)
+
+
+class CorpusIndex:
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        # The index can be rebuilt from the corpus, so favour speed over
+        # durability.
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def add_meta(self, key, value):
+        self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                        "ON CONFLICT (key) DO UPDATE SET value = value + excluded.value",
+                        (key, value))
+
+    def add_duplicate(self, sentence_hash):
+        # True if the sentence is in the index already, counting it again
+        cursor = self.db.execute("UPDATE sentences SET count = count + 1 WHERE hash = ?",
+                                 (sentence_hash,))
+        return cursor.rowcount > 0
+
+    def add_sentence(self, sentence_hash):
+        self.db.execute("INSERT OR IGNORE INTO sentences (hash, count) VALUES (?, 1)",
+                        (sentence_hash,))
+
+    def find_near_duplicate(self, signature, buckets, threshold):
+        for band, bucket in buckets:
+            row = self.db.execute("SELECT s.signature FROM buckets b JOIN signatures s "
+                                  "ON s.hash = b.hash WHERE b.band = ? AND b.bucket = ?",
+                                  (band, bucket)).fetchone()
+            if row and similarity(signature, struct.unpack('<%dI' % NUM_PERMUTATIONS,
+                                                           row[0])) >= threshold:
+                return True
+        return False
+
+    def add_signature(self, sentence_hash, signature, buckets):
+        self.db.execute("INSERT OR IGNORE INTO signatures (hash, signature) VALUES (?, ?)",
+                        (sentence_hash, struct.pack('<%dI' % NUM_PERMUTATIONS, *signature)))
+        self.db.executemany("INSERT OR IGNORE INTO buckets (band, bucket, hash) VALUES (?, ?, ?)",
+                            [(band, bucket, sentence_hash) for band, bucket in buckets])
+
+    def add_words(self, counts):
+        self.db.executemany("INSERT INTO vocabulary (word, count) VALUES (?, ?) "
+                            "ON CONFLICT (word) DO UPDATE SET count = count + excluded.count",
+                            counts.items())
+
+
+def deduplicate(lines, index, threshold=0.75, near=True):
+    # Yields the sentences to keep, updating the index on the way
+    words = Counter()
+    stats = Counter()
+    for line in lines:
+        tokens = tokenize(line)
+        stats['sentences'] += 1
+        if not tokens:
+            continue
+        sentence_hash = _hash64(' '.join(tokens))
+        if index.add_duplicate(sentence_hash):
+            stats['exact_duplicates'] += 1
+            continue
+        if near and len(tokens) >= SHINGLE_SIZE:
+            signature = minhash(tokens)
+            buckets = band_buckets(signature)
+            if index.find_near_duplicate(signature, buckets, threshold):
+                stats['near_duplicates'] += 1
+                continue
+            index.add_signature(sentence_hash, signature, buckets)
+        # Only the kept sentences are in the index, so that a diff does not
+        # count the dropped ones
+        index.add_sentence(sentence_hash)
+        stats['kept'] += 1
+        stats['tokens'] += len(tokens)
+        words.update(tokens)
+        yield line
+        if stats['kept'] % BATCH_SIZE == 0:
+            index.add_words(words)
+            words.clear()
+            index.db.commit()
+    index.add_words(words)
+    for key, value in stats.items():
+        index.add_meta(key, value)
+    index.db.commit()
+
+
+def print_stats(index):
+    print("Sentences:        %d" % index.get_meta('sentences'))
+    print("Exact duplicates: %d" % index.get_meta('exact_duplicates'))
+    print("Near duplicates:  %d" % index.get_meta('near_duplicates'))
+    print("Kept:             %d" % index.get_meta('kept'))
+    print("Tokens:           %d" % index.get_meta('tokens'))
+    vocabulary = index.db.execute("SELECT COUNT(*) FROM vocabulary").fetchone()[0]
+    print("Vocabulary:       %d words" % vocabulary)
+
+
+def print_diff(index, others, top):
+    # Words and sentences of the index that none of the others contain
+    for n, other in enumerate(others):
+        index.db.execute("ATTACH DATABASE ? AS other%d" % n, (other,))
+    words = ' AND '.join("v.word NOT IN (SELECT word FROM other%d.vocabulary)" % n
+                         for n in range(len(others)))
+    sentences = ' AND '.join("s.hash NOT IN (SELECT hash FROM other%d.sentences)" % n
+                             for n in range(len(others)))
+
+    new_sentences = index.db.execute("SELECT COUNT(*) FROM sentences s WHERE " +
+                                     sentences).fetchone()[0]
+    total_sentences = index.db.execute("SELECT COUNT(*) FROM sentences").fetchone()[0]
+    new_words = index.db.execute("SELECT v.word, v.count FROM vocabulary v WHERE " + words +
+                                 " ORDER BY v.count DESC").fetchall()
+    print("New sentences: %d of %d" % (new_sentences, total_sentences))
+    print("New words:     %d (%d occurrences)"
+          % (len(new_words), sum(count for _, count in new_words)))
+    for word, count in new_words[:top]:
+        print("  %8d  %s" % (count, word))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate and index a corpus")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="deduplicate a corpus and index it")
+    build.add_argument('corpus', help="corpus file, one sentence per line")
+    build.add_argument('-o', '--output', required=True, help="deduplicated corpus file")
+    build.add_argument('-i', '--index', required=True, help="index file to create")
+    build.add_argument('--append', action='store_true',
+                       help="add the corpus to an existing index, dropping the sentences "
+                       "it already holds")
+    build.add_argument('--threshold', type=float, default=0.75,
+                       help="similarity above which sentences are near duplicates")
+    build.add_argument('--exact-only', action='store_true',
+                       help="only remove exact duplicates")
+
+    stats = commands.add_parser('stats', help="print the statistics of an index")
+    stats.add_argument('index')
+
+    diff = commands.add_parser('diff', help="compare an index with other indexes")
+    diff.add_argument('index', help="index of the new corpus")
+    diff.add_argument('others', nargs='+', help="indexes of the corpora already uploaded")
+    diff.add_argument('--top', type=int, default=50, help="number of new words to list")
+    args = parser.parse_args()
+
+    # SQLite would create an empty database for a missing file, in which
+    # every sentence and word of the other index looks new
+    if args.command != 'build':
+        for path in [args.index] + (args.others if args.command == 'diff' else []):
+            if not os.path.exists(path):
+                parser.error("no index %s" % path)
+    # Building a corpus again into its own index would drop every sentence
+    # as a duplicate
+    elif os.path.exists(args.index) and not args.append:
+        parser.error("index %s exists, use --append to add the corpus to it" % args.index)
+
+    index = CorpusIndex(args.index)
+    try:
+        if args.command == 'build':
+            with open(args.corpus, encoding='utf-8', errors='surrogateescape') as corpus, \
+                 open(args.output, 'w', encoding='utf-8', errors='surrogateescape') as output:
+                output.writelines(deduplicate(corpus, index, args.threshold,
+                                              not args.exact_only))
+            print_stats(index)
+        elif args.command == 'stats':
+            print_stats(index)
+        else:
+            print_diff(index, args.others, args.top)
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())